@@ -1,22 +1,47 @@
 # client/controllers/auth_controller_client.py
 import socket
 import json
+import sqlite3
+import random
 import threading
 import time
 import struct
-from config.config import SERVER_CONFIG
+from collections import OrderedDict
+from config.config import SERVER_CONFIG, HEARTBEAT_CONFIG, RECONNECT_CONFIG, CLIENT_STORE_CONFIG
+from client.controllers.message_store import MessageStore
 from queue import Queue
 
 
 class AuthController:
-    def __init__(self, socket, host=SERVER_CONFIG["host"], port=SERVER_CONFIG["port"]):
+    """Kết nối duy nhất của client tới server, dùng chung cho đăng ký, đăng nhập và màn hình chat.
+
+    Tạo lúc mở app và kết nối ngay trong thread nhận, nên thời gian kết nối trùng với lúc
+    người dùng gõ form đăng nhập; socket=None thì tự kết nối.
+    """
+
+    def __init__(self, socket=None, host=SERVER_CONFIG["host"], port=SERVER_CONFIG["port"],
+                 store_directory=CLIENT_STORE_CONFIG["directory"]):
         self.host = host
         self.port = port
+        self.store_directory = store_directory  # None: không lưu tin cục bộ (load test)
+        self.store = None  # MessageStore của user đang đăng nhập
         self.client_socket = socket
+        self.connected = threading.Event()  # Có socket dùng được; send_request chờ trên cờ này
+        if socket is not None:
+            self.connected.set()
         self.current_user_id = None
-        self.reconnect_attempts = 3
+        self.session_token = None  # Server cấp khi đăng nhập, dùng để resume_session
+        # Id tin cuối đã nhận (1-1, nhóm): resume_session chỉ nhận lại phần bị lỡ
+        self.last_message_id = None
+        self.last_group_message_id = None
+        self.seen_messages = OrderedDict()  # (loại, id) tin vừa nhận, bỏ bản trùng khi bắt kịp
+        self.retry_after = 0  # Server yêu cầu chờ thêm trước lần kết nối lại tới
+        self.reconnect_lock = threading.Lock()
         self.message_queue = Queue()
+        self.event_queue = Queue()
         self.response_queue = Queue()
+        self.send_lock = threading.Lock()  # Pong gửi từ thread nhận, không xen vào giữa request khác
+        self.last_server_activity = time.monotonic()
         self.running = True
         threading.Thread(target=self._receive_loop, daemon=True).start()
 
@@ -31,17 +56,47 @@ class AuthController:
         return total_sent
 
     def _recv_all(self, sock, length):
-        """Nhận đủ số bytes cần thiết"""
+        """Nhận đủ số bytes cần thiết; timeout chỉ là lỗi khi server im lặng quá stall_timeout"""
         data = b''
         while len(data) < length:
-            chunk = sock.recv(min(length - len(data), 10485760))  # 10MB chunks
+            try:
+                chunk = sock.recv(min(length - len(data), 10485760))  # 10MB chunks
+            except socket.timeout:
+                if time.monotonic() - self.last_server_activity > HEARTBEAT_CONFIG["stall_timeout"]:
+                    raise
+                continue
             if not chunk:
                 raise socket.error("Socket connection broken")
+            self.last_server_activity = time.monotonic()
             data += chunk
         return data
 
+    def connect(self):
+        """Kết nối lần đầu; lỗi thì để reconnect thử lại theo backoff"""
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=10)
+        except socket.error as e:
+            print(f"Không thể kết nối tới server: {str(e)}")
+            return self.reconnect()
+        try:
+            self._hello(sock)
+        except socket.error:
+            sock.close()
+            return self.reconnect()
+        self.last_server_activity = time.monotonic()
+        self.client_socket = sock
+        self.connected.set()
+        return True
+
+    def _hello(self, sock):
+        """Báo server client đã có thread nhận, ping được ngay cả trước khi đăng nhập"""
+        data = json.dumps({"action": "hello"}).encode('utf-8')
+        self._send_all(sock, struct.pack('>I', len(data)) + data)
+
     def _receive_loop(self):
         """Thread riêng để nhận tất cả dữ liệu từ server"""
+        if self.client_socket is None and not self.connect():
+            return
         while self.running:
             try:
                 if self.client_socket and self.client_socket.fileno() != -1:
@@ -61,58 +116,145 @@ class AuthController:
                     response = json.loads(message)
 
                     # Phân loại message
-                    if response.get("action") == "message":
+                    if response.get("action") == "ping":
+                        # Trả lời ngay để server đo RTT và biết client còn sống
+                        self.send_event({"action": "pong", "ts": response.get("ts")})
+                    elif response.get("action") == "server_shutdown":
+                        # Server sắp đóng kết nối: lần kết nối lại chờ ít nhất retry_after
+                        self.retry_after = response.get("retry_after", 0)
+                    elif response.get("action") == "message":
                         # Tin nhắn chat từ người khác
-                        self.message_queue.put(response)
+                        if self._track_message(response):
+                            self._store_incoming(response)
+                            self.message_queue.put(response)
+                    elif "action" in response:
+                        # Sự kiện server tự đẩy xuống (phòng thoại, ...)
+                        self.event_queue.put(response)
                     else:
                         # Response từ request
                         self.response_queue.put(response)
                 else:
                     if not self.reconnect():
                         break
-                    time.sleep(0.5)
             except (socket.error, json.JSONDecodeError) as e:
+                if not self.running:
+                    break
                 print(f"Lỗi nhận dữ liệu: {str(e)}")
+                self.connected.clear()
+                self.client_socket.close()
                 if not self.reconnect():
                     break
-                time.sleep(0.5)
             except Exception as e:
                 print(f"Lỗi không xác định trong _receive_loop: {str(e)}")
                 break
 
-    def reconnect(self):
-        """Thử kết nối lại với server"""
-        for _ in range(self.reconnect_attempts):
-            try:
-                self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self.client_socket.connect((self.host, self.port))
-                print("Kết nối lại thành công")
-                # Gửi resume session nếu đã có user_id
+    def _track_message(self, message):
+        """Cập nhật mốc tin cuối đã nhận; False nếu là bản trùng (vừa nhận trước đó)"""
+        message_id = message.get("message_id")
+        if message_id is None:
+            return True
+        key = ("group" if "group_id" in message else "user", message_id)
+        if key in self.seen_messages:
+            return False
+        self.seen_messages[key] = True
+        if len(self.seen_messages) > 1000:
+            self.seen_messages.popitem(last=False)
+        if key[0] == "group":
+            self.last_group_message_id = max(self.last_group_message_id or 0, message_id)
+        else:
+            self.last_message_id = max(self.last_message_id or 0, message_id)
+        return True
+
+    def _store_incoming(self, message):
+        store = self.store
+        if store is None:
+            return
+        try:
+            store.add_incoming(message, self.current_user_id)
+        except sqlite3.Error as e:
+            # Vừa đăng xuất (store đã đóng) hoặc lỗi đĩa: lần mở hội thoại sau lấy bù từ server
+            print(f"Không thể lưu tin nhắn cục bộ: {str(e)}")
+
+    def _resume(self, sock):
+        """Gửi resume_session kèm mốc tin cuối, trả về phản hồi của server"""
+        request = {"action": "resume_session", "token": self.session_token}
+        if self.last_message_id is not None and self.last_group_message_id is not None:
+            request["last_message_id"] = self.last_message_id
+            request["last_group_message_id"] = self.last_group_message_id
+        data = json.dumps(request).encode('utf-8')
+        self._send_all(sock, struct.pack('>I', len(data)) + data)
+        # Phản hồi là frame đầu tiên; tin bị lỡ tới sau, do _receive_loop đọc
+        length_data = self._recv_all(sock, 4)
+        resp_length = struct.unpack('>I', length_data)[0]
+        return json.loads(self._recv_all(sock, resp_length).decode('utf-8'))
+
+    def reconnect(self, max_attempts=None, blocking=True):
+        """Kết nối lại với server, mặc định thử tới khi được hoặc controller dừng.
+
+        Lần thử thứ n chờ ngẫu nhiên trong [0, base_delay * 2^n] (full jitter) để các client
+        không cùng lúc dồn vào server vừa khởi động lại; server trả retry_after thì chờ thêm.
+        """
+        if not self.reconnect_lock.acquire(blocking):
+            return False  # Thread khác đang kết nối lại
+        try:
+            if self.client_socket and self.client_socket.fileno() != -1:
+                return True  # Thread khác vừa kết nối lại xong
+            attempt = 0
+            while self.running and (max_attempts is None or attempt < max_attempts):
+                cap = min(RECONNECT_CONFIG["max_delay"], RECONNECT_CONFIG["base_delay"] * 2 ** attempt)
+                time.sleep(self.retry_after + random.uniform(0, cap))
+                self.retry_after = 0
+                attempt += 1
                 try:
-                    if self.current_user_id is not None:
-                        resume_req = {"action": "resume_session", "user_id": self.current_user_id}
-                        data = json.dumps(resume_req).encode('utf-8')
-                        # Gửi với length prefix
-                        length = struct.pack('>I', len(data))
-                        self._send_all(self.client_socket, length + data)
-                        # Nhận phản hồi (nhỏ)
-                        length_data = self._recv_all(self.client_socket, 4)
-                        resp_length = struct.unpack('>I', length_data)[0]
-                        resp_data = self._recv_all(self.client_socket, resp_length)
-                        _ = json.loads(resp_data.decode('utf-8'))
-                except Exception:
-                    pass
+                    sock = socket.create_connection((self.host, self.port), timeout=10)
+                except socket.error as e:
+                    print(f"Thử kết nối lại ({attempt}): {str(e)}")
+                    continue
+                self.last_server_activity = time.monotonic()
+                if self.session_token is not None:
+                    try:
+                        response = self._resume(sock)
+                    except (socket.error, ValueError) as e:
+                        print(f"Khôi phục phiên thất bại ({attempt}): {str(e)}")
+                        sock.close()
+                        continue
+                    if "retry_after" in response:
+                        # Server quá tải: chờ theo yêu cầu rồi thử lại
+                        self.retry_after = response["retry_after"]
+                        sock.close()
+                        continue
+                    if response.get("status") != "success":
+                        # Token hết hạn hoặc server đổi khóa: kết nối dùng được nhưng phải đăng nhập lại.
+                        # Phần còn lại (bản lưu, hàng đợi) dọn trên thread giao diện khi MainView đăng xuất
+                        self.session_token = None
+                        self.current_user_id = None
+                        self.event_queue.put({
+                            "action": "session_expired",
+                            "message": response.get("message", "Phiên đăng nhập đã hết hạn")
+                        })
+                        self.client_socket = sock
+                        self.connected.set()
+                        print("Đã kết nối lại nhưng phiên đăng nhập hết hạn, cần đăng nhập lại")
+                        return True
+                else:
+                    try:
+                        self._hello(sock)
+                    except socket.error:
+                        sock.close()
+                        continue
+                self.client_socket = sock
+                self.connected.set()
+                print("Kết nối lại thành công")
                 return True
-            except socket.error as e:
-                print(f"Thử kết nối lại: {str(e)}")
-                time.sleep(1)
-        return False
+            return False
+        finally:
+            self.reconnect_lock.release()
 
     def send_request(self, request, timeout=10):
         """Gửi request và đợi response"""
-        if not self.client_socket or self.client_socket.fileno() == -1:
-            if not self.reconnect():
-                raise Exception("Không thể kết nối lại với server")
+        # Thread nhận tự kết nối (lại); chỉ chờ, không chạy vòng backoff trên thread gọi
+        if not self.connected.wait(timeout):
+            raise Exception("Không thể kết nối với server")
 
         try:
             # Xóa queue cũ
@@ -122,7 +264,8 @@ class AuthController:
             # Gửi request với length prefix
             data = json.dumps(request).encode('utf-8')
             length = struct.pack('>I', len(data))
-            self._send_all(self.client_socket, length + data)
+            with self.send_lock:
+                self._send_all(self.client_socket, length + data)
 
             # Đợi response từ queue
             try:
@@ -134,11 +277,69 @@ class AuthController:
         except socket.error as e:
             raise Exception(f"Lỗi gửi request: {str(e)}")
 
+    def send_event(self, request):
+        """Gửi sự kiện không cần phản hồi (server không trả lời)"""
+        if not self.client_socket or self.client_socket.fileno() == -1:
+            return False
+        try:
+            data = json.dumps(request).encode('utf-8')
+            with self.send_lock:
+                self._send_all(self.client_socket, struct.pack('>I', len(data)) + data)
+            return True
+        except socket.error:
+            return False
+
+    # === Phiên đăng nhập ===
+    def start_session(self, response):
+        """Lưu thông tin phiên từ phản hồi login thành công"""
+        self.current_user_id = response["user_id"]
+        self.session_token = response.get("session_token")
+        self.last_message_id = response.get("last_message_id")
+        self.last_group_message_id = response.get("last_group_message_id")
+        if self.store_directory is not None:
+            self.store = MessageStore(self.current_user_id, self.store_directory)
+
+    def register(self, display_name, email, password):
+        request = {"action": "register", "display_name": display_name, "email": email, "password": password}
+        return self.send_request(request)
+
+    def login(self, email, password):
+        response = self.send_request({"action": "login", "email": email, "password": password})
+        if response.get("status") == "success":
+            self.start_session(response)
+        return response
+
+    def logout(self):
+        """Đăng xuất nhưng giữ kết nối cho lần đăng nhập sau"""
+        try:
+            self.send_request({"action": "logout"})
+        except Exception as e:
+            print(f"Lỗi đăng xuất: {str(e)}")
+        self.current_user_id = None
+        self.session_token = None
+        self.last_message_id = None
+        self.last_group_message_id = None
+        self.seen_messages.clear()
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+        for q in (self.message_queue, self.event_queue):
+            while not q.empty():
+                q.get_nowait()
+
+    def send_typing(self, receiver_id, typing=True):
+        return self.send_event({"action": "typing", "receiver_id": receiver_id, "typing": typing})
+
     def get_users(self):
         """Lấy danh sách users"""
         request = {"action": "get_users"}
         return self.send_request(request).get("users", [])
 
+    def get_user(self, user_id):
+        """1 user trong danh bạ; None nếu không tìm thấy"""
+        request = {"action": "get_user", "user_id": user_id}
+        return self.send_request(request).get("user")
+
     def send_message(self, receiver_id, message):
         """Gửi tin nhắn"""
         request = {"action": "message", "receiver_id": receiver_id, "message": message}
@@ -176,12 +377,55 @@ class AuthController:
 
 
 
-    def get_chat_history(self, receiver_id):
-        """Lấy lịch sử chat"""
+    def get_chat_history(self, receiver_id, before_id=None, limit=None, after_id=None):
+        """Lấy lịch sử chat; có limit thì lấy limit tin mới nhất trước before_id, after_id chỉ lấy tin mới hơn"""
         request = {"action": "get_chat_history", "receiver_id": receiver_id}
+        if before_id is not None:
+            request["before_id"] = before_id
+        if limit is not None:
+            request["limit"] = limit
+        if after_id is not None:
+            request["after_id"] = after_id
         response = self.send_request(request)
         return response.get("history", [])
 
+    def _server_history(self, conv_key, **paging):
+        if conv_key[0] == "group":
+            return self.get_group_history(conv_key[1], **paging)
+        return self.get_chat_history(conv_key[1], **paging)
+
+    def cached_history(self, conv_key, limit=CLIENT_STORE_CONFIG["page_size"]):
+        """Trang tin mới nhất đã lưu cục bộ của hội thoại ("user"|"group", id), hiển thị ngay không chờ server"""
+        if self.store is None:
+            return []
+        sync_range = self.store.sync_range(conv_key)
+        return self.store.history(conv_key, limit=limit, min_id=sync_range[0] if sync_range else None)
+
+    def sync_history(self, conv_key, limit=CLIENT_STORE_CONFIG["page_size"]):
+        """Lấy tối đa limit tin mới nhất sau mốc đã đồng bộ, lưu lại; trả về các tin chưa có trong bản lưu"""
+        after_id = self.store.synced_id(conv_key) if self.store is not None else None
+        history = self._server_history(conv_key, after_id=after_id, limit=limit)
+        if self.store is None:
+            return history
+        # Đủ limit tin: có thể còn tin chưa lấy giữa mốc cũ và trang này
+        floor_id = history[0]["id"] if len(history) >= limit else None
+        return self.store.sync(conv_key, history, floor_id)
+
+    def older_history(self, conv_key, before_id, limit=CLIENT_STORE_CONFIG["page_size"]):
+        """limit tin ngay trước before_id (cuộn lên đầu khung chat): đọc bản lưu trong đoạn đã đồng bộ,
+        thiếu thì lấy tiếp từ server. Ít hơn limit tin nghĩa là đã tới tin đầu tiên."""
+        sync_range = self.store.sync_range(conv_key) if self.store is not None else None
+        if sync_range is None or before_id < sync_range[0]:
+            # Ngoài đoạn liền mạch của bản lưu: lấy thẳng từ server, không lưu
+            return self._server_history(conv_key, before_id=before_id, limit=limit)
+        floor_id = sync_range[0]
+        page = self.store.history(conv_key, before_id=before_id, limit=limit, min_id=floor_id)
+        if len(page) >= limit or floor_id == 0:
+            return page
+        older = self._server_history(conv_key, before_id=floor_id, limit=limit - len(page))
+        self.store.add_older(conv_key, older, complete=len(older) < limit - len(page))
+        return older + page
+
     # === Profile APIs ===
     def get_profile(self):
         request = {"action": "get_profile"}
@@ -203,6 +447,93 @@ class AuthController:
         }
         return self.send_request(request)
 
+    # === Read marker APIs ===
+    def mark_read(self, peer_id=None, group_id=None, last_read_id=None):
+        """Gửi marker đã đọc không chờ phản hồi (server không trả lời request quiet)"""
+        request = {"action": "mark_read", "quiet": True}
+        if group_id is not None:
+            request["group_id"] = group_id
+        else:
+            request["peer_id"] = peer_id
+        if last_read_id is not None:
+            request["last_read_id"] = last_read_id
+        return self.send_event(request)
+
+    def get_unread_counts(self):
+        request = {"action": "get_unread_counts"}
+        return self.send_request(request).get("unread", [])
+
+    # === Group APIs ===
+    def create_group(self, name, member_ids):
+        request = {"action": "create_group", "name": name, "member_ids": member_ids}
+        return self.send_request(request)
+
+    def get_groups(self):
+        request = {"action": "get_groups"}
+        return self.send_request(request).get("groups", [])
+
+    def get_group_history(self, group_id, after_id=None, before_id=None, limit=None):
+        request = {"action": "get_group_history", "group_id": group_id}
+        if after_id is not None:
+            request["after_id"] = after_id
+        if before_id is not None:
+            request["before_id"] = before_id
+        if limit is not None:
+            request["limit"] = limit
+        return self.send_request(request).get("history", [])
+
+    def send_group_message(self, group_id, kind, data, filename=None):
+        """kind: text/image/voice/video; data là nội dung text hoặc base64 của media"""
+        request = {"action": "send_group_message", "group_id": group_id, "kind": kind}
+        if kind == "text":
+            request["message"] = data
+        else:
+            request[f"{kind}_data"] = data
+            request["filename"] = filename
+        timeout = 300 if kind == "video" else 30 if kind != "text" else 10
+        return self.send_request(request, timeout=timeout)
+
+    # === Voice room APIs ===
+    def join_voice_room(self, room):
+        request = {"action": "join_voice_room", "room": room}
+        return self.send_request(request)
+
+    def leave_voice_room(self):
+        request = {"action": "leave_voice_room"}
+        return self.send_request(request)
+
+    def get_voice_rooms(self):
+        request = {"action": "get_voice_rooms"}
+        return self.send_request(request).get("rooms", [])
+
+    # === Presence APIs ===
+    def get_presence(self, since=None):
+        request = {"action": "get_presence"}
+        if since is not None:
+            request["since"] = since
+        return self.send_request(request)
+
+    def subscribe_presence(self, tcp=False):
+        """tcp=True: nhận sự kiện presence qua TCP khi không join được multicast"""
+        request = {"action": "subscribe_presence", "tcp": tcp}
+        return self.send_request(request)
+
+    def search_messages(self, query, peer_id=None, group_id=None, offset=0, limit=20):
+        """Tìm tin nhắn; không truyền peer_id/group_id thì tìm trong mọi hội thoại"""
+        request = {"action": "search_messages", "query": query, "offset": offset, "limit": limit}
+        if peer_id is not None:
+            request["peer_id"] = peer_id
+        if group_id is not None:
+            request["group_id"] = group_id
+        return self.send_request(request)
+
+    def get_incoming_event(self, timeout=0.1):
+        """Lấy sự kiện server đẩy xuống từ queue (non-blocking)"""
+        try:
+            return self.event_queue.get(timeout=timeout)
+        except:
+            return None
+
     def get_incoming_message(self, timeout=0.1):
         """Lấy tin nhắn incoming từ queue (non-blocking)"""
         try:
@@ -213,5 +544,6 @@ class AuthController:
     def stop(self):
         """Dừng controller"""
         self.running = False
+        self.connected.clear()
         if self.client_socket and self.client_socket.fileno() != -1:
             self.client_socket.close()
\ No newline at end of file
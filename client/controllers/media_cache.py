@@ -0,0 +1,138 @@
+# client/controllers/media_cache.py
+import atexit
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from config.config import MEDIA_CACHE_CONFIG
+
+INDEX_FILE = "index.json"
+# Chỉ đụng tới file đúng cách đặt tên của cache (hash nội dung + đuôi): thư mục có thể chứa file khác
+CACHE_FILE = re.compile(r"^([0-9a-f]{32})(\.[A-Za-z0-9]+)?$")
+TMP_FILE = re.compile(r"^[0-9a-f]{32}(\.[A-Za-z0-9]+)?\.\d+\.tmp$")
+STALE_TMP_SECONDS = 3600  # File tạm cũ hơn thế là do tắt giữa chừng, không phải đang được ghi
+
+
+def media_key(data_base64):
+    """Khóa theo nội dung: cùng ảnh/voice/video gửi lại hay mở lại hội thoại đều trùng khóa"""
+    return hashlib.blake2b(data_base64.encode('ascii'), digest_size=16).hexdigest()
+
+
+class MediaCache:
+    """Cache trên đĩa cho media đã giải mã base64, dùng chung cho ảnh, voice và video.
+
+    Giới hạn tổng dung lượng max_bytes, xóa file lâu chưa dùng nhất trước. Chỉ mục (thứ tự LRU,
+    kích thước) ghi ra index.json nên khởi động lại vẫn dùng được các file đã có.
+    Nhiều client mở cùng thư mục vẫn an toàn: file theo hash không có trong chỉ mục được nhận
+    vào làm file cũ nhất chứ không bị xóa, file không đúng cách đặt tên thì không bao giờ đụng tới.
+    """
+
+    def __init__(self, directory=MEDIA_CACHE_CONFIG["directory"], max_bytes=MEDIA_CACHE_CONFIG["max_bytes"]):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = None  # key -> (tên file, kích thước), cũ nhất trước; nạp khi dùng lần đầu
+        self.total = 0
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def _load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.entries = OrderedDict()
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE), encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = []
+        saved = [entry for entry in saved if os.path.exists(os.path.join(self.directory, entry[1]))]
+        known = {key for key, _, _ in saved}
+        # File không có trong chỉ mục (tắt giữa chừng, client khác ghi) không biết thứ tự dùng
+        # -> xếp theo mtime trước các file trong chỉ mục, bị dọn trước khi vượt giới hạn
+        unindexed = []
+        now = time.time()
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            try:
+                match = CACHE_FILE.match(filename)
+                if match and match.group(1) not in known:
+                    stat = os.stat(path)
+                    unindexed.append((stat.st_mtime, match.group(1), filename, stat.st_size))
+                    known.add(match.group(1))
+                elif TMP_FILE.match(filename) and now - os.path.getmtime(path) > STALE_TMP_SECONDS:
+                    os.remove(path)
+            except OSError:
+                pass
+        unindexed.sort()
+        for _, key, filename, size in unindexed:
+            self.entries[key] = (filename, size)
+            self.total += size
+        for key, filename, size in saved:
+            self.entries[key] = (filename, size)
+            self.total += size
+        self.dirty = bool(unindexed)
+        atexit.register(self.flush)
+
+    def _ensure_loaded(self):
+        if self.entries is None:
+            self._load()
+
+    def path(self, data_base64, ext=""):
+        """Đường dẫn file chứa media đã giải mã; chỉ giải mã và ghi file khi chưa có trong cache"""
+        key = media_key(data_base64)
+        with self.lock:
+            self._ensure_loaded()
+            entry = self.entries.get(key)
+            if entry is not None:
+                path = os.path.join(self.directory, entry[0])
+                if os.path.exists(path):
+                    self.entries.move_to_end(key)
+                    self.dirty = True
+                    return path
+                del self.entries[key]
+                self.total -= entry[1]
+
+        data = base64.b64decode(data_base64)
+        filename = key + ext
+        path = os.path.join(self.directory, filename)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = (filename, len(data))
+                self.total += len(data)
+            self.entries.move_to_end(key)
+            self._evict()
+            self._save()
+        return path
+
+    def _evict(self):
+        # Luôn giữ file vừa thêm (cuối danh sách) dù 1 mình nó đã vượt giới hạn
+        while self.total > self.max_bytes and len(self.entries) > 1:
+            key, (filename, size) = self.entries.popitem(last=False)
+            self.total -= size
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except OSError:
+                pass  # Đang được phát (Windows khóa file): để lần dọn sau
+
+    def _save(self):
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump([[key, filename, size] for key, (filename, size) in self.entries.items()], f)
+        os.replace(index_path + ".tmp", index_path)
+        self.dirty = False
+
+    def flush(self):
+        """Ghi thứ tự LRU mới (các lần đọc trúng cache) ra đĩa"""
+        with self.lock:
+            if self.entries is not None and self.dirty:
+                self._save()
+
+
+MEDIA_CACHE = MediaCache()
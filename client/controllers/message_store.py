@@ -0,0 +1,147 @@
+# client/controllers/message_store.py
+import json
+import os
+import sqlite3
+import threading
+from config.config import CLIENT_STORE_CONFIG
+
+
+class MessageStore:
+    """Bản lưu cục bộ các tin đã nhận của 1 user, theo hội thoại ("user"|"group", id).
+
+    [floor_id, synced_id] của hội thoại là đoạn đã đồng bộ đủ với server: mọi tin có id trong
+    đoạn đều có trong bản lưu (floor_id = 0: từ tin đầu tiên). Tin đẩy xuống lúc đang chạy được
+    ghi ngay nhưng không nâng mốc, vì giữa chúng có thể còn tin chưa nhận (tin mình gửi, tin lúc
+    mất kết nối); lần mở sau lấy bù từ mốc. Tin cũ hơn floor_id lấy từ server khi cuộn lên.
+    """
+
+    def __init__(self, user_id, directory=CLIENT_STORE_CONFIG["directory"]):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"messages_{user_id}.db")
+        # Ghi từ thread nhận, đọc từ thread giao diện
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode = WAL")
+            self.conn.execute("PRAGMA synchronous = NORMAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    conv_type TEXT NOT NULL,
+                    conv_id INTEGER NOT NULL,
+                    id INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (conv_type, conv_id, id)
+                )
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    conv_type TEXT NOT NULL,
+                    conv_id INTEGER NOT NULL,
+                    synced_id INTEGER NOT NULL,
+                    floor_id INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (conv_type, conv_id)
+                )
+            """)
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(sync_state)")]
+            if "floor_id" not in columns:
+                # Bản lưu cũ luôn đồng bộ từ tin đầu tiên
+                self.conn.execute("ALTER TABLE sync_state ADD COLUMN floor_id INTEGER NOT NULL DEFAULT 0")
+            self.conn.commit()
+
+    def add(self, conv_key, messages):
+        """Lưu (ghi đè theo id) các tin dạng dict có "id"; avatar không lưu vì đổi theo thời gian"""
+        rows = []
+        for msg in messages:
+            msg = {k: v for k, v in msg.items() if k not in ("sender_avatar", "action")}
+            rows.append((conv_key[0], conv_key[1], msg["id"], json.dumps(msg)))
+        if not rows:
+            return
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?)", rows)
+            self.conn.commit()
+
+    def add_incoming(self, message, user_id):
+        """Ghi ngay 1 frame "message" server đẩy xuống (tin 1-1 hoặc nhóm)"""
+        if message.get("message_id") is None:
+            return
+        if message.get("group_id") is not None:
+            conv_key = ("group", message["group_id"])
+        else:
+            sender_id = message.get("sender_id")
+            conv_key = ("user", message.get("receiver_id") if sender_id == user_id else sender_id)
+        msg = dict(message, id=message["message_id"])
+        msg.pop("message_id")
+        self.add(conv_key, [msg])
+
+    def history(self, conv_key, before_id=None, limit=None, min_id=None):
+        """Tin theo id tăng dần; có limit thì lấy limit tin mới nhất trước before_id, không nhỏ hơn min_id"""
+        query = "SELECT data FROM messages WHERE conv_type = ? AND conv_id = ?"
+        params = list(conv_key)
+        if before_id is not None:
+            query += " AND id < ?"
+            params.append(before_id)
+        if min_id is not None:
+            query += " AND id >= ?"
+            params.append(min_id)
+        query += " ORDER BY id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self.lock:
+            rows = self.conn.execute(query, params).fetchall()
+        return [json.loads(row[0]) for row in reversed(rows)]
+
+    def sync_range(self, conv_key):
+        """(floor_id, synced_id), None nếu hội thoại chưa đồng bộ lần nào"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT floor_id, synced_id FROM sync_state WHERE conv_type = ? AND conv_id = ?", conv_key
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def synced_id(self, conv_key):
+        sync_range = self.sync_range(conv_key)
+        return sync_range[1] if sync_range else None
+
+    def sync(self, conv_key, messages, floor_id=None):
+        """Lưu kết quả lấy từ server sau synced_id và nâng mốc; trả về các tin chưa có trong bản lưu.
+        floor_id: trang lấy về không nối liền với đoạn đã đồng bộ (bị giới hạn số tin), đoạn mới
+        bắt đầu từ đây"""
+        if not messages:
+            return []
+        with self.lock:
+            stored = {row[0] for row in self.conn.execute(
+                "SELECT id FROM messages WHERE conv_type = ? AND conv_id = ? AND id >= ?",
+                (conv_key[0], conv_key[1], messages[0]["id"])
+            )}
+        new = [msg for msg in messages if msg["id"] not in stored]
+        self.add(conv_key, messages)
+        with self.lock:
+            previous = self.conn.execute(
+                "SELECT floor_id, synced_id FROM sync_state WHERE conv_type = ? AND conv_id = ?", conv_key
+            ).fetchone()
+            synced_id = max(messages[-1]["id"], previous[1]) if previous else messages[-1]["id"]
+            if floor_id is None:
+                floor_id = previous[0] if previous else 0
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sync_state (conv_type, conv_id, synced_id, floor_id) VALUES (?, ?, ?, ?)",
+                (conv_key[0], conv_key[1], synced_id, floor_id)
+            )
+            self.conn.commit()
+        return new
+
+    def add_older(self, conv_key, messages, complete):
+        """Lưu trang tin ngay trước floor_id lấy từ server và hạ floor_id;
+        complete: server không còn tin cũ hơn"""
+        self.add(conv_key, messages)
+        floor_id = 0 if complete or not messages else messages[0]["id"]
+        with self.lock:
+            self.conn.execute(
+                "UPDATE sync_state SET floor_id = ? WHERE conv_type = ? AND conv_id = ?",
+                (floor_id, conv_key[0], conv_key[1])
+            )
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
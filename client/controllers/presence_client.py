@@ -0,0 +1,110 @@
+# client/controllers/presence_client.py
+import socket
+import struct
+import threading
+from config.config import MULTICAST_CONFIG
+
+# Phải khớp với server/controllers/presence_controller.py
+PRESENCE_PACKET = struct.Struct('>2sBBII')
+PRESENCE_MAGIC = b'PS'
+PRESENCE_VERSION = 1
+EVENT_NAMES = {1: "online", 2: "offline", 3: "directory", 4: "heartbeat"}
+
+
+class PresenceTracker:
+    """Giữ danh sách user online theo seq của server.
+
+    Sự kiện tới từ multicast hoặc TCP fallback đều đi qua `apply`; khi thấy hổng seq
+    thì `apply` trả về True để nơi gọi lấy snapshot qua `get_presence` rồi `load_snapshot`.
+    """
+
+    def __init__(self):
+        self.seq = None
+        self.online = set()
+
+    def load_snapshot(self, snapshot):
+        """Trả về các user_id đổi danh bạ trong những sự kiện bị lỡ; None nếu là snapshot đầy đủ
+        (server không còn giữ các sự kiện đó, không biết user nào đã đổi)"""
+        if "events" in snapshot:
+            changed = set()
+            for event in snapshot["events"]:
+                self._apply_event(event)
+                self.seq = event["seq"]
+                if event["type"] == "directory":
+                    changed.add(event["user_id"])
+            return changed
+        self.seq = snapshot.get("seq", 0)
+        self.online = set(snapshot.get("online", []))
+        return None
+
+    def _apply_event(self, event):
+        if event["type"] == "online":
+            self.online.add(event["user_id"])
+        elif event["type"] == "offline":
+            self.online.discard(event["user_id"])
+
+    def apply(self, event):
+        """Áp dụng 1 sự kiện; trả về True nếu cần đồng bộ lại"""
+        seq = event.get("seq", 0)
+        if self.seq is None:
+            return True
+        if event["type"] == "heartbeat":
+            # Heartbeat chỉ báo seq mới nhất: lệch nghĩa là đã mất gói
+            return seq != self.seq
+        if seq <= self.seq:
+            return False  # Gói trùng hoặc đã có trong snapshot
+        if seq != self.seq + 1:
+            return True
+        self._apply_event(event)
+        self.seq = seq
+        return False
+
+
+class PresenceListener:
+    """Nhận datagram presence từ multicast và đẩy vào event_queue của controller,
+    để giao diện xử lý chung với sự kiện TCP"""
+
+    def __init__(self, event_queue, group=MULTICAST_CONFIG["group"], port=MULTICAST_CONFIG["port"],
+                 interface=MULTICAST_CONFIG["interface"]):
+        self.event_queue = event_queue
+        self.group = group
+        self.interface = interface
+        self.running = False
+
+        # Lỗi ở đây (không có route multicast, ...) -> nơi gọi chuyển sang TCP fallback
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.socket.bind(("", port))
+        membership = struct.pack('4s4s', socket.inet_aton(group), socket.inet_aton(interface))
+        self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        self.socket.settimeout(0.5)
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._receive_loop, daemon=True).start()
+
+    def _receive_loop(self):
+        while self.running:
+            try:
+                packet, _ = self.socket.recvfrom(64)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if len(packet) != PRESENCE_PACKET.size:
+                continue
+            magic, version, event_type, seq, value = PRESENCE_PACKET.unpack(packet)
+            if magic != PRESENCE_MAGIC or version != PRESENCE_VERSION or event_type not in EVENT_NAMES:
+                continue
+            self.event_queue.put({
+                "action": "presence",
+                "type": EVENT_NAMES[event_type],
+                "seq": seq,
+                "user_id": value
+            })
+
+    def stop(self):
+        self.running = False
+        self.socket.close()
@@ -0,0 +1,288 @@
+# client/controllers/voice_room_client.py
+import socket
+import struct
+import threading
+import time
+from array import array
+from config.config import MULTICAST_CONFIG, VOICE_ROOM_CONFIG
+
+# Header gói thoại: magic, version, codec, sender_id, seq, timestamp (theo số mẫu)
+PACKET_HEADER = struct.Struct('>2sBBIII')
+PACKET_MAGIC = b'VR'
+PACKET_VERSION = 1
+CODEC_PCM16 = 0
+CODEC_ULAW = 1
+
+
+# === G.711 mu-law (viết tay vì audioop đã bị xóa khỏi Python 3.13) ===
+def _ulaw_encode_sample(sample):
+    sign = 0x80 if sample < 0 else 0
+    if sample < 0:
+        sample = -sample
+    sample = min(sample, 32635) + 0x84
+    exponent = 7
+    mask = 0x4000
+    while exponent > 0 and not (sample & mask):
+        exponent -= 1
+        mask >>= 1
+    mantissa = (sample >> (exponent + 3)) & 0x0F
+    return ~(sign | (exponent << 4) | mantissa) & 0xFF
+
+
+def _ulaw_decode_byte(value):
+    value = ~value & 0xFF
+    sign = value & 0x80
+    exponent = (value >> 4) & 0x07
+    mantissa = value & 0x0F
+    sample = (((mantissa << 3) + 0x84) << exponent) - 0x84
+    return -sample if sign else sample
+
+
+# Bảng tra tính sẵn 1 lần: encode theo mẫu 16-bit không dấu, decode theo byte
+_ULAW_ENCODE_TABLE = bytes(_ulaw_encode_sample(s - 65536 if s >= 32768 else s) for s in range(65536))
+_ULAW_DECODE_TABLE = [_ulaw_decode_byte(b) for b in range(256)]
+
+
+def ulaw_encode(pcm):
+    """PCM 16-bit (little endian) -> mu-law, mỗi mẫu còn 1 byte"""
+    samples = array('h', pcm)
+    return bytes(_ULAW_ENCODE_TABLE[s & 0xFFFF] for s in samples)
+
+
+def ulaw_decode(data):
+    """mu-law -> PCM 16-bit"""
+    return array('h', [_ULAW_DECODE_TABLE[b] for b in data]).tobytes()
+
+
+def encode_packet(sender_id, seq, timestamp, pcm, codec=CODEC_ULAW):
+    payload = ulaw_encode(pcm) if codec == CODEC_ULAW else pcm
+    return PACKET_HEADER.pack(PACKET_MAGIC, PACKET_VERSION, codec, sender_id, seq, timestamp) + payload
+
+
+def decode_packet(packet):
+    """Trả về (sender_id, seq, timestamp, pcm) hoặc None nếu gói không hợp lệ"""
+    if len(packet) < PACKET_HEADER.size:
+        return None
+    magic, version, codec, sender_id, seq, timestamp = PACKET_HEADER.unpack_from(packet)
+    if magic != PACKET_MAGIC or version != PACKET_VERSION:
+        return None
+    payload = packet[PACKET_HEADER.size:]
+    if codec == CODEC_ULAW:
+        pcm = ulaw_decode(payload)
+    elif codec == CODEC_PCM16:
+        pcm = bytes(payload)
+    else:
+        return None
+    return sender_id, seq, timestamp, pcm
+
+
+def mix_frames(frames, frame_bytes):
+    """Cộng các frame PCM 16-bit của nhiều người nói, có chặn tràn"""
+    if not frames:
+        return b'\x00' * frame_bytes
+    if len(frames) == 1:
+        return frames[0]
+    mixed = [0] * (frame_bytes // 2)
+    for frame in frames:
+        for i, s in enumerate(array('h', frame)):
+            mixed[i] += s
+    return array('h', [max(-32768, min(32767, s)) for s in mixed]).tobytes()
+
+
+class JitterBuffer:
+    """Bộ đệm jitter cho 1 người nói.
+
+    Sắp xếp lại gói theo seq, đợi đủ `depth` frame trước khi phát, bỏ gói đến muộn
+    và bù gói mất (lặp frame trước, giảm dần âm lượng) tối đa `max_conceal` frame.
+    """
+
+    def __init__(self, frame_bytes, depth=VOICE_ROOM_CONFIG["jitter_frames"],
+                 max_conceal=VOICE_ROOM_CONFIG["max_conceal_frames"]):
+        self.frame_bytes = frame_bytes
+        self.depth = depth
+        self.max_conceal = max_conceal
+        self.frames = {}  # seq -> pcm
+        self.next_seq = None
+        self.playing = False
+        self.last_frame = None
+        self.concealed = 0
+        self.stats = {"received": 0, "late": 0, "lost": 0, "concealed": 0}
+        self.lock = threading.Lock()
+
+    def _reset(self, seq):
+        self.frames.clear()
+        self.next_seq = seq
+        self.playing = False
+        self.last_frame = None
+        self.concealed = 0
+
+    def put(self, seq, pcm):
+        with self.lock:
+            self.stats["received"] += 1
+            if self.next_seq is None:
+                self._reset(seq)
+            elif seq < self.next_seq:
+                if self.next_seq - seq > 50 * self.depth:
+                    # Người nói đã khởi động lại (seq về 0) -> đệm lại từ đầu
+                    self._reset(seq)
+                else:
+                    self.stats["late"] += 1
+                    return
+            self.frames[seq] = pcm
+            if not self.playing and len(self.frames) >= self.depth:
+                self.playing = True
+                self.next_seq = min(self.frames)
+
+    def pop(self):
+        """Lấy frame kế tiếp để phát; None nếu người này đang im lặng"""
+        with self.lock:
+            if not self.playing:
+                return None
+
+            frame = self.frames.pop(self.next_seq, None)
+            self.next_seq += 1
+            if frame is not None:
+                self.last_frame = frame
+                self.concealed = 0
+                return frame
+
+            if not self.frames:
+                # Hết dữ liệu: người nói ngừng nói -> đệm lại khi có gói mới
+                self.playing = False
+                return None
+
+            # Mất gói giữa chừng -> bù bằng frame trước, nhỏ dần
+            self.stats["lost"] += 1
+            if self.last_frame is None or self.concealed >= self.max_conceal:
+                return b'\x00' * self.frame_bytes
+            self.concealed += 1
+            self.stats["concealed"] += 1
+            gain = 1.0 - self.concealed / (self.max_conceal + 1)
+            return array('h', [int(s * gain) for s in array('h', self.last_frame)]).tobytes()
+
+
+class VoiceRoomClient:
+    """Gửi/nhận frame âm thanh qua UDP multicast cho 1 phòng thoại.
+
+    Không phụ thuộc PyAudio: âm thanh thu được đưa vào bằng `send_frame`, âm thanh
+    để phát lấy ra bằng `read_mixed_frame` (hoặc truyền input/output stream để tự chạy).
+    """
+
+    def __init__(self, user_id, group, port, sample_rate=VOICE_ROOM_CONFIG["sample_rate"],
+                 frame_ms=VOICE_ROOM_CONFIG["frame_ms"], interface=MULTICAST_CONFIG["interface"],
+                 ttl=MULTICAST_CONFIG["ttl"], codec=CODEC_ULAW):
+        self.user_id = user_id
+        self.group = group
+        self.port = port
+        self.interface = interface
+        self.codec = codec
+        self.frame_samples = sample_rate * frame_ms // 1000
+        self.frame_bytes = self.frame_samples * 2
+        self.frame_interval = frame_ms / 1000
+        self.seq = 0
+        self.timestamp = 0
+        self.buffers = {}  # sender_id -> JitterBuffer
+        self.buffers_lock = threading.Lock()
+        self.running = False
+
+        # Socket nhận: bind vào port của phòng và join group
+        self.recv_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.recv_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            self.recv_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.recv_socket.bind(("", port))
+        membership = struct.pack('4s4s', socket.inet_aton(group), socket.inet_aton(interface))
+        self.recv_socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        self.recv_socket.settimeout(0.5)
+
+        # Socket gửi: TTL thấp để gói không ra khỏi LAN, bật loop để test trên 1 máy
+        self.send_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.send_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        self.send_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        if interface != "0.0.0.0":
+            self.send_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+
+    def start(self, input_stream=None, output_stream=None):
+        """Bắt đầu nhận gói; nếu có stream PyAudio thì tự thu và phát"""
+        self.running = True
+        threading.Thread(target=self._receive_loop, daemon=True).start()
+        if input_stream is not None:
+            threading.Thread(target=self._capture_loop, args=(input_stream,), daemon=True).start()
+        if output_stream is not None:
+            threading.Thread(target=self._playout_loop, args=(output_stream,), daemon=True).start()
+
+    def send_frame(self, pcm):
+        """Gửi 1 frame PCM 16-bit (đúng frame_bytes) tới cả phòng"""
+        packet = encode_packet(self.user_id, self.seq, self.timestamp, pcm, self.codec)
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        self.timestamp = (self.timestamp + self.frame_samples) & 0xFFFFFFFF
+        try:
+            self.send_socket.sendto(packet, (self.group, self.port))
+        except OSError as e:
+            print(f"Lỗi gửi gói thoại: {e}")
+
+    def _receive_loop(self):
+        while self.running:
+            try:
+                packet, _ = self.recv_socket.recvfrom(2048)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            decoded = decode_packet(packet)
+            if decoded is None:
+                continue
+            sender_id, seq, _, pcm = decoded
+            if sender_id == self.user_id or len(pcm) != self.frame_bytes:
+                continue  # Bỏ gói của chính mình (do multicast loop)
+            with self.buffers_lock:
+                buffer = self.buffers.get(sender_id)
+                if buffer is None:
+                    buffer = self.buffers[sender_id] = JitterBuffer(self.frame_bytes)
+            buffer.put(seq, pcm)
+
+    def read_mixed_frame(self):
+        """Lấy frame đã trộn từ tất cả người nói (gọi mỗi frame_ms)"""
+        with self.buffers_lock:
+            buffers = list(self.buffers.values())
+        frames = [f for f in (b.pop() for b in buffers) if f is not None]
+        return mix_frames(frames, self.frame_bytes)
+
+    def remove_speaker(self, sender_id):
+        with self.buffers_lock:
+            self.buffers.pop(sender_id, None)
+
+    def _capture_loop(self, input_stream):
+        while self.running:
+            try:
+                pcm = input_stream.read(self.frame_samples, exception_on_overflow=False)
+            except Exception as e:
+                print(f"Lỗi thu âm phòng thoại: {e}")
+                break
+            self.send_frame(pcm)
+
+    def _playout_loop(self, output_stream):
+        # Phát theo nhịp đồng hồ, không phụ thuộc thời điểm gói đến
+        next_tick = time.monotonic()
+        while self.running:
+            try:
+                output_stream.write(self.read_mixed_frame())
+            except Exception as e:
+                print(f"Lỗi phát âm phòng thoại: {e}")
+                break
+            next_tick += self.frame_interval
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_tick = time.monotonic()
+
+    def stop(self):
+        self.running = False
+        try:
+            membership = struct.pack('4s4s', socket.inet_aton(self.group), socket.inet_aton(self.interface))
+            self.recv_socket.setsockopt(socket.IPPROTO_IP, socket.IP_DROP_MEMBERSHIP, membership)
+        except OSError:
+            pass
+        self.recv_socket.close()
+        self.send_socket.close()
@@ -4,12 +4,14 @@ from PyQt5 import QtWidgets
 from views.login_view import LoginView
 from views.register_view import RegisterView
 from views.main_view import MainView
+from client.controllers.auth_controller_client import AuthController
 
 class ChatApp:
     def __init__(self):
         self.app = QtWidgets.QApplication(sys.argv)
         self.current_window = None
-        self.socket = None  # Lưu socket toàn cục
+        # Kết nối ngay khi mở app, dùng chung cho đăng ký -> đăng nhập -> màn hình chat
+        self.connection = AuthController()
         self.user_id = None
         self.display_name = None
 
@@ -25,18 +27,19 @@ class ChatApp:
         self.current_window = RegisterView(self)
         self.current_window.show()
 
-    def show_main(self, socket, user_id, display_name):
-        self.socket = socket  # Lưu socket từ login
+    def show_main(self, user_id, display_name):
         self.user_id = user_id
         self.display_name = display_name
         if self.current_window:
             self.current_window.close()
-        self.current_window = MainView(self, socket, user_id, display_name)
+        self.current_window = MainView(self, user_id, display_name)
         self.current_window.show()
 
     def run(self):
         self.show_login()
-        sys.exit(self.app.exec_())
+        code = self.app.exec_()
+        self.connection.stop()
+        sys.exit(code)
 
 if __name__ == "__main__":
     app = ChatApp()
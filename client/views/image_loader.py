@@ -0,0 +1,143 @@
+# client/views/image_loader.py
+from PyQt5 import QtCore, QtGui
+import base64
+import binascii
+from collections import OrderedDict
+from client.controllers.media_cache import MEDIA_CACHE
+
+
+_SKIPPED = object()  # Task bị hủy trước khi chạy
+
+
+def _decode_avatar(data_base64, size):
+    """base64 -> QImage cắt vuông size x size"""
+    image = QtGui.QImage()
+    try:
+        image.loadFromData(base64.b64decode(data_base64))
+    except (ValueError, binascii.Error):
+        return None
+    if image.isNull():
+        return None
+    return image.scaled(size, size, QtCore.Qt.KeepAspectRatioByExpanding, QtCore.Qt.SmoothTransformation)
+
+
+def _decode_image(data_base64, max_size):
+    """Ảnh tin nhắn: ghi file qua MEDIA_CACHE rồi giải mã thẳng ở kích thước hiển thị"""
+    reader = QtGui.QImageReader(MEDIA_CACHE.path(data_base64))
+    size = reader.size()
+    if size.isValid() and (size.width() > max_size or size.height() > max_size):
+        reader.setScaledSize(size.scaled(max_size, max_size, QtCore.Qt.KeepAspectRatio))
+    image = reader.read()
+    return None if image.isNull() else image
+
+
+def _decode_file(data_base64, ext):
+    """Voice/video: chỉ cần file trên đĩa cho QMediaPlayer"""
+    return MEDIA_CACHE.path(data_base64, ext)
+
+
+class _DecodeTask(QtCore.QRunnable):
+    """1 việc giải mã chạy trong QThreadPool; chỉ dùng QImage/file (không dùng QPixmap ngoài thread giao diện)"""
+
+    def __init__(self, loader, key, func, args, tag):
+        super().__init__()
+        self.setAutoDelete(False)  # Python giữ task tới khi nhận kết quả để hủy được an toàn
+        self.loader = loader
+        self.key = key
+        self.func = func
+        self.args = args
+        self.tag = tag
+        self.cancelled = False
+
+    def run(self):
+        if self.cancelled:
+            self.loader.decoded.emit(self.key, _SKIPPED)
+            return
+        try:
+            result = self.func(*self.args)
+        except Exception as e:
+            print(f"Lỗi giải mã media: {e}")
+            result = None
+        self.loader.decoded.emit(self.key, result)
+
+
+class ImageLoader(QtCore.QObject):
+    """Giải mã avatar, ảnh và file media trong thread nền, giữ LRU các kết quả.
+
+    Các hàm get_* trả kết quả nếu đã có, chưa có thì xếp việc và trả None (nơi gọi vẽ
+    placeholder); xong (kể cả lỗi, xem is_failed) thì phát `ready(key)`. Việc gắn tag (vd hội thoại đang mở) hủy được
+    bằng `cancel(tag)` khi người dùng chuyển đi trước lúc giải mã xong.
+    """
+
+    ready = QtCore.pyqtSignal(str)
+    decoded = QtCore.pyqtSignal(str, object)  # Từ thread nền, tự chuyển về thread giao diện
+
+    def __init__(self, max_items=512, parent=None):
+        super().__init__(parent)
+        self.max_items = max_items
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(max(2, QtCore.QThread.idealThreadCount() - 1))
+        self.results = OrderedDict()  # key -> QPixmap hoặc đường dẫn file
+        self.tasks = {}  # key -> _DecodeTask đang chờ/chạy
+        self.failed = set()
+        self.decoded.connect(self._on_decoded)
+
+    def get(self, key, data_base64, size, tag=None):
+        """Avatar vuông size x size"""
+        return self._get(key, _decode_avatar, (data_base64, size), tag)
+
+    def get_image(self, key, data_base64, max_size, tag=None):
+        """Ảnh tin nhắn thu nhỏ trong max_size x max_size"""
+        return self._get(key, _decode_image, (data_base64, max_size), tag)
+
+    def get_file(self, key, data_base64, ext, tag=None):
+        """Đường dẫn file media trong MEDIA_CACHE"""
+        return self._get(key, _decode_file, (data_base64, ext), tag)
+
+    def is_failed(self, key):
+        return key in self.failed
+
+    def _get(self, key, func, args, tag):
+        result = self.results.get(key)
+        if result is not None:
+            self.results.move_to_end(key)
+            return result
+        task = self.tasks.get(key)
+        if task is not None:
+            if task.cancelled:
+                task.cancelled = False  # Bị hủy nhưng đang chạy dở: dùng lại kết quả
+            task.tag = tag
+        elif key not in self.failed:
+            task = self.tasks[key] = _DecodeTask(self, key, func, args, tag)
+            self.pool.start(task)
+        return None
+
+    def cancel(self, tag):
+        """Bỏ các việc của tag: việc còn trong hàng đợi bị gỡ, việc đang chạy bị bỏ kết quả"""
+        for key, task in list(self.tasks.items()):
+            if task.tag != tag:
+                continue
+            if self.pool.tryTake(task):
+                del self.tasks[key]
+            else:
+                task.cancelled = True
+
+    def _on_decoded(self, key, result):
+        task = self.tasks.pop(key, None)
+        if task is None or task.cancelled:
+            return
+        if result is _SKIPPED:
+            # Bị hủy rồi lại được yêu cầu trước khi tới lượt chạy: xếp lại
+            self.tasks[key] = task
+            self.pool.start(task)
+            return
+        if result is None:
+            self.failed.add(key)  # Không giải mã được: không thử lại
+            self.ready.emit(key)
+            return
+        if isinstance(result, QtGui.QImage):
+            result = QtGui.QPixmap.fromImage(result)
+        self.results[key] = result
+        while len(self.results) > self.max_items:
+            self.results.popitem(last=False)
+        self.ready.emit(key)
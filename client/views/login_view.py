@@ -1,9 +1,5 @@
 # client/views/login_view.py
 from PyQt5 import QtWidgets, QtCore, QtGui
-import socket
-import json
-import struct
-from config.config import SERVER_CONFIG
 
 
 class LoginView(QtWidgets.QWidget):
@@ -210,47 +206,13 @@ class LoginView(QtWidgets.QWidget):
             return
 
         try:
-            client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            client_socket.connect((SERVER_CONFIG["host"], SERVER_CONFIG["port"]))
-            client_socket.settimeout(10)
-
-            request = {
-                "action": "login",
-                "email": email,
-                "password": password
-            }
-            # Gửi với length prefix
-            data = json.dumps(request).encode('utf-8')
-            length = struct.pack('>I', len(data))
-            client_socket.send(length + data)
-            
-            # Nhận với length prefix
-            length_data = client_socket.recv(4)
-            if len(length_data) < 4:
-                raise socket.error("Không nhận đủ dữ liệu")
-            resp_length = struct.unpack('>I', length_data)[0]
-            resp_data = b''
-            while len(resp_data) < resp_length:
-                chunk = client_socket.recv(min(resp_length - len(resp_data), 10485760))
-                if not chunk:
-                    raise socket.error("Kết nối bị đóng")
-                resp_data += chunk
-            response = json.loads(resp_data.decode('utf-8'))
-
+            response = self.app.connection.login(email, password)
             if response.get("status") == "success":
-                user_id = response.get("user_id")
-                display_name = response.get("display_name")
-                self.app.show_main(client_socket, user_id, display_name)
+                self.app.show_main(response.get("user_id"), response.get("display_name"))
             else:
                 self.status_label.setText(f"❌ {response.get('message')}")
-                client_socket.close()
-
-        except socket.error as e:
-            self.status_label.setText(f"🔌 Lỗi kết nối: {str(e)}")
-        except json.JSONDecodeError:
-            self.status_label.setText("⚠️ Lỗi phản hồi từ server")
         except Exception as e:
-            self.status_label.setText(f"❌ Lỗi: {str(e)}")
+            self.status_label.setText(f"🔌 Lỗi kết nối: {str(e)}")
 
     def go_to_register(self):
         self.app.show_register()
\ No newline at end of file
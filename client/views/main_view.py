@@ -14,249 +14,22 @@ import os
 import io
 import wave
 import pyaudio
-import tempfile
-import subprocess
-import platform
-from config.config import SERVER_CONFIG
-from client.controllers.auth_controller_client import AuthController
+import time
+from config.config import SERVER_CONFIG, TYPING_CONFIG, READ_MARKER_CONFIG, CLIENT_STORE_CONFIG
+from client.controllers.voice_room_client import VoiceRoomClient
+from client.controllers.presence_client import PresenceListener, PresenceTracker
 from client.views.profile_view import ProfileDialog
-
-
-class ChatListItem(QtWidgets.QWidget):
-    """Widget cho mỗi item trong danh sách chat"""
-
-    def __init__(self, user_id, display_name, last_message="", avatar_base64=None, parent=None):
-        super().__init__(parent)
-        self.user_id = user_id
-        self.display_name = display_name
-        self.avatar_base64 = avatar_base64
-
-        layout = QtWidgets.QHBoxLayout()
-        layout.setContentsMargins(15, 10, 15, 10)
-
-        # Avatar
-        avatar_label = QtWidgets.QLabel()
-        avatar_label.setStyleSheet("""
-            font-size: 32px;
-            background-color: qlineargradient(x1:0, y1:0, x2:1, y2:1,
-                stop:0 #667eea, stop:1 #764ba2);
-            border-radius: 25px;
-            padding: 5px;
-            min-width: 50px;
-            max-width: 50px;
-            min-height: 50px;
-            max-height: 50px;
-        """)
-        avatar_label.setAlignment(QtCore.Qt.AlignCenter)
-        if self.avatar_base64:
-            try:
-                pix = QtGui.QPixmap()
-                pix.loadFromData(base64.b64decode(self.avatar_base64))
-                avatar_label.setPixmap(pix.scaled(50, 50, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation))
-                avatar_label.setStyleSheet("border-radius:25px;")
-            except Exception:
-                avatar_label.setText("👤")
-        else:
-            avatar_label.setText("👤")
-        layout.addWidget(avatar_label)
-
-        # Info
-        info_layout = QtWidgets.QVBoxLayout()
-        info_layout.setSpacing(3)
-
-        name_label = QtWidgets.QLabel(display_name)
-        name_label.setStyleSheet("font-size: 15px; font-weight: bold; color: #2c3e50;")
-        info_layout.addWidget(name_label)
-
-        last_msg_label = QtWidgets.QLabel(last_message if last_message else "Bắt đầu trò chuyện...")
-        last_msg_label.setStyleSheet("font-size: 12px; color: #7f8c8d;")
-        last_msg_label.setWordWrap(True)
-        info_layout.addWidget(last_msg_label)
-
-        layout.addLayout(info_layout, 1)
-
-        self.setLayout(layout)
-        self.setStyleSheet("""
-            ChatListItem {
-                background-color: white;
-                border-bottom: 1px solid #ecf0f1;
-            }
-            ChatListItem:hover {
-                background-color: #f8f9fa;
-            }
-        """)
-
-
-class VoiceMessageWidget(QtWidgets.QWidget):
-    """Widget cho tin nhắn voice"""
-
-    def __init__(self, voice_data, is_self=False, parent=None):
-        super().__init__(parent)
-        self.voice_data = voice_data
-        self.is_playing = False
-        self.audio_player = QtMultimedia.QMediaPlayer()
-        self.temp_file = None  # Thêm biến lưu đường dẫn file tạm
-
-        layout = QtWidgets.QHBoxLayout(self)
-        layout.setContentsMargins(15, 10, 15, 10)
-        layout.setSpacing(10)
-
-        # Nút play/pause
-        self.play_button = QtWidgets.QPushButton("▶")
-        self.play_button.setFixedSize(30, 30)
-        self.play_button.setStyleSheet("""
-            QPushButton {
-                background-color: #4CAF50;
-                border: none;
-                border-radius: 15px;
-                color: white;
-                font-size: 12px;
-            }
-            QPushButton:hover {
-                background-color: #45a049;
-            }
-        """)
-        self.play_button.clicked.connect(self.toggle_play)
-        layout.addWidget(self.play_button)
-
-        # Thanh tiến trình
-        self.progress_bar = QtWidgets.QProgressBar()
-        self.progress_bar.setFixedHeight(6)
-        self.progress_bar.setTextVisible(False)
-        self.progress_bar.setStyleSheet("""
-            QProgressBar {
-                border: none;
-                background-color: #e0e0e0;
-                border-radius: 3px;
-            }
-            QProgressBar::chunk {
-                background-color: #4CAF50;
-                border-radius: 3px;
-            }
-        """)
-        layout.addWidget(self.progress_bar)
-
-        # Thời gian
-        self.time_label = QtWidgets.QLabel("0:00")
-        self.time_label.setStyleSheet("color: #666; font-size: 12px;")
-        self.time_label.setFixedWidth(35)
-        layout.addWidget(self.time_label)
-
-        # Timer để cập nhật tiến trình
-        self.progress_timer = QtCore.QTimer()
-        self.progress_timer.timeout.connect(self.update_progress)
-
-        # Kết nối sự kiện media player
-        self.audio_player.positionChanged.connect(self.on_position_changed)
-        self.audio_player.durationChanged.connect(self.on_duration_changed)
-        self.audio_player.stateChanged.connect(self.on_state_changed)
-
-        self.setFixedHeight(50)
-        self.setStyleSheet(f"""
-            VoiceMessageWidget {{
-                background: qlineargradient(x1:0, y1:0, x2:1, y2:0,
-                    stop:0 {'#667eea' if is_self else '#ffffff'}, 
-                    stop:1 {'#764ba2' if is_self else '#f0f0f0'});
-                border-radius: 25px;
-                border: 1px solid {'#667eea' if is_self else '#ddd'};
-            }}
-        """)
-
-    def toggle_play(self):
-        """Bật/tắt phát voice message"""
-        if not self.is_playing:
-            self.play_voice()
-        else:
-            self.stop_voice()
-
-    def play_voice(self):
-        """Phát tin nhắn voice"""
-        try:
-            # Nếu chưa có file tạm hoặc file đã bị xóa, tạo mới
-            if self.temp_file is None or not os.path.exists(self.temp_file):
-                # Decode base64 và lưu file tạm
-                audio_bytes = base64.b64decode(self.voice_data)
-
-                # Sử dụng thư mục tạm của hệ thống thay vì thư mục hiện tại
-                import tempfile
-                temp_dir = tempfile.gettempdir()
-                self.temp_file = os.path.join(temp_dir, f"temp_voice_message_{id(self)}.wav")
-
-                with open(self.temp_file, 'wb') as f:
-                    f.write(audio_bytes)
-
-            content = QtMultimedia.QMediaContent(QtCore.QUrl.fromLocalFile(self.temp_file))
-            self.audio_player.setMedia(content)
-            self.audio_player.play()
-
-        except Exception as e:
-            print(f"Lỗi phát voice: {e}")
-            QtWidgets.QMessageBox.warning(self, "Lỗi", "Không thể phát tin nhắn thoại")
-
-    def stop_voice(self):
-        """Dừng phát voice"""
-        self.audio_player.stop()
-
-    def on_position_changed(self, position):
-        """Cập nhật vị trí phát"""
-        if self.audio_player.duration() > 0:
-            progress = int((position / self.audio_player.duration()) * 100)
-            self.progress_bar.setValue(progress)
-
-            # Cập nhật thời gian
-            seconds = position // 1000
-            self.time_label.setText(f"{seconds // 60}:{seconds % 60:02d}")
-
-    def on_duration_changed(self, duration):
-        """Khi có thông tin về độ dài audio"""
-        if duration > 0:
-            total_seconds = duration // 1000
-            self.progress_bar.setMaximum(100)
-
-    def on_state_changed(self, state):
-        """Khi trạng thái player thay đổi"""
-        if state == QtMultimedia.QMediaPlayer.PlayingState:
-            self.is_playing = True
-            self.play_button.setText("❚❚")
-            self.progress_timer.start(100)
-        else:
-            self.is_playing = False
-            self.play_button.setText("▶")
-            self.progress_timer.stop()
-
-            if state == QtMultimedia.QMediaPlayer.StoppedState:
-                self.progress_bar.setValue(0)
-                self.time_label.setText("0:00")
-
-    def update_progress(self):
-        """Cập nhật tiến trình"""
-        if self.audio_player.duration() > 0:
-            position = self.audio_player.position()
-            duration = self.audio_player.duration()
-            progress = int((position / duration) * 100)
-            self.progress_bar.setValue(progress)
-
-    def cleanup(self):
-        """Dọn dẹp file tạm"""
-        if self.temp_file and os.path.exists(self.temp_file):
-            try:
-                # Dừng player trước khi xóa file
-                if self.audio_player.state() == QtMultimedia.QMediaPlayer.PlayingState:
-                    self.audio_player.stop()
-
-                os.remove(self.temp_file)
-                self.temp_file = None
-            except Exception as e:
-                print(f"Không thể xóa file tạm: {e}")
+from client.views.transcript_view import TranscriptView, make_item
+from client.views.sidebar_view import ConversationListView, make_row
 
 
 class MainView(QtWidgets.QMainWindow):
-    message_received = QtCore.pyqtSignal(str, str, str, int)  # message, sender_name, message_type, sender_id
+    message_received = QtCore.pyqtSignal(dict)  # frame "message" từ server
+    event_received = QtCore.pyqtSignal(dict)  # sự kiện server đẩy xuống
 
-    def __init__(self, app, socket, user_id, display_name):
+    def __init__(self, app, user_id, display_name):
         super().__init__()
         self.app = app
-        self.socket = socket
         self.user_id = user_id
         self.display_name = display_name
         self.setWindowTitle("Chat App")
@@ -286,6 +59,30 @@ class MainView(QtWidgets.QMainWindow):
         top_bar_layout.addWidget(self.user_label)
         top_bar_layout.addStretch()
 
+        # Nút phòng thoại nhóm (UDP multicast trong LAN)
+        self.voice_room_button = QtWidgets.QPushButton("🎧")
+        self.voice_room_button.setToolTip("Vào phòng thoại chung")
+        self.voice_room_button.setCheckable(True)
+        self.voice_room_button.setStyleSheet("""
+            QPushButton {
+                background-color: rgba(255, 255, 255, 0.2);
+                color: white;
+                border: 1px solid white;
+                border-radius: 15px;
+                padding: 5px;
+                font-size: 16px;
+                min-width: 30px;
+                max-width: 30px;
+                min-height: 30px;
+                max-height: 30px;
+            }
+            QPushButton:checked {
+                background-color: #2ecc71;
+            }
+        """)
+        self.voice_room_button.clicked.connect(self.toggle_voice_room)
+        top_bar_layout.addWidget(self.voice_room_button)
+
         self.logout_button = QtWidgets.QPushButton("⬅")
         self.logout_button.setToolTip("Đăng xuất")
         self.logout_button.setStyleSheet("""
@@ -321,42 +118,46 @@ class MainView(QtWidgets.QMainWindow):
         self.chat_list_main_layout.setContentsMargins(0, 0, 0, 0)
         self.chat_list_main_layout.setSpacing(0)
 
-        list_header = QtWidgets.QLabel("💬 Tin nhắn")
+        list_header = QtWidgets.QWidget()
         list_header.setStyleSheet("""
-            font-size: 18px; 
-            font-weight: bold; 
-            padding: 15px; 
             background: qlineargradient(x1:0, y1:0, x2:1, y2:0,
                 stop:0 #a8edea, stop:1 #fed6e3);
+        """)
+        list_header_layout = QtWidgets.QHBoxLayout(list_header)
+        list_header_layout.setContentsMargins(15, 15, 15, 15)
+        list_header_label = QtWidgets.QLabel("💬 Tin nhắn")
+        list_header_label.setStyleSheet("""
+            font-size: 18px; 
+            font-weight: bold; 
             color: #2c3e50;
+            background: transparent;
         """)
-        self.chat_list_main_layout.addWidget(list_header)
+        list_header_layout.addWidget(list_header_label)
+        list_header_layout.addStretch()
 
-        scroll_area = QtWidgets.QScrollArea()
-        scroll_area.setWidgetResizable(True)
-        scroll_area.setStyleSheet("""
-            QScrollArea {
-                border: none;
+        self.create_group_button = QtWidgets.QPushButton("👥+")
+        self.create_group_button.setToolTip("Tạo nhóm chat")
+        self.create_group_button.setCursor(QtGui.QCursor(QtCore.Qt.PointingHandCursor))
+        self.create_group_button.setStyleSheet("""
+            QPushButton {
                 background-color: white;
+                border: none;
+                border-radius: 12px;
+                padding: 4px 8px;
+                font-size: 14px;
             }
-            QScrollBar:vertical {
-                width: 8px;
-                background: #f5f6fa;
-            }
-            QScrollBar::handle:vertical {
-                background: #bdc3c7;
-                border-radius: 4px;
+            QPushButton:hover {
+                background-color: #f0f0f0;
             }
         """)
+        self.create_group_button.clicked.connect(self.show_create_group_dialog)
+        list_header_layout.addWidget(self.create_group_button)
+        self.chat_list_main_layout.addWidget(list_header)
 
-        scroll_content = QtWidgets.QWidget()
-        self.chat_list_layout = QtWidgets.QVBoxLayout(scroll_content)
-        self.chat_list_layout.setContentsMargins(0, 0, 0, 0)
-        self.chat_list_layout.setSpacing(0)
-        self.chat_list_layout.addStretch()
-
-        scroll_area.setWidget(scroll_content)
-        self.chat_list_main_layout.addWidget(scroll_area)
+        # Danh sách hội thoại: model/view, avatar giải mã trong thread nền khi dòng hiện ra
+        self.chat_list = ConversationListView()
+        self.chat_list.conversation_selected.connect(self.open_conversation)
+        self.chat_list_main_layout.addWidget(self.chat_list)
         self.splitter.addWidget(self.chat_list_widget)
 
         # Right panel - Chat area
@@ -380,26 +181,17 @@ class MainView(QtWidgets.QMainWindow):
         self.chat_label = QtWidgets.QLabel("Chọn người để bắt đầu trò chuyện")
         self.chat_label.setStyleSheet("font-size: 16px; font-weight: bold; color: white;")
         chat_header_layout.addWidget(self.chat_label)
+        self.typing_label = QtWidgets.QLabel("")
+        self.typing_label.setStyleSheet("font-size: 12px; font-style: italic; color: rgba(255, 255, 255, 0.85);")
+        chat_header_layout.addWidget(self.typing_label)
+        chat_header_layout.addStretch()
         self.chat_layout.addWidget(chat_header)
 
-        # Chat scroll area
-        chat_scroll = QtWidgets.QScrollArea()
-        chat_scroll.setWidgetResizable(True)
-        chat_scroll.setStyleSheet("""
-            QScrollArea {
-                border: none;
-                background-color: transparent;
-            }
-        """)
-
-        self.chat_content = QtWidgets.QWidget()
-        self.chat_messages_layout = QtWidgets.QVBoxLayout(self.chat_content)
-        self.chat_messages_layout.setContentsMargins(15, 15, 15, 15)
-        self.chat_messages_layout.setSpacing(10)
-        self.chat_messages_layout.addStretch()
-
-        chat_scroll.setWidget(self.chat_content)
-        self.chat_layout.addWidget(chat_scroll)
+        # Khung tin nhắn: model/view, chỉ vẽ các tin đang hiện
+        self.transcript = TranscriptView()
+        self.transcript.video_requested.connect(self.open_video)
+        self.transcript.reached_top.connect(self.load_older_messages)
+        self.chat_layout.addWidget(self.transcript)
 
         # Input area
         input_widget = QtWidgets.QWidget()
@@ -444,6 +236,7 @@ class MainView(QtWidgets.QMainWindow):
             }
         """)
         self.message_input.returnPressed.connect(self.send_message)
+        self.message_input.textEdited.connect(self.on_message_edited)
         input_layout.addWidget(self.message_input)
 
         # Nút micro
@@ -466,13 +259,34 @@ class MainView(QtWidgets.QMainWindow):
         self.splitter.setStretchFactor(0, 1)
         self.splitter.setStretchFactor(1, 3)
 
-        self.controller = AuthController(self.socket)
-        self.controller.current_user_id = self.user_id
+        self.controller = self.app.connection  # Kết nối dùng chung của app, đã đăng nhập
+        self.active = True  # Tắt khi rời màn hình này; kết nối vẫn tiếp tục chạy
         self.message_received.connect(self.display_incoming_message)
+        self.event_received.connect(self.handle_server_event)
         self.current_receiver_id = None
         self.current_receiver_name = None
+        self.current_group_id = None
+        self.users = []
+        self.groups = []
+        # Khung chat chỉ giữ các trang đã tải; cuộn lên đầu thì tải trang trước oldest_message_id
+        self.oldest_message_id = None
+        self.history_complete = False
+
+        # Chỉ báo "đang nhập"
+        self.last_typing_sent = 0
+        self.typing_hide_timer = QtCore.QTimer(self)
+        self.typing_hide_timer.setSingleShot(True)
+        self.typing_hide_timer.timeout.connect(lambda: self.typing_label.setText(""))
         self.self_avatar = None
         self.user_avatars = {}  # user_id -> base64
+        self.unread = {}  # ("user"|"group", id) -> số tin chưa đọc
+        # Marker đã đọc chờ gửi: conv_key -> id tin (None: tới tin mới nhất); gom lại, gửi không chờ
+        self.pending_reads = {}
+        self.read_timer = QtCore.QTimer(self)
+        self.read_timer.setSingleShot(True)
+        self.read_timer.timeout.connect(self.flush_read_markers)
+        self.presence = PresenceTracker()
+        self.presence_listener = None
 
         # Biến cho ghi âm
         self.is_recording = False
@@ -481,10 +295,18 @@ class MainView(QtWidgets.QMainWindow):
         self.stream = None
         self.recording_thread = None
 
+        # Biến cho phòng thoại
+        self.voice_room = None
+        self.voice_room_audio = None
+        self.voice_room_joined = False  # Server đã nhận vào phòng: lỗi gì sau đó cũng phải báo rời
+        self.voice_room_streams = []
+
         # Load avatars and users
         self.refresh_self_profile()
         self.load_users()
+        self.start_presence()
         threading.Thread(target=self.check_incoming_messages, daemon=True).start()
+        threading.Thread(target=self.check_incoming_events, daemon=True).start()
 
     def _get_button_style(self, color1, color2):
         return f"""
@@ -510,156 +332,36 @@ class MainView(QtWidgets.QMainWindow):
             }}
         """
 
-    def create_message_bubble(self, message, sender_name, is_self=False, is_image=False, is_voice=False, is_video=False, avatar_base64=None):
-        """Tạo bubble tin nhắn giống Zalo - đã thêm hỗ trợ voice và video"""
-        bubble_widget = QtWidgets.QWidget()
-        bubble_layout = QtWidgets.QHBoxLayout(bubble_widget)
-        bubble_layout.setContentsMargins(0, 0, 0, 0)
-        bubble_layout.setSpacing(8)
-
-        # Avatar
-        avatar = QtWidgets.QLabel()
-        avatar.setStyleSheet(f"""
-            font-size: 28px;
-            background: qlineargradient(x1:0, y1:0, x2:1, y2:1,
-                stop:0 {'#667eea' if not is_self else '#4facfe'}, 
-                stop:1 {'#764ba2' if not is_self else '#00f2fe'});
-            border-radius: 20px;
-            padding: 5px;
-            min-width: 40px;
-            max-width: 40px;
-            min-height: 40px;
-            max-height: 40px;
-        """)
-        avatar.setAlignment(QtCore.Qt.AlignCenter)
-        if avatar_base64:
-            try:
-                pix = QtGui.QPixmap()
-                pix.loadFromData(base64.b64decode(avatar_base64))
-                avatar.setPixmap(pix.scaled(40, 40, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation))
-                avatar.setStyleSheet("border-radius:20px;")
-            except Exception:
-                avatar.setText("👤" if not is_self else "😊")
-        else:
-            avatar.setText("👤" if not is_self else "😊")
-
-        # Message content
-        content_widget = QtWidgets.QWidget()
-        content_layout = QtWidgets.QVBoxLayout(content_widget)
-        content_layout.setContentsMargins(0, 0, 0, 0)
-        content_layout.setSpacing(3)
-
-        if not is_self:
-            name_label = QtWidgets.QLabel(sender_name)
-            name_label.setStyleSheet("font-size: 11px; color: #7f8c8d; font-weight: bold;")
-            content_layout.addWidget(name_label)
-
-        if is_voice:
-            # Voice message widget
-            voice_widget = VoiceMessageWidget(message, is_self)
-            content_layout.addWidget(voice_widget)
-        elif is_video:
-            # Hiển thị video với thumbnail và button để mở
-            # Dùng VideoMessageWidget
-            video_widget = self.VideoMessageWidget(message, is_self)
-            content_layout.addWidget(video_widget)
-            # Lưu để cleanup
-            video_widget.temp_file = getattr(video_widget, 'temp_file', None)
-            
-            
-        elif is_image:
-            # Hiển thị ảnh
-            image_label = QtWidgets.QLabel()
-            try:
-                pixmap = QtGui.QPixmap()
-                image_bytes = base64.b64decode(message)
-                if pixmap.loadFromData(image_bytes):
-                    scaled_pixmap = pixmap.scaled(250, 250, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
-                    image_label.setPixmap(scaled_pixmap)
-                else:
-                    image_label.setText("📷 [Ảnh không thể hiển thị]")
-            except Exception as e:
-                print(f"Lỗi decode ảnh: {str(e)}")
-                image_label.setText("📷 [Lỗi tải ảnh]")
-
-            image_label.setStyleSheet("""
-                background-color: white;
-                border-radius: 10px;
-                padding: 5px;
-            """)
-            content_layout.addWidget(image_label)
-        else:
-            # Tin nhắn text
-            message_label = QtWidgets.QLabel(message)
-            message_label.setWordWrap(True)
-            message_label.setTextFormat(QtCore.Qt.RichText)
-            message_label.setStyleSheet(f"""
-                background: qlineargradient(x1:0, y1:0, x2:1, y2:0,
-                    stop:0 {'#667eea' if is_self else '#ffffff'}, 
-                    stop:1 {'#764ba2' if is_self else '#f0f0f0'});
-                color: {'white' if is_self else '#2c3e50'};
-                padding: 10px 15px;
-                border-radius: 15px;
-                font-size: 14px;
-                max-width: 400px;
-            """)
-            content_layout.addWidget(message_label)
-
-        # Layout theo vị trí
-        if is_self:
-            bubble_layout.addStretch()
-            bubble_layout.addWidget(content_widget)
-            bubble_layout.addWidget(avatar)
-        else:
-            bubble_layout.addWidget(avatar)
-            bubble_layout.addWidget(content_widget)
-            bubble_layout.addStretch()
-
-        return bubble_widget
-
     def add_message_to_chat(self, message, sender_name, is_self=False, is_image=False, is_voice=False, is_video=False, avatar_base64=None):
-        """Thêm tin nhắn vào chat - đã thêm hỗ trợ voice và video"""
-        try:
-            bubble = self.create_message_bubble(message, sender_name, is_self, is_image, is_voice, is_video, avatar_base64)
-            self.chat_messages_layout.insertWidget(self.chat_messages_layout.count() - 1, bubble)
-
-            # Auto scroll
-            parent = self.chat_content.parentWidget()
-            if parent and isinstance(parent, QtWidgets.QScrollArea):
-                def scroll_to_bottom():
-                    scrollbar = parent.verticalScrollBar()
-                    scrollbar.setValue(scrollbar.maximum())
-
-                QtCore.QTimer.singleShot(100, scroll_to_bottom)
-        except Exception as e:
-            print(f"Lỗi add message: {str(e)}")
-            import traceback
-            traceback.print_exc()
+        """Thêm 1 tin vào cuối khung chat (text, ảnh, voice hoặc video)"""
+        kind = "image" if is_image else "voice" if is_voice else "video" if is_video else "text"
+        if is_self and avatar_base64 is None:
+            avatar_base64 = self.self_avatar
+        self.transcript.add_items([make_item(message, sender_name, is_self, kind, avatar_base64)])
+
+    def open_video(self, video_file):
+        """Xem video trong cửa sổ riêng; file đã được ghi sẵn trong thread nền"""
+        dialog = QtWidgets.QDialog(self)
+        dialog.setWindowTitle("Video")
+        layout = QtWidgets.QVBoxLayout(dialog)
+        video_widget = self.VideoMessageWidget(video_file)
+        layout.addWidget(video_widget)
+        dialog.resize(640, 420)
+        dialog.finished.connect(lambda _: video_widget.cleanup())
+        dialog.show()
 
     def load_users(self):
+        """Làm mới danh sách hội thoại; các dòng không đổi giữ nguyên, không giải mã lại avatar"""
         try:
             self.users = self.controller.get_users()
+            self.load_unread_counts()
+            self.user_avatars = {user["user_id"]: user.get("avatar") for user in self.users}
 
-            for i in reversed(range(self.chat_list_layout.count())):
-                item = self.chat_list_layout.itemAt(i)
-                if item.widget() and not isinstance(item, QtWidgets.QSpacerItem):
-                    item.widget().deleteLater()
-
-            self.user_avatars = {}
-            for user in self.users:
-                if user["user_id"] != self.user_id:
-                    chat_item = ChatListItem(
-                        user["user_id"],
-                        user["display_name"],
-                        "Nhấn để bắt đầu chat",
-                        user.get("avatar")
-                    )
-                    chat_item.setCursor(QtGui.QCursor(QtCore.Qt.PointingHandCursor))
-                    chat_item.mousePressEvent = lambda e, uid=user["user_id"], name=user["display_name"]: self.select_chat_by_id(uid, name)
-                    self.chat_list_layout.insertWidget(self.chat_list_layout.count() - 1, chat_item)
-                self.user_avatars[user["user_id"]] = user.get("avatar")
+            rows = self.load_groups()
+            rows += [self.user_row(user) for user in self.users if user["user_id"] != self.user_id]
+            self.chat_list.model.set_rows(rows)
 
-            if len(self.users) > 1:
+            if len(self.users) > 1 and self.current_receiver_id is None and self.current_group_id is None:
                 first_user = next((u for u in self.users if u["user_id"] != self.user_id), None)
                 if first_user:
                     self.select_chat_by_id(first_user["user_id"], first_user["display_name"])
@@ -668,76 +370,282 @@ class MainView(QtWidgets.QMainWindow):
             print(f"Lỗi khi tải danh sách: {str(e)}")
             QtWidgets.QMessageBox.warning(self, "Lỗi", f"Không thể tải danh sách: {str(e)}")
 
+    def user_row(self, user):
+        return make_row(
+            ("user", user["user_id"]),
+            user["display_name"],
+            user["display_name"],
+            "Nhấn để bắt đầu chat",
+            user.get("avatar"),
+            user["user_id"] in self.presence.online,
+            self.unread.get(("user", user["user_id"]), 0)
+        )
+
+    def refresh_user(self, user_id):
+        """Chỉ tải lại 1 user vừa đăng ký hoặc đổi tên/avatar, không tải lại cả danh bạ"""
+        if user_id == self.user_id:
+            return
+        try:
+            user = self.controller.get_user(user_id)
+        except Exception as e:
+            print(f"Không thể tải thông tin user {user_id}: {str(e)}")
+            return
+        if user is None:
+            return
+        self.user_avatars[user_id] = user.get("avatar")
+        for i, known in enumerate(self.users):
+            if known["user_id"] == user_id:
+                self.users[i] = user
+                self.chat_list.model.update(("user", user_id), name=user["display_name"],
+                                            title=user["display_name"], avatar=user.get("avatar"))
+                return
+        self.users.append(user)
+        self.chat_list.model.append(self.user_row(user))
+
+    def load_groups(self):
+        """Các dòng nhóm chat, đứng đầu danh sách"""
+        try:
+            self.groups = self.controller.get_groups()
+        except Exception as e:
+            print(f"Lỗi khi tải nhóm: {str(e)}")
+            return []
+        return [
+            make_row(
+                ("group", group["group_id"]),
+                f"👥 {group['name']}",
+                group["name"],
+                f"{len(group.get('members', []))} thành viên",
+                unread=self.unread.get(("group", group["group_id"]), 0)
+            )
+            for group in self.groups
+        ]
+
+    def open_conversation(self, conv_key, name):
+        if conv_key[0] == "group":
+            self.select_group(conv_key[1], name)
+        else:
+            self.select_chat_by_id(conv_key[1], name)
+
+    def show_create_group_dialog(self):
+        dialog = QtWidgets.QDialog(self)
+        dialog.setWindowTitle("Tạo nhóm chat")
+        dialog.resize(320, 420)
+        layout = QtWidgets.QVBoxLayout(dialog)
+
+        name_input = QtWidgets.QLineEdit()
+        name_input.setPlaceholderText("Tên nhóm")
+        layout.addWidget(name_input)
+
+        member_list = QtWidgets.QListWidget()
+        for user in getattr(self, "users", []):
+            if user["user_id"] == self.user_id:
+                continue
+            item = QtWidgets.QListWidgetItem(user["display_name"])
+            item.setData(QtCore.Qt.UserRole, user["user_id"])
+            item.setFlags(item.flags() | QtCore.Qt.ItemIsUserCheckable)
+            item.setCheckState(QtCore.Qt.Unchecked)
+            member_list.addItem(item)
+        layout.addWidget(member_list)
+
+        buttons = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel)
+        buttons.accepted.connect(dialog.accept)
+        buttons.rejected.connect(dialog.reject)
+        layout.addWidget(buttons)
+
+        if not dialog.exec_():
+            return
+        name = name_input.text().strip()
+        member_ids = [
+            member_list.item(i).data(QtCore.Qt.UserRole)
+            for i in range(member_list.count())
+            if member_list.item(i).checkState() == QtCore.Qt.Checked
+        ]
+        if not name or not member_ids:
+            QtWidgets.QMessageBox.warning(self, "Cảnh báo", "Vui lòng nhập tên nhóm và chọn thành viên!")
+            return
+        try:
+            response = self.controller.create_group(name, member_ids)
+            if response.get("status") == "success":
+                self.load_users()
+                self.select_group(response["group_id"], name)
+            else:
+                QtWidgets.QMessageBox.warning(self, "Lỗi", f"Không thể tạo nhóm: {response.get('message')}")
+        except Exception as e:
+            QtWidgets.QMessageBox.warning(self, "Lỗi", f"Lỗi tạo nhóm: {str(e)}")
+
+    # === ĐÃ ĐỌC / CHƯA ĐỌC ===
+
+    def load_unread_counts(self):
+        """Lấy số tin chưa đọc của mọi hội thoại trong 1 request"""
+        try:
+            self.unread = {
+                (item["conv_type"], item["conv_id"]): item["unread"]
+                for item in self.controller.get_unread_counts()
+            }
+        except Exception as e:
+            print(f"Không thể tải số tin chưa đọc: {e}")
+
+    def current_conversation(self):
+        if self.current_group_id:
+            return ("group", self.current_group_id)
+        if self.current_receiver_id:
+            return ("user", self.current_receiver_id)
+        return None
+
+    def set_unread(self, conv_key, count):
+        self.unread[conv_key] = count
+        self.chat_list.model.update(conv_key, unread=count)
+
+    def mark_current_read(self, last_read_id=None):
+        """Xóa badge ngay; marker gửi lên server sau flush_delay, nhiều tin liền nhau chỉ 1 lần"""
+        conv_key = self.current_conversation()
+        if conv_key is None:
+            return
+        if conv_key in self.pending_reads:
+            previous = self.pending_reads[conv_key]
+            if previous is None or last_read_id is None:
+                last_read_id = None
+            else:
+                last_read_id = max(previous, last_read_id)
+        self.pending_reads[conv_key] = last_read_id
+        self.set_unread(conv_key, 0)
+        if not self.read_timer.isActive():
+            self.read_timer.start(int(READ_MARKER_CONFIG["flush_delay"] * 1000))
+
+    def flush_read_markers(self):
+        self.read_timer.stop()
+        pending, self.pending_reads = self.pending_reads, {}
+        for (conv_type, conv_id), last_read_id in pending.items():
+            if conv_type == "group":
+                self.controller.mark_read(group_id=conv_id, last_read_id=last_read_id)
+            else:
+                self.controller.mark_read(peer_id=conv_id, last_read_id=last_read_id)
+
+    def select_group(self, group_id, name):
+        self.current_group_id = group_id
+        self.current_receiver_id = None
+        self.current_receiver_name = name
+        self.chat_label.setText(f"👥 {name}")
+        self.clear_chat_messages()
+        self.load_conversation(("group", group_id))
+
+    def load_conversation(self, conv_key):
+        """Hiện ngay trang tin mới nhất đã lưu cục bộ, rồi chỉ lấy từ server phần mới hơn"""
+        cached = self.controller.cached_history(conv_key)
+        self.render_history(cached)
+        QtWidgets.QApplication.processEvents()  # Vẽ bản lưu trước khi chờ server
+
+        try:
+            new = self.controller.sync_history(conv_key)
+        except Exception as e:
+            print(f"Lỗi khi đồng bộ hội thoại: {str(e)}")
+            return
+        if conv_key != self.current_conversation():
+            return  # Người dùng đã chuyển hội thoại khác trong lúc chờ
+        if cached and new and (new[0]["id"] < cached[-1]["id"] or len(new) >= CLIENT_STORE_CONFIG["page_size"]):
+            # Có tin chen vào giữa (vd tin mình gửi), hoặc cả trang tin mới (có thể còn khoảng trống
+            # với bản lưu): vẽ lại trang mới nhất theo đúng thứ tự
+            self.clear_chat_messages()
+            self.render_history(self.controller.cached_history(conv_key))
+        else:
+            self.render_history(new)
+        self.mark_current_read()
+
+    def load_older_messages(self):
+        """Cuộn lên đầu khung chat: tải trang tin ngay trước tin cũ nhất đang hiện"""
+        conv_key = self.current_conversation()
+        if conv_key is None or self.oldest_message_id is None or self.history_complete:
+            return
+        try:
+            older = self.controller.older_history(conv_key, self.oldest_message_id)
+        except Exception as e:
+            print(f"Lỗi khi tải tin cũ: {str(e)}")
+            return
+        if conv_key != self.current_conversation():
+            return
+        self.history_complete = len(older) < CLIENT_STORE_CONFIG["page_size"]
+        self.render_history(older, prepend=True)
+
+    def render_history(self, messages, prepend=False):
+        """Thêm cả trang lịch sử vào khung chat trong 1 lần chèn vào model"""
+        items = []
+        for msg in messages:
+            sender_id = msg.get("sender_id")
+            is_self = sender_id == self.user_id
+            # Bản lưu cục bộ không giữ avatar
+            avatar = self.self_avatar if is_self else msg.get("sender_avatar") or self.user_avatars.get(sender_id)
+            sender_name = msg.get("sender_name", "Unknown")
+            for kind in ("image", "voice", "video"):
+                if msg.get(f"is_{kind}"):
+                    if msg.get(f"{kind}_data"):
+                        items.append(make_item(msg[f"{kind}_data"], sender_name, is_self, kind, avatar))
+                    break
+            else:
+                if msg.get("message"):
+                    items.append(make_item(msg["message"], sender_name, is_self, "text", avatar))
+        if messages and (prepend or self.oldest_message_id is None):
+            self.oldest_message_id = messages[0]["id"]
+        if prepend:
+            self.transcript.prepend_items(items)
+        else:
+            self.transcript.add_items(items)
+
     def select_chat_by_id(self, user_id, display_name):
+        self.current_group_id = None
         self.current_receiver_id = user_id
         self.current_receiver_name = display_name
         self.chat_label.setText(f"💬 {display_name}")
+        self.clear_chat_messages()
+        self.load_conversation(("user", user_id))
 
-        # Clear messages
-        for i in reversed(range(self.chat_messages_layout.count())):
-            item = self.chat_messages_layout.itemAt(i)
-            if item.widget() and not isinstance(item, QtWidgets.QSpacerItem):
-                # Dọn dẹp voice và video widgets trước khi xóa
-                widget = item.widget()
-                if hasattr(widget, 'cleanup'):
-                    widget.cleanup()
-                # Cleanup video temp files
-                if hasattr(widget, 'temp_file') and widget.temp_file and os.path.exists(widget.temp_file):
-                    try:
-                        if hasattr(widget, 'media_player'):
-                            widget.media_player.stop()
-                        os.remove(widget.temp_file)
-                    except Exception as e:
-                        print(f"Không thể xóa file video tạm: {e}")
-                widget.deleteLater()
+    def clear_chat_messages(self):
+        self.typing_label.setText("")
+        self.oldest_message_id = None
+        self.history_complete = False
+        self.transcript.clear()
 
-        try:
-            if self.controller.client_socket and self.controller.client_socket.fileno() != -1:
-                history = self.controller.get_chat_history(user_id)
-                for msg in history:
-                    sender_id = msg.get("sender_id")
-                    sender_name = msg.get("sender_name", "Unknown")
-                    sender_avatar = msg.get("sender_avatar")
-                    is_image = bool(msg.get("is_image", False))
-                    is_voice = bool(msg.get("is_voice", False))
-                    is_video = bool(msg.get("is_video", False))
-                    is_self = sender_id == self.user_id
-
-                    if is_image:
-                        image_data = msg.get("image_data")
-                        if image_data:
-                            self.add_message_to_chat(image_data, sender_name, is_self, True, False, False, self.self_avatar if is_self else sender_avatar)
-                    elif is_voice:
-                        voice_data = msg.get("voice_data")
-                        if voice_data:
-                            self.add_message_to_chat(voice_data, sender_name, is_self, False, True, False, self.self_avatar if is_self else sender_avatar)
-                    elif is_video:
-                        video_data = msg.get("video_data")
-                        if video_data:
-                            self.add_message_to_chat(video_data, sender_name, is_self, False, False, True, self.self_avatar if is_self else sender_avatar)
-                    else:
-                        message_text = msg.get("message", "")
-                        if message_text:
-                            self.add_message_to_chat(message_text, sender_name, is_self, False, False, False, self.self_avatar if is_self else sender_avatar)
-        except Exception as e:
-            print(f"Lỗi khi load chat: {str(e)}")
-            import traceback
-            traceback.print_exc()
+    # === ĐANG NHẬP ===
+
+    def on_message_edited(self, text):
+        """Báo "đang nhập" cho người nhận, tự giới hạn tần suất như server"""
+        if not self.current_receiver_id:
+            return
+        now = time.monotonic()
+        if text and now - self.last_typing_sent >= TYPING_CONFIG["interval"]:
+            self.last_typing_sent = now
+            self.controller.send_typing(self.current_receiver_id, True)
+        elif not text and self.last_typing_sent:
+            self.last_typing_sent = 0
+            self.controller.send_typing(self.current_receiver_id, False)
+
+    def show_typing_indicator(self, event):
+        if event.get("sender_id") != self.current_receiver_id or self.current_group_id:
+            return
+        if event.get("typing"):
+            self.typing_label.setText("đang nhập...")
+            self.typing_hide_timer.start(int(TYPING_CONFIG["display_timeout"] * 1000))
+        else:
+            self.typing_label.setText("")
+            self.typing_hide_timer.stop()
 
     def send_message(self):
         message = self.message_input.text().strip()
         if not message:
             return
 
-        if not self.current_receiver_id:
+        if not self.current_receiver_id and not self.current_group_id:
             QtWidgets.QMessageBox.warning(self, "Cảnh báo", "Vui lòng chọn người nhận!")
             return
 
         try:
-            response = self.controller.send_message(self.current_receiver_id, message)
+            if self.current_group_id:
+                response = self.controller.send_group_message(self.current_group_id, "text", message)
+            else:
+                response = self.controller.send_message(self.current_receiver_id, message)
             if response and response.get("status") == "success":
                 self.add_message_to_chat(message, "Bạn", is_self=True, is_image=False, is_voice=False, is_video=False)
                 self.message_input.clear()
+                self.last_typing_sent = 0
             else:
                 error_msg = response.get('message', 'Không rõ lỗi') if response else 'Không nhận được phản hồi'
                 QtWidgets.QMessageBox.warning(self, "Lỗi", f"Không thể gửi: {error_msg}")
@@ -749,7 +657,7 @@ class MainView(QtWidgets.QMainWindow):
 
     def send_image(self):
         """Gửi hình ảnh"""
-        if not self.current_receiver_id:
+        if not self.current_receiver_id and not self.current_group_id:
             QtWidgets.QMessageBox.warning(self, "Cảnh báo", "Vui lòng chọn người nhận!")
             return
 
@@ -768,13 +676,17 @@ class MainView(QtWidgets.QMainWindow):
                     image_base64 = base64.b64encode(image_data).decode('utf-8')
 
                 # Gửi qua controller
-                request = {
-                    "action": "send_image",
-                    "receiver_id": self.current_receiver_id,
-                    "image_data": image_base64,
-                    "filename": os.path.basename(file_path)
-                }
-                response = self.controller.send_request(request)
+                if self.current_group_id:
+                    response = self.controller.send_group_message(
+                        self.current_group_id, "image", image_base64, os.path.basename(file_path))
+                else:
+                    request = {
+                        "action": "send_image",
+                        "receiver_id": self.current_receiver_id,
+                        "image_data": image_base64,
+                        "filename": os.path.basename(file_path)
+                    }
+                    response = self.controller.send_request(request)
 
                 if response.get("status") == "success":
                     self.add_message_to_chat(image_base64, "Bạn", is_self=True, is_image=True, is_voice=False, is_video=False)
@@ -786,7 +698,7 @@ class MainView(QtWidgets.QMainWindow):
 
     def send_video(self):
         """Gửi video"""
-        if not self.current_receiver_id:
+        if not self.current_receiver_id and not self.current_group_id:
             QtWidgets.QMessageBox.warning(self, "Cảnh báo", "Vui lòng chọn người nhận!")
             return
 
@@ -851,13 +763,17 @@ class MainView(QtWidgets.QMainWindow):
                 QtWidgets.QApplication.processEvents()
 
                 # Gửi qua controller
-                request = {
-                    "action": "send_video",
-                    "receiver_id": self.current_receiver_id,
-                    "video_data": video_base64,
-                    "filename": os.path.basename(file_path)
-                }
-                response = self.controller.send_request(request, timeout=300)  # 5 phút cho video lớn
+                if self.current_group_id:
+                    response = self.controller.send_group_message(
+                        self.current_group_id, "video", video_base64, os.path.basename(file_path))
+                else:
+                    request = {
+                        "action": "send_video",
+                        "receiver_id": self.current_receiver_id,
+                        "video_data": video_base64,
+                        "filename": os.path.basename(file_path)
+                    }
+                    response = self.controller.send_request(request, timeout=300)  # 5 phút cho video lớn
 
                 progress.setValue(100)
                 progress.close()
@@ -920,61 +836,125 @@ class MainView(QtWidgets.QMainWindow):
         dialog.close()
 
     def check_incoming_messages(self):
-        while True:
+        while self.active:
             try:
                 message = self.controller.get_incoming_message(timeout=0.5)
                 if message:
-                    sender_name = message.get('sender_name', 'Unknown')
-                    sender_id = message.get('sender_id')
-                    is_image = message.get('is_image', False)
-                    is_voice = message.get('is_voice', False)
-                    is_video = message.get('is_video', False)
-
-                    if is_voice:
-                        msg_content = message.get('voice_data', '')
-                        self.message_received.emit(msg_content, sender_name, 'voice', sender_id)
-                    elif is_image:
-                        msg_content = message.get('image_data', '')
-                        self.message_received.emit(msg_content, sender_name, 'image', sender_id)
-                    elif is_video:
-                        msg_content = message.get('video_data', '')
-                        self.message_received.emit(msg_content, sender_name, 'video', sender_id)
-                    else:
-                        msg_content = message.get('message', '')
-                        self.message_received.emit(msg_content, sender_name, 'text', sender_id)
+                    self.message_received.emit(message)
             except Exception as e:
                 print(f"Lỗi check message: {str(e)}")
                 break
 
-    def display_incoming_message(self, message, sender_name, message_type, sender_id):
-        is_image = (message_type == 'image')
-        is_voice = (message_type == 'voice')
-        is_video = (message_type == 'video')
+    def check_incoming_events(self):
+        while self.active and self.controller.running:
+            try:
+                event = self.controller.get_incoming_event(timeout=0.5)
+                if event:
+                    self.event_received.emit(event)
+            except Exception as e:
+                print(f"Lỗi check event: {str(e)}")
+                break
+
+    def handle_server_event(self, event):
+        if event.get("action") == "voice_room_update":
+            self.update_voice_room_members(event)
+        elif event.get("action") == "presence":
+            self.handle_presence_event(event)
+        elif event.get("action") == "group_created":
+            self.load_users()
+        elif event.get("action") == "typing":
+            self.show_typing_indicator(event)
+        elif event.get("action") == "session_expired":
+            # Kết nối lại được nhưng server không nhận phiên cũ: quay về màn hình đăng nhập
+            QtWidgets.QMessageBox.warning(self, "Phiên đăng nhập hết hạn",
+                                          f"{event.get('message')}. Vui lòng đăng nhập lại.")
+            self.logout()
+
+    # === PRESENCE ===
+
+    def start_presence(self):
+        """Nghe presence qua multicast; không được thì nhờ server đẩy qua TCP"""
+        use_tcp = False
+        try:
+            self.presence_listener = PresenceListener(self.controller.event_queue)
+            self.presence_listener.start()
+        except OSError as e:
+            print(f"Không nghe được presence multicast, dùng TCP: {e}")
+            self.presence_listener = None
+            use_tcp = True
+        try:
+            snapshot = self.controller.subscribe_presence(tcp=use_tcp)
+            if not snapshot.get("multicast", True) and self.presence_listener is not None:
+                # Server chạy nhiều node: sự kiện chỉ tới qua TCP, không trộn seq với multicast
+                self.presence_listener.stop()
+                self.presence_listener = None
+            self.presence.load_snapshot(snapshot)
+            self.refresh_online_indicators()
+        except Exception as e:
+            print(f"Không thể tải trạng thái online: {e}")
+
+    def handle_presence_event(self, event):
+        if self.presence.apply(event):
+            # Mất gói -> lấy các sự kiện bị thiếu (hoặc snapshot) qua TCP
+            try:
+                changed = self.presence.load_snapshot(self.controller.get_presence(since=self.presence.seq))
+            except Exception as e:
+                print(f"Không thể đồng bộ presence: {e}")
+                changed = ()
+            if changed is None:
+                # Server không còn giữ các sự kiện bị lỡ (hoặc vừa khởi động lại): tải lại cả danh bạ
+                self.load_users()
+            else:
+                for user_id in changed:
+                    self.refresh_user(user_id)
+        elif event.get("type") == "directory":
+            self.refresh_user(event.get("user_id"))
+        self.refresh_online_indicators()
+
+    def refresh_online_indicators(self):
+        for conv_key in self.chat_list.model.keys():
+            if conv_key[0] == "user":
+                self.chat_list.model.update(conv_key, online=conv_key[1] in self.presence.online)
+
+    def display_incoming_message(self, message):
+        sender_id = message.get('sender_id')
+        group_id = message.get('group_id')
+        conv_key = ("group", group_id) if group_id else ("user", sender_id)
+
+        # Tin không thuộc hội thoại đang mở -> chỉ tăng badge chưa đọc
+        if conv_key != self.current_conversation():
+            self.set_unread(conv_key, self.unread.get(conv_key, 0) + 1)
+            return
+
+        sender_name = message.get('sender_name', 'Unknown')
         avatar = self.user_avatars.get(sender_id)
-        self.add_message_to_chat(message, sender_name, is_self=False, is_image=is_image, is_voice=is_voice, is_video=is_video, avatar_base64=avatar)
+        self.typing_label.setText("")
+        if message.get('is_voice'):
+            self.add_message_to_chat(message.get('voice_data', ''), sender_name, is_voice=True, avatar_base64=avatar)
+        elif message.get('is_image'):
+            self.add_message_to_chat(message.get('image_data', ''), sender_name, is_image=True, avatar_base64=avatar)
+        elif message.get('is_video'):
+            self.add_message_to_chat(message.get('video_data', ''), sender_name, is_video=True, avatar_base64=avatar)
+        else:
+            self.add_message_to_chat(message.get('message', ''), sender_name, avatar_base64=avatar)
+        self.mark_current_read(message.get('message_id'))
 
     def logout(self):
-        self.controller.stop()
+        self.flush_read_markers()
+        self.leave_voice_room()
+        if self.presence_listener:
+            self.presence_listener.stop()
+        self.active = False
+        self.controller.logout()
         self.app.show_login()
 
     def closeEvent(self, event):
-        # Dọn dẹp tất cả voice và video widgets trước khi đóng
-        for i in reversed(range(self.chat_messages_layout.count())):
-            item = self.chat_messages_layout.itemAt(i)
-            if item.widget():
-                widget = item.widget()
-                if hasattr(widget, 'cleanup'):
-                    widget.cleanup()
-                # Cleanup video temp files
-                if hasattr(widget, 'temp_file') and widget.temp_file and os.path.exists(widget.temp_file):
-                    try:
-                        if hasattr(widget, 'media_player'):
-                            widget.media_player.stop()
-                        os.remove(widget.temp_file)
-                    except Exception as e:
-                        print(f"Không thể xóa file video tạm: {e}")
-
-        self.controller.stop()
+        self.flush_read_markers()
+        self.transcript.stop_playback()
+        self.leave_voice_room()
+        if self.presence_listener:
+            self.presence_listener.stop()
+        self.active = False
         event.accept()
 
     # === CÁC PHƯƠNG THỨC XỬ LÝ VOICE MESSAGE ===
@@ -1074,8 +1054,12 @@ class MainView(QtWidgets.QMainWindow):
             buffer.close()
 
             # Gửi đi
-            if self.current_receiver_id:
-                response = self.send_voice_message(self.current_receiver_id, voice_base64, "voice_message.wav")
+            if self.current_receiver_id or self.current_group_id:
+                if self.current_group_id:
+                    response = self.controller.send_group_message(
+                        self.current_group_id, "voice", voice_base64, "voice_message.wav")
+                else:
+                    response = self.send_voice_message(self.current_receiver_id, voice_base64, "voice_message.wav")
 
                 if response and response.get("status") == "success":
                     self.add_message_to_chat(voice_base64, "Bạn", is_self=True, is_image=False, is_voice=True, is_video=False)
@@ -1103,15 +1087,85 @@ class MainView(QtWidgets.QMainWindow):
 
 
 
+    # === PHÒNG THOẠI NHÓM ===
+
+    def toggle_voice_room(self):
+        if self.voice_room is None:
+            self.join_voice_room("Phòng chung")
+        else:
+            self.leave_voice_room()
+
+    def join_voice_room(self, room_name):
+        """Vào phòng thoại: server trả về group/port multicast, âm thanh đi thẳng giữa các client"""
+        try:
+            response = self.controller.join_voice_room(room_name)
+            if response.get("status") != "success":
+                raise Exception(response.get("message", "Không rõ lỗi"))
+            self.voice_room_joined = True
+
+            self.voice_room = VoiceRoomClient(
+                self.user_id, response["group"], response["port"],
+                sample_rate=response["sample_rate"], frame_ms=response["frame_ms"]
+            )
+            self.voice_room_audio = pyaudio.PyAudio()
+            input_stream = self.voice_room_audio.open(
+                format=pyaudio.paInt16, channels=1, rate=response["sample_rate"],
+                input=True, frames_per_buffer=self.voice_room.frame_samples
+            )
+            output_stream = self.voice_room_audio.open(
+                format=pyaudio.paInt16, channels=1, rate=response["sample_rate"],
+                output=True, frames_per_buffer=self.voice_room.frame_samples
+            )
+            self.voice_room_streams = [input_stream, output_stream]
+            self.voice_room.start(input_stream, output_stream)
+            self.update_voice_room_members(response)
+        except Exception as e:
+            print(f"Lỗi vào phòng thoại: {e}")
+            self.leave_voice_room()
+            QtWidgets.QMessageBox.warning(self, "Lỗi", f"Không thể vào phòng thoại: {str(e)}")
+
+    def leave_voice_room(self):
+        if self.voice_room is not None:
+            self.voice_room.stop()
+            self.voice_room = None
+        if self.voice_room_joined:
+            self.voice_room_joined = False
+            try:
+                self.controller.leave_voice_room()
+            except Exception as e:
+                print(f"Lỗi rời phòng thoại: {e}")
+        for stream in self.voice_room_streams:
+            try:
+                stream.stop_stream()
+                stream.close()
+            except Exception:
+                pass
+        self.voice_room_streams = []
+        if self.voice_room_audio:
+            self.voice_room_audio.terminate()
+            self.voice_room_audio = None
+        self.voice_room_button.setChecked(False)
+        self.voice_room_button.setToolTip("Vào phòng thoại chung")
+
+    def update_voice_room_members(self, room_info):
+        if self.voice_room is None:
+            return
+        members = room_info.get("members", [])
+        # Bỏ bộ đệm jitter của người đã rời phòng
+        for sender_id in list(self.voice_room.buffers):
+            if sender_id not in members:
+                self.voice_room.remove_speaker(sender_id)
+        self.voice_room_button.setChecked(True)
+        self.voice_room_button.setToolTip(f"{room_info.get('room')}: {len(members)} người - nhấn để rời")
+
     # === CÁC PHƯƠNG THỨC XỬ LÝ VIDEO MESSAGE ===
     class VideoMessageWidget(QtWidgets.QWidget):
-        def __init__(self, video_data_base64, is_self=False, parent=None):
+        def __init__(self, video_file, is_self=False, parent=None):
             global HAS_VIDEO_WIDGET
             super().__init__(parent)
-            self.video_data = video_data_base64
             self.is_self = is_self
-            
-            self.temp_file = None
+
+            self.media_file = video_file  # File trong MEDIA_CACHE
             self.media_player = QtMultimedia.QMediaPlayer()
             self.is_playing = False
 
@@ -1201,28 +1255,8 @@ class MainView(QtWidgets.QMainWindow):
             self.media_player.durationChanged.connect(self.on_duration_changed)
             self.media_player.stateChanged.connect(self.on_state_changed)
 
-            # Tạo file tạm ngay khi khởi tạo
-            self.create_temp_file()
-
-        def create_temp_file(self):
-            """Tạo file tạm từ base64"""
-            try:
-                video_bytes = base64.b64decode(self.video_data)
-                import tempfile, hashlib
-                hash_name = hashlib.md5(self.video_data[:500].encode()).hexdigest()
-                self.temp_file = os.path.join(tempfile.gettempdir(), f"chat_video_{hash_name}.mp4")
-                
-                if not os.path.exists(self.temp_file):
-                    with open(self.temp_file, 'wb') as f:
-                        f.write(video_bytes)
-
-                # Set media
-                if HAS_VIDEO_WIDGET:
-                    content = QtMultimedia.QMediaContent(QtCore.QUrl.fromLocalFile(self.temp_file))
-                    self.media_player.setMedia(content)
-
-            except Exception as e:
-                print(f"Lỗi tạo file video tạm: {e}")
+            if HAS_VIDEO_WIDGET:
+                self.media_player.setMedia(QtMultimedia.QMediaContent(QtCore.QUrl.fromLocalFile(self.media_file)))
 
         def toggle_play(self):
             if self.is_playing:
@@ -1265,14 +1299,9 @@ class MainView(QtWidgets.QMainWindow):
             self.time_label.setText(f"{pos_sec//60}:{pos_sec%60:02d} / {dur_sec//60}:{dur_sec%60:02d}")
 
         def cleanup(self):
-            """Dọn dẹp khi widget bị xóa"""
+            """Dọn dẹp khi widget bị xóa; file video giữ lại trong MEDIA_CACHE"""
             if self.media_player.state() == QtMultimedia.QMediaPlayer.PlayingState:
                 self.media_player.stop()
-            if self.temp_file and os.path.exists(self.temp_file):
-                try:
-                    os.remove(self.temp_file)
-                except:
-                    pass
 
     # === PROFILE ===
     def open_profile_dialog(self, event=None):
@@ -1,10 +1,6 @@
 # client/views/register_view.py
 from PyQt5 import QtWidgets, QtCore, QtGui
-import socket
-import json
-import struct
 import re
-from config.config import SERVER_CONFIG
 
 
 class RegisterView(QtWidgets.QWidget):
@@ -241,33 +237,7 @@ class RegisterView(QtWidgets.QWidget):
             return
 
         try:
-            client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            client_socket.connect((SERVER_CONFIG["host"], SERVER_CONFIG["port"]))
-
-            request = {
-                "action": "register",
-                "display_name": display_name,
-                "email": email,
-                "password": password
-            }
-            # Gửi với length prefix
-            data = json.dumps(request).encode('utf-8')
-            length = struct.pack('>I', len(data))
-            client_socket.send(length + data)
-            
-            # Nhận với length prefix
-            length_data = client_socket.recv(4)
-            if len(length_data) < 4:
-                raise socket.error("Không nhận đủ dữ liệu")
-            resp_length = struct.unpack('>I', length_data)[0]
-            resp_data = b''
-            while len(resp_data) < resp_length:
-                chunk = client_socket.recv(min(resp_length - len(resp_data), 4096))
-                if not chunk:
-                    raise socket.error("Kết nối bị đóng")
-                resp_data += chunk
-            response = json.loads(resp_data.decode('utf-8'))
-            client_socket.close()
+            response = self.app.connection.register(display_name, email, password)
 
             if response.get("status") == "success":
                 self.status_label.setStyleSheet("color: #27ae60; font-size: 12px; background: transparent;")
@@ -299,12 +269,8 @@ class RegisterView(QtWidgets.QWidget):
                 self.status_label.setStyleSheet("color: #e74c3c; font-size: 12px; background: transparent;")
                 self.status_label.setText(f"{response.get('message')}")
 
-        except socket.error as e:
-            self.status_label.setText(f"Lỗi kết nối: {str(e)}")
-        except json.JSONDecodeError:
-            self.status_label.setText("Lỗi phản hồi từ server")
         except Exception as e:
-            self.status_label.setText(f"Lỗi: {str(e)}")
+            self.status_label.setText(f"Lỗi kết nối: {str(e)}")
 
     def go_to_login(self):
         self.app.show_login()
\ No newline at end of file
@@ -0,0 +1,221 @@
+# client/views/sidebar_view.py
+from PyQt5 import QtWidgets, QtCore, QtGui
+from client.controllers.media_cache import media_key
+from client.views.image_loader import ImageLoader
+
+RowRole = QtCore.Qt.UserRole + 1
+
+ROW_HEIGHT = 70
+AVATAR_SIZE = 50
+PADDING = 15
+
+# Các trường so sánh khi làm mới: chỉ dòng đổi 1 trong số này mới vẽ lại
+ROW_FIELDS = ("name", "subtitle", "avatar", "online", "unread")
+
+
+def make_row(conv_key, name, title, subtitle, avatar_base64=None, online=False, unread=0):
+    """1 hội thoại trong danh sách; title là tên truyền cho select_chat_by_id/select_group"""
+    return {"key": conv_key, "name": name, "title": title, "subtitle": subtitle,
+            "avatar": avatar_base64, "online": online, "unread": unread}
+
+
+class ConversationListModel(QtCore.QAbstractListModel):
+    """Danh sách nhóm và user; làm mới chỉ báo thay đổi cho các dòng thật sự khác"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rows = []
+        self.positions = {}  # conv_key -> số dòng
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self.rows[index.row()]
+        if role == RowRole:
+            return row
+        if role == QtCore.Qt.DisplayRole:
+            return row["name"]
+        return None
+
+    def set_rows(self, rows):
+        if [r["key"] for r in rows] != [r["key"] for r in self.rows]:
+            # Thêm/bớt hội thoại: dựng lại cả danh sách (hiếm)
+            self.beginResetModel()
+            self.rows = rows
+            self.positions = {r["key"]: i for i, r in enumerate(rows)}
+            self.endResetModel()
+            return
+        for i, (old, new) in enumerate(zip(self.rows, rows)):
+            if any(old[f] != new[f] for f in ROW_FIELDS):
+                if old["avatar"] == new["avatar"] and "avatar_key" in old:
+                    new["avatar_key"] = old["avatar_key"]
+                self.rows[i] = new
+                index = self.index(i)
+                self.dataChanged.emit(index, index)
+
+    def update(self, conv_key, **fields):
+        i = self.positions.get(conv_key)
+        if i is None:
+            return
+        row = self.rows[i]
+        if all(row[f] == v for f, v in fields.items()):
+            return
+        if "avatar" in fields and fields["avatar"] != row["avatar"]:
+            row.pop("avatar_key", None)
+        row.update(fields)
+        index = self.index(i)
+        self.dataChanged.emit(index, index)
+
+    def get(self, conv_key, field, default=None):
+        i = self.positions.get(conv_key)
+        return default if i is None else self.rows[i][field]
+
+    def keys(self):
+        return list(self.positions)
+
+    def append(self, row):
+        self.beginInsertRows(QtCore.QModelIndex(), len(self.rows), len(self.rows))
+        self.positions[row["key"]] = len(self.rows)
+        self.rows.append(row)
+        self.endInsertRows()
+
+
+class ConversationDelegate(QtWidgets.QStyledItemDelegate):
+    """Vẽ 1 dòng hội thoại; avatar chỉ được giải mã (trong thread nền) khi dòng đó hiện ra"""
+
+    def __init__(self, view, loader):
+        super().__init__(view)
+        self.loader = loader
+        self.name_font = QtGui.QFont(view.font())
+        self.name_font.setPixelSize(15)
+        self.name_font.setBold(True)
+        self.small_font = QtGui.QFont(view.font())
+        self.small_font.setPixelSize(12)
+        self.badge_font = QtGui.QFont(view.font())
+        self.badge_font.setPixelSize(11)
+        self.badge_font.setBold(True)
+        self.emoji_font = QtGui.QFont(view.font())
+        self.emoji_font.setPixelSize(28)
+
+    def sizeHint(self, option, index):
+        return QtCore.QSize(option.rect.width(), ROW_HEIGHT)
+
+    def _avatar(self, row):
+        if not row["avatar"]:
+            return None
+        if "avatar_key" not in row:
+            row["avatar_key"] = f"avatar{AVATAR_SIZE}:{media_key(row['avatar'])}"
+        return self.loader.get(row["avatar_key"], row["avatar"], AVATAR_SIZE)
+
+    def paint(self, painter, option, index):
+        row = index.data(RowRole)
+        rect = option.rect
+        painter.save()
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+
+        hover = option.state & QtWidgets.QStyle.State_MouseOver
+        painter.fillRect(rect, QtGui.QColor("#f8f9fa" if hover else "white"))
+        painter.setPen(QtGui.QColor("#ecf0f1"))
+        painter.drawLine(rect.bottomLeft(), rect.bottomRight())
+
+        avatar_rect = QtCore.QRect(rect.left() + PADDING, rect.center().y() - AVATAR_SIZE // 2 + 1,
+                                   AVATAR_SIZE, AVATAR_SIZE)
+        path = QtGui.QPainterPath()
+        path.addEllipse(QtCore.QRectF(avatar_rect))
+        pixmap = self._avatar(row)
+        if pixmap is not None:
+            painter.save()
+            painter.setClipPath(path)
+            painter.drawPixmap(avatar_rect, pixmap)
+            painter.restore()
+        else:
+            # Chưa giải mã xong hoặc không có avatar
+            gradient = QtGui.QLinearGradient(QtCore.QPointF(avatar_rect.topLeft()),
+                                             QtCore.QPointF(avatar_rect.bottomRight()))
+            gradient.setColorAt(0, QtGui.QColor("#667eea"))
+            gradient.setColorAt(1, QtGui.QColor("#764ba2"))
+            painter.fillPath(path, QtGui.QBrush(gradient))
+            painter.setFont(self.emoji_font)
+            painter.setPen(QtGui.QColor("white"))
+            painter.drawText(avatar_rect, QtCore.Qt.AlignCenter, "👤")
+
+        # Badge số tin chưa đọc
+        right = rect.right() - PADDING
+        if row["unread"] > 0:
+            text = str(row["unread"]) if row["unread"] < 100 else "99+"
+            metrics = QtGui.QFontMetrics(self.badge_font)
+            badge = QtCore.QRect(0, 0, max(20, metrics.horizontalAdvance(text) + 12), 20)
+            badge.moveCenter(QtCore.QPoint(right - badge.width() // 2, rect.center().y()))
+            painter.setPen(QtCore.Qt.NoPen)
+            painter.setBrush(QtGui.QColor("#e74c3c"))
+            painter.drawRoundedRect(QtCore.QRectF(badge), 10, 10)
+            painter.setFont(self.badge_font)
+            painter.setPen(QtGui.QColor("white"))
+            painter.drawText(badge, QtCore.Qt.AlignCenter, text)
+            right = badge.left() - 8
+
+        text_left = avatar_rect.right() + 1 + PADDING
+        text_width = max(0, right - text_left)
+        name_metrics = QtGui.QFontMetrics(self.name_font)
+        name_rect = QtCore.QRect(text_left, rect.top() + 14, text_width, name_metrics.height())
+        is_user = row["key"][0] == "user"
+        name = name_metrics.elidedText(row["name"], QtCore.Qt.ElideRight, text_width - (16 if is_user else 0))
+        painter.setFont(self.name_font)
+        painter.setPen(QtGui.QColor("#2c3e50"))
+        painter.drawText(name_rect, QtCore.Qt.AlignLeft | QtCore.Qt.AlignVCenter, name)
+
+        if is_user:
+            # Chấm trạng thái online
+            dot_x = text_left + name_metrics.horizontalAdvance(name) + 6
+            painter.setPen(QtCore.Qt.NoPen)
+            painter.setBrush(QtGui.QColor("#2ecc71" if row["online"] else "#bdc3c7"))
+            painter.drawEllipse(QtCore.QRectF(dot_x, name_rect.center().y() - 4, 8, 8))
+
+        small_metrics = QtGui.QFontMetrics(self.small_font)
+        subtitle_rect = QtCore.QRect(text_left, name_rect.bottom() + 4, text_width, small_metrics.height())
+        painter.setFont(self.small_font)
+        painter.setPen(QtGui.QColor("#7f8c8d"))
+        painter.drawText(subtitle_rect, QtCore.Qt.AlignLeft | QtCore.Qt.AlignVCenter,
+                         small_metrics.elidedText(row["subtitle"], QtCore.Qt.ElideRight, text_width))
+        painter.restore()
+
+
+class ConversationListView(QtWidgets.QListView):
+    """Danh sách hội thoại bên trái: mọi dòng cao bằng nhau, chỉ vẽ các dòng đang hiện"""
+
+    conversation_selected = QtCore.pyqtSignal(object, str)  # (loại, id), tên hội thoại
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.model = ConversationListModel(self)
+        self.setModel(self.model)
+        self.loader = ImageLoader(parent=self)
+        self.loader.ready.connect(lambda _: self.viewport().update())
+        self.setItemDelegate(ConversationDelegate(self, self.loader))
+        self.setUniformItemSizes(True)
+        self.setMouseTracking(True)
+        self.setSelectionMode(QtWidgets.QAbstractItemView.NoSelection)
+        self.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
+        self.setCursor(QtGui.QCursor(QtCore.Qt.PointingHandCursor))
+        self.setStyleSheet("""
+            QListView {
+                border: none;
+                background-color: white;
+            }
+            QScrollBar:vertical {
+                width: 8px;
+                background: #f5f6fa;
+            }
+            QScrollBar::handle:vertical {
+                background: #bdc3c7;
+                border-radius: 4px;
+            }
+        """)
+        self.clicked.connect(self._on_clicked)
+
+    def _on_clicked(self, index):
+        row = index.data(RowRole)
+        self.conversation_selected.emit(row["key"], row["title"])
@@ -0,0 +1,449 @@
+# client/views/transcript_view.py
+from PyQt5 import QtWidgets, QtCore, QtGui, QtMultimedia
+from client.controllers.media_cache import media_key
+from client.views.image_loader import ImageLoader
+
+MessageRole = QtCore.Qt.UserRole + 1
+
+MARGIN = 15          # Lề trái/phải của khung chat
+ROW_SPACING = 10     # Khoảng cách giữa 2 tin
+AVATAR_SIZE = 40
+AVATAR_GAP = 8
+BUBBLE_PADDING = (15, 10)  # (ngang, dọc) quanh chữ
+MAX_BUBBLE_WIDTH = 400
+IMAGE_MAX = 250
+IMAGE_PLACEHOLDER = QtCore.QSize(IMAGE_MAX, 160)
+VOICE_SIZE = QtCore.QSize(220, 50)
+VIDEO_SIZE = QtCore.QSize(250, 60)
+
+
+def make_item(content, sender_name, is_self=False, kind="text", avatar_base64=None):
+    """1 dòng trong transcript; kind: text/image/voice/video, content là chữ hoặc base64 của media"""
+    return {"content": content, "sender_name": sender_name, "is_self": is_self,
+            "kind": kind, "avatar": avatar_base64}
+
+
+def _item_key(item, prefix):
+    """Khóa trong ImageLoader; hash nội dung tính 1 lần cho mỗi tin"""
+    if "hash" not in item:
+        item["hash"] = media_key(item["content"])
+    return f"{prefix}:{item['hash']}"
+
+
+class TranscriptModel(QtCore.QAbstractListModel):
+    """Danh sách tin của hội thoại đang mở; chỉ giữ dữ liệu, không tạo widget nào"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.items = []
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.items)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        item = self.items[index.row()]
+        if role == MessageRole:
+            return item
+        if role == QtCore.Qt.DisplayRole:
+            return item["content"] if item["kind"] == "text" else item["kind"]
+        return None
+
+    def extend(self, items):
+        """Thêm nhiều tin 1 lần (tải lịch sử) để view chỉ layout lại 1 lần"""
+        if not items:
+            return
+        start = len(self.items)
+        self.beginInsertRows(QtCore.QModelIndex(), start, start + len(items) - 1)
+        self.items.extend(items)
+        self.endInsertRows()
+
+    def append(self, item):
+        self.extend([item])
+
+    def prepend(self, items):
+        """Chèn trang tin cũ hơn lên đầu"""
+        if not items:
+            return
+        self.beginInsertRows(QtCore.QModelIndex(), 0, len(items) - 1)
+        self.items[:0] = items
+        self.endInsertRows()
+
+    def clear(self):
+        self.beginResetModel()
+        self.items = []
+        self.endResetModel()
+
+    def row_changed(self, row):
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+
+class BubbleDelegate(QtWidgets.QStyledItemDelegate):
+    """Vẽ bubble tin nhắn trực tiếp bằng QPainter; view chỉ gọi cho các dòng đang hiện.
+    Ảnh/avatar chưa giải mã xong thì vẽ placeholder."""
+
+    def __init__(self, view, loader):
+        super().__init__(view)
+        self.view = view
+        self.loader = loader
+        self.waiting = {}  # khóa ảnh đang giải mã -> các dòng cần đổi kích thước khi xong
+        self.text_font = QtGui.QFont(view.font())
+        self.text_font.setPixelSize(14)
+        self.name_font = QtGui.QFont(view.font())
+        self.name_font.setPixelSize(11)
+        self.name_font.setBold(True)
+        self.emoji_font = QtGui.QFont(view.font())
+        self.emoji_font.setPixelSize(22)
+
+    # === Kích thước ===
+
+    def _content_width(self):
+        return max(100, self.view.viewport().width() - 2 * MARGIN - AVATAR_SIZE - AVATAR_GAP)
+
+    def _text_rect(self, text, width):
+        metrics = QtGui.QFontMetrics(self.text_font)
+        max_text = min(MAX_BUBBLE_WIDTH, width) - 2 * BUBBLE_PADDING[0]
+        return metrics.boundingRect(QtCore.QRect(0, 0, max_text, 100000), QtCore.Qt.TextWordWrap, text)
+
+    def _content_size(self, item, width):
+        kind = item["kind"]
+        if kind == "image":
+            size = item.get("image_size") or IMAGE_PLACEHOLDER
+            return QtCore.QSize(size.width() + 10, size.height() + 10)
+        if kind == "voice":
+            return VOICE_SIZE
+        if kind == "video":
+            return VIDEO_SIZE
+        rect = self._text_rect(item["content"], width)
+        return QtCore.QSize(rect.width() + 2 * BUBBLE_PADDING[0], rect.height() + 2 * BUBBLE_PADDING[1])
+
+    def _name_height(self, item):
+        return 0 if item["is_self"] else QtGui.QFontMetrics(self.name_font).height() + 3
+
+    def sizeHint(self, option, index):
+        item = index.data(MessageRole)
+        width = self._content_width()
+        cached = item.get("layout")
+        if cached is None or cached[0] != width:
+            content = self._content_size(item, width)
+            height = max(AVATAR_SIZE, self._name_height(item) + content.height()) + ROW_SPACING
+            cached = item["layout"] = (width, content, height)
+        return QtCore.QSize(self.view.viewport().width(), cached[2])
+
+    # === Vẽ ===
+
+    def paint(self, painter, option, index):
+        item = index.data(MessageRole)
+        width, content_size, _ = item.get("layout") or (None, None, None)
+        if content_size is None:
+            self.sizeHint(option, index)
+            width, content_size, _ = item["layout"]
+        rect = option.rect.adjusted(MARGIN, ROW_SPACING // 2, -MARGIN, -ROW_SPACING // 2)
+        is_self = item["is_self"]
+
+        painter.save()
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+        painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform)
+
+        if is_self:
+            avatar_rect = QtCore.QRect(rect.right() - AVATAR_SIZE + 1, rect.top(), AVATAR_SIZE, AVATAR_SIZE)
+            content_x = avatar_rect.left() - AVATAR_GAP - content_size.width()
+        else:
+            avatar_rect = QtCore.QRect(rect.left(), rect.top(), AVATAR_SIZE, AVATAR_SIZE)
+            content_x = avatar_rect.right() + 1 + AVATAR_GAP
+        self._paint_avatar(painter, avatar_rect, item)
+
+        top = rect.top()
+        if not is_self:
+            painter.setFont(self.name_font)
+            painter.setPen(QtGui.QColor("#7f8c8d"))
+            name_height = self._name_height(item)
+            painter.drawText(QtCore.QRect(content_x, top, width, name_height),
+                             QtCore.Qt.AlignLeft | QtCore.Qt.AlignTop, item["sender_name"])
+            top += name_height
+        content_rect = QtCore.QRect(QtCore.QPoint(content_x, top), content_size)
+
+        kind = item["kind"]
+        if kind == "image":
+            self._paint_image(painter, content_rect, index, item)
+        elif kind == "voice":
+            self._paint_voice(painter, content_rect, index, item)
+        elif kind == "video":
+            self._paint_video(painter, content_rect)
+        else:
+            self._paint_text(painter, content_rect, item)
+        painter.restore()
+
+    def _bubble_brush(self, rect, is_self):
+        gradient = QtGui.QLinearGradient(QtCore.QPointF(rect.topLeft()), QtCore.QPointF(rect.topRight()))
+        gradient.setColorAt(0, QtGui.QColor("#667eea" if is_self else "#ffffff"))
+        gradient.setColorAt(1, QtGui.QColor("#764ba2" if is_self else "#f0f0f0"))
+        return QtGui.QBrush(gradient)
+
+    def _avatar_pixmap(self, item):
+        if "avatar_key" not in item:
+            item["avatar_key"] = f"avatar{AVATAR_SIZE}:{media_key(item['avatar'])}"
+        return self.loader.get(item["avatar_key"], item["avatar"], AVATAR_SIZE, self.view.generation)
+
+    def _paint_avatar(self, painter, rect, item):
+        path = QtGui.QPainterPath()
+        path.addEllipse(QtCore.QRectF(rect))
+        pixmap = self._avatar_pixmap(item) if item["avatar"] else None
+        if pixmap is not None:
+            painter.save()
+            painter.setClipPath(path)
+            painter.drawPixmap(rect, pixmap)
+            painter.restore()
+            return
+        is_self = item["is_self"]
+        gradient = QtGui.QLinearGradient(QtCore.QPointF(rect.topLeft()), QtCore.QPointF(rect.bottomRight()))
+        gradient.setColorAt(0, QtGui.QColor("#4facfe" if is_self else "#667eea"))
+        gradient.setColorAt(1, QtGui.QColor("#00f2fe" if is_self else "#764ba2"))
+        painter.fillPath(path, QtGui.QBrush(gradient))
+        painter.setFont(self.emoji_font)
+        painter.setPen(QtGui.QColor("white"))
+        painter.drawText(rect, QtCore.Qt.AlignCenter, "😊" if is_self else "👤")
+
+    def _paint_text(self, painter, rect, item):
+        is_self = item["is_self"]
+        painter.setPen(QtCore.Qt.NoPen)
+        painter.setBrush(self._bubble_brush(rect, is_self))
+        painter.drawRoundedRect(QtCore.QRectF(rect), 15, 15)
+        painter.setFont(self.text_font)
+        painter.setPen(QtGui.QColor("white" if is_self else "#2c3e50"))
+        painter.drawText(rect.adjusted(BUBBLE_PADDING[0], BUBBLE_PADDING[1], -BUBBLE_PADDING[0], -BUBBLE_PADDING[1]),
+                         QtCore.Qt.TextWordWrap, item["content"])
+
+    def _image_pixmap(self, index, item):
+        key = _item_key(item, "image")
+        pixmap = self.loader.get_image(key, item["content"], IMAGE_MAX, self.view.generation)
+        if pixmap is None:
+            if not self.loader.is_failed(key):
+                self.waiting.setdefault(key, set()).add(index.row())
+        elif item.get("image_size") != pixmap.size():
+            # Đã giải mã từ trước (ảnh trùng, mở lại hội thoại): cập nhật kích thước dòng
+            self.image_ready(index, pixmap)
+        return pixmap
+
+    def image_ready(self, index, pixmap):
+        item = index.data(MessageRole)
+        item["image_size"] = pixmap.size()
+        item.pop("layout", None)
+        self.sizeHintChanged.emit(index)
+
+    def _paint_image(self, painter, rect, index, item):
+        painter.setPen(QtCore.Qt.NoPen)
+        painter.setBrush(QtGui.QColor("white"))
+        painter.drawRoundedRect(QtCore.QRectF(rect), 10, 10)
+        pixmap = self._image_pixmap(index, item)
+        inner = rect.adjusted(5, 5, -5, -5)
+        if pixmap is None:
+            failed = self.loader.is_failed(_item_key(item, "image"))
+            painter.setPen(QtGui.QColor("#7f8c8d"))
+            painter.setFont(self.text_font)
+            painter.drawText(inner, QtCore.Qt.AlignCenter, "📷 [Lỗi tải ảnh]" if failed else "📷 Đang tải ảnh...")
+        else:
+            painter.drawPixmap(QtCore.QRect(inner.topLeft(), pixmap.size()), pixmap)
+
+    def _paint_voice(self, painter, rect, index, item):
+        is_self = item["is_self"]
+        playing = self.view.playing_row == index.row()
+        painter.setPen(QtGui.QPen(QtGui.QColor("#667eea" if is_self else "#ddd")))
+        painter.setBrush(self._bubble_brush(rect, is_self))
+        painter.drawRoundedRect(QtCore.QRectF(rect).adjusted(0.5, 0.5, -0.5, -0.5), 25, 25)
+
+        button = QtCore.QRect(rect.left() + 15, rect.center().y() - 15, 30, 30)
+        painter.setPen(QtCore.Qt.NoPen)
+        painter.setBrush(QtGui.QColor("#4CAF50"))
+        painter.drawEllipse(button)
+        painter.setPen(QtGui.QColor("white"))
+        painter.setFont(self.name_font)
+        loading = self.view.pending_media is not None and self.view.pending_media[1] == index.row()
+        painter.drawText(button, QtCore.Qt.AlignCenter, "…" if loading else "❚❚" if playing else "▶")
+
+        bar = QtCore.QRect(button.right() + 10, rect.center().y() - 3, rect.width() - 110, 6)
+        painter.setPen(QtCore.Qt.NoPen)
+        painter.setBrush(QtGui.QColor("#e0e0e0"))
+        painter.drawRoundedRect(QtCore.QRectF(bar), 3, 3)
+        if playing and self.view.progress > 0:
+            done = QtCore.QRect(bar.topLeft(), QtCore.QSize(int(bar.width() * self.view.progress), bar.height()))
+            painter.setBrush(QtGui.QColor("#4CAF50"))
+            painter.drawRoundedRect(QtCore.QRectF(done), 3, 3)
+
+        seconds = self.view.position // 1000 if playing else 0
+        painter.setPen(QtGui.QColor("#666"))
+        painter.setFont(self.name_font)
+        painter.drawText(QtCore.QRect(bar.right() + 8, rect.top(), 40, rect.height()),
+                         QtCore.Qt.AlignVCenter | QtCore.Qt.AlignLeft, f"{seconds // 60}:{seconds % 60:02d}")
+
+    def _paint_video(self, painter, rect):
+        painter.setPen(QtCore.Qt.NoPen)
+        painter.setBrush(QtGui.QColor("#333"))
+        painter.drawRoundedRect(QtCore.QRectF(rect), 12, 12)
+        painter.setPen(QtGui.QColor("white"))
+        painter.setFont(self.text_font)
+        painter.drawText(rect, QtCore.Qt.AlignCenter, "🎬 Video - nhấn để xem")
+
+
+class TranscriptView(QtWidgets.QListView):
+    """Khung chat dạng model/view: chỉ vẽ các dòng đang hiện, layout theo từng lô (Batched) nên
+    hội thoại dài không chặn giao diện; cuộn lên đầu thì phát reached_top để tải trang cũ hơn.
+
+    Ảnh, avatar và file voice/video giải mã trong ImageLoader (thread nền); chuyển hội thoại
+    thì hủy các việc chưa xong của hội thoại cũ. Voice phát bằng 1 QMediaPlayer dùng chung;
+    video mở ở cửa sổ riêng qua video_requested.
+    """
+
+    video_requested = QtCore.pyqtSignal(str)  # Đường dẫn file video được nhấn
+    reached_top = QtCore.pyqtSignal()         # Đã cuộn tới tin cũ nhất đang có
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.model = TranscriptModel(self)
+        self.setModel(self.model)
+        self.generation = 0  # Tag các việc giải mã của hội thoại đang mở
+        self.loader = ImageLoader(max_items=256, parent=self)  # Ảnh 250px nặng hơn avatar nhiều
+        self.loader.ready.connect(self.on_media_ready)
+        self.delegate = BubbleDelegate(self, self.loader)
+        self.setItemDelegate(self.delegate)
+        self.setSelectionMode(QtWidgets.QAbstractItemView.NoSelection)
+        self.setVerticalScrollMode(QtWidgets.QAbstractItemView.ScrollPerPixel)
+        self.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
+        self.setResizeMode(QtWidgets.QListView.Adjust)
+        self.setUniformItemSizes(False)
+        self.setLayoutMode(QtWidgets.QListView.Batched)
+        self.setFocusPolicy(QtCore.Qt.NoFocus)
+        self.setStyleSheet("""
+            QListView {
+                border: none;
+                background-color: transparent;
+            }
+        """)
+
+        # Voice đang phát
+        self.player = QtMultimedia.QMediaPlayer(self)
+        self.playing_row = None
+        self.position = 0
+        self.progress = 0.0
+        self.pending_media = None  # (khóa, dòng) voice/video đã nhấn, chờ ghi file xong
+        self.player.positionChanged.connect(self.on_position_changed)
+        self.player.stateChanged.connect(self.on_state_changed)
+        self.clicked.connect(self.on_clicked)
+
+        # Layout theo lô làm thanh cuộn dài dần: đang ở cuối thì giữ ở cuối
+        self.follow_bottom = True
+        self.verticalScrollBar().rangeChanged.connect(self.on_range_changed)
+        self.verticalScrollBar().valueChanged.connect(self.on_scrolled)
+
+    def add_items(self, items):
+        self.follow_bottom = True
+        self.model.extend(items)
+        QtCore.QTimer.singleShot(0, self.scrollToBottom)
+
+    def prepend_items(self, items):
+        """Thêm trang tin cũ lên đầu, giữ nguyên tin đang xem trên màn hình"""
+        if not items:
+            return
+        count = len(items)
+        # Các chỉ số dòng đang giữ dịch xuống theo số dòng chèn thêm
+        if self.playing_row is not None:
+            self.playing_row += count
+        if self.pending_media is not None:
+            self.pending_media = (self.pending_media[0], self.pending_media[1] + count)
+        for rows in self.delegate.waiting.values():
+            shifted = {row + count for row in rows}
+            rows.clear()
+            rows.update(shifted)
+        self.follow_bottom = False
+        self.model.prepend(items)
+        self.doItemsLayout()
+        self.scrollTo(self.model.index(count), QtWidgets.QAbstractItemView.PositionAtTop)
+
+    def on_range_changed(self, minimum, maximum):
+        if self.follow_bottom:
+            self.verticalScrollBar().setValue(maximum)
+
+    def on_scrolled(self, value):
+        scrollbar = self.verticalScrollBar()
+        self.follow_bottom = value >= scrollbar.maximum()
+        if value == scrollbar.minimum() and scrollbar.maximum() > scrollbar.minimum():
+            self.reached_top.emit()
+
+    def clear(self):
+        self.stop_playback()
+        self.loader.cancel(self.generation)
+        self.generation += 1
+        self.delegate.waiting.clear()
+        self.pending_media = None
+        self.follow_bottom = True
+        self.model.clear()
+
+    def on_media_ready(self, key):
+        result = self.loader.results.get(key)  # None: giải mã lỗi
+        rows = self.delegate.waiting.pop(key, ())
+        if result is not None:
+            for row in rows:
+                if row < self.model.rowCount():
+                    self.delegate.image_ready(self.model.index(row), result)
+        if self.pending_media is not None and self.pending_media[0] == key:
+            row = self.pending_media[1]
+            self.pending_media = None
+            if result is None:
+                self.model.row_changed(row)
+                QtWidgets.QMessageBox.warning(self, "Lỗi", "Không thể mở tin nhắn media")
+            else:
+                self._open_media(row, result)
+        self.viewport().update()
+
+    def on_clicked(self, index):
+        item = index.data(MessageRole)
+        if item["kind"] not in ("voice", "video"):
+            return
+        if item["kind"] == "voice" and self.playing_row == index.row():
+            self.stop_playback()
+            return
+        key = _item_key(item, item["kind"])
+        path = self.loader.get_file(key, item["content"], ".wav" if item["kind"] == "voice" else ".mp4",
+                                    self.generation)
+        if path is not None:
+            self._open_media(index.row(), path)
+        elif self.loader.is_failed(key):
+            QtWidgets.QMessageBox.warning(self, "Lỗi", "Không thể mở tin nhắn media")
+        else:
+            self.pending_media = (key, index.row())
+            self.model.row_changed(index.row())
+
+    def _open_media(self, row, path):
+        if self.model.items[row]["kind"] == "video":
+            self.video_requested.emit(path)
+            return
+        self.stop_playback()
+        self.playing_row = row
+        self.player.setMedia(QtMultimedia.QMediaContent(QtCore.QUrl.fromLocalFile(path)))
+        self.player.play()
+        self.model.row_changed(row)
+
+    # === Voice ===
+
+    def stop_playback(self):
+        row = self.playing_row
+        self.playing_row = None
+        self.position = 0
+        self.progress = 0.0
+        self.player.stop()
+        if row is not None and row < self.model.rowCount():
+            self.model.row_changed(row)
+
+    def on_position_changed(self, position):
+        if self.playing_row is None:
+            return
+        duration = self.player.duration()
+        self.position = position
+        self.progress = position / duration if duration > 0 else 0.0
+        self.model.row_changed(self.playing_row)
+
+    def on_state_changed(self, state):
+        if state == QtMultimedia.QMediaPlayer.StoppedState and self.playing_row is not None:
+            self.stop_playback()
@@ -8,10 +8,160 @@ DATABASE_CONFIG = {
 
 SERVER_CONFIG = {
     "host": "10.50.192.2",  # IP chung
-    "port": 5001         # Port cho socket TCP
+    "port": 5001,        # Port cho socket TCP
+    "reuse_port": True   # SO_REUSEPORT (Linux/BSD): process mới bind cùng port khi process cũ còn chạy
 }
 
 MULTICAST_CONFIG = {
     "group": "239.0.0.1",  # Multicast IP (phạm vi local)
-    "port": 5008
-}
\ No newline at end of file
+    "port": 5008,
+    "ttl": 1,                 # Không cho gói tin ra khỏi mạng LAN
+    "interface": "0.0.0.0"    # Card mạng dùng cho multicast ("127.0.0.1" để test loopback)
+}
+
+VOICE_ROOM_CONFIG = {
+    "port_base": 5010,        # Mỗi phòng thoại dùng 1 port: port_base + slot
+    "max_rooms": 16,
+    "max_members": 32,
+    "sample_rate": 8000,      # 8kHz mono 16-bit, nén G.711 mu-law
+    "frame_ms": 20,           # Mỗi gói UDP chứa 20ms âm thanh
+    "jitter_frames": 3,       # Số frame đệm trước khi phát
+    "max_conceal_frames": 5   # Số frame bù mất gói tối đa trước khi im lặng
+}
+
+PRESENCE_CONFIG = {
+    "heartbeat_interval": 5,  # Giây giữa 2 gói heartbeat (để client phát hiện mất gói cuối)
+    "history_size": 256       # Số sự kiện gần nhất giữ lại để client bù khi mất gói
+}
+
+TYPING_CONFIG = {
+    "interval": 2.0,          # Mỗi cặp người gửi-nhận: tối đa 1 sự kiện "đang nhập" mỗi interval giây
+    "display_timeout": 4.0    # Client ẩn chỉ báo nếu không nhận thêm sự kiện sau khoảng này
+}
+
+READ_MARKER_CONFIG = {
+    "flush_delay": 1.0        # Client gom các lần đánh dấu đã đọc trong khoảng này thành 1 sự kiện mỗi hội thoại
+}
+
+REQUEST_LIMITS_CONFIG = {
+    "max_frame_bytes": 100 * 1024 * 1024,  # Frame lớn nhất server chấp nhận (video)
+    "max_media_bytes": 100 * 1024 * 1024,  # send_image/send_voice/send_video/avatar
+    "max_control_bytes": 1024 * 1024,      # Các action còn lại
+    # Token bucket theo user (chưa đăng nhập: theo IP): rate request/giây, burst request dồn được
+    "rate_limits": {
+        "register": {"rate": 0.2, "burst": 3},
+        "login": {"rate": 0.5, "burst": 5},
+        "change_password": {"rate": 0.2, "burst": 3},
+        "message": {"rate": 20, "burst": 40},
+        "send_group_message": {"rate": 10, "burst": 20},
+        "search_messages": {"rate": 5, "burst": 10}
+    },
+    # Token bucket chung cả server: chặn cơn bão reconnect sau khi restart
+    "global_rate_limits": {
+        "resume_session": {"rate": 100, "burst": 200}
+    },
+    # IP mà nhiều client thật dùng chung (máy chạy load test, reverse proxy): bucket chưa đăng nhập
+    # tính theo từng kết nối thay vì theo IP
+    "per_connection_ips": []
+}
+
+METRICS_CONFIG = {
+    "http_enabled": True,
+    "http_host": "127.0.0.1",  # Chỉ cho máy local scrape (Prometheus / load test)
+    "http_port": 9108,
+    "admin_user_ids": [1]       # User được gọi action get_metrics
+}
+
+LOGGING_CONFIG = {
+    "filename": "server.log",
+    "level": "DEBUG",
+    "format": "%(asctime)s - %(levelname)s - %(message)s",
+    "max_bytes": 10 * 1024 * 1024,  # Xoay file khi vượt 10MB
+    "backup_count": 5,
+    "queue_size": 10000,            # Hàng đợi đầy thì bỏ bản ghi thay vì chặn thread xử lý
+    # Tỉ lệ giữ lại bản ghi DEBUG theo nhóm (tên module cuối của logger)
+    "sampling": {
+        "auth_controller": 0.1,
+        "user_model": 0.1
+    },
+    # Số bản ghi tối đa mỗi giây theo nhóm (WARNING trở xuống); ERROR luôn được ghi
+    "rate_limits": {
+        "auth_controller": 200,
+        "user_model": 200,
+        "action_router": 50
+    }
+}
+
+STORAGE_CONFIG = {
+    "backend": "mysql",         # mysql | sqlite
+    "sqlite_path": "chat.db",   # ":memory:" để chạy tạm (load test, benchmark)
+    "bcrypt_rounds": 12
+}
+
+SEARCH_CONFIG = {
+    "page_size": 20,
+    "max_page_size": 50,
+    "snippet_chars": 200  # Số ký tự đầu của tin nhắn giữ trong chỉ mục để trả về kết quả
+}
+
+ARCHIVE_CONFIG = {
+    "enabled": True,
+    "directory": "archive",     # Mỗi cặp user 1 thư mục chứa các segment .json.gz
+    "older_than_days": 180,     # Tin 1-1 cũ hơn mức này chuyển khỏi bảng chat_messages
+    "batch_size": 500,          # Số tin mỗi lần chuyển (mỗi batch giữ db_lock 1 lần)
+    "interval_hours": 24,
+    "compress_level": 6,
+    "cache_segments": 32        # Số segment đã giải nén giữ trong RAM
+}
+
+PASSWORD_CONFIG = {
+    "workers": 4,        # Số process chạy bcrypt (mỗi process dùng trọn 1 lõi CPU)
+    "max_pending": 64,   # Quá số yêu cầu đang chờ này thì trả lỗi "đang bận" ngay
+    "timeout": 10        # Giây chờ tối đa 1 lần băm/kiểm tra
+}
+
+SESSION_CONFIG = {
+    "secret_file": "session.key",  # Khóa HMAC; giữ nguyên qua các lần khởi động lại để token còn hiệu lực
+    "ttl": 7 * 24 * 3600           # Token hết hạn sau 7 ngày
+}
+
+HEARTBEAT_CONFIG = {
+    "ping_interval": 5,     # Giây giữa 2 lần server ping mỗi kết nối
+    "poll_interval": 1,     # Timeout của mỗi lần recv/send (để kiểm tra tiến độ)
+    "stall_timeout": 15     # Không nhận được byte nào (kể cả pong) trong khoảng này -> đóng kết nối
+}
+
+RECONNECT_CONFIG = {
+    "base_delay": 0.5,      # Giây; lần thử thứ n chờ ngẫu nhiên trong [0, base_delay * 2^n] (full jitter)
+    "max_delay": 30,        # Trần thời gian chờ giữa 2 lần thử
+    "catch_up_limit": 500   # Khi resume, tin bị lỡ được đọc và gửi lại theo trang cỡ này (mỗi loại 1-1, nhóm) tới khi hết
+}
+
+SHUTDOWN_CONFIG = {
+    "drain_timeout": 30,                 # Giây chờ các request đang xử lý/upload xong trước khi cắt
+    "retry_after": 5,                    # Giây client nên chờ trước khi kết nối lại (tắt hẳn, không handoff)
+    "spool_file": "offline_spool.json",  # Hàng đợi tin offline ghi ra đĩa khi tắt, nạp lại khi chạy
+    "listen_fd_env": "CHAT_LISTEN_FD"    # Biến môi trường truyền socket đang listen cho process mới
+}
+
+CLUSTER_CONFIG = {
+    "enabled": False,             # Chạy nhiều server chat sau 1 địa chỉ, chuyển tin qua message bus (presence qua TCP, tắt multicast)
+    "node_id": None,              # None -> "hostname:port"
+    "bus": "tcp",                 # "tcp": broker riêng; "memory": các node chạy chung 1 process (thử nghiệm)
+    "broker_host": "127.0.0.1",
+    "broker_port": 5100,
+    "announce_interval": 10,      # Giây giữa 2 lần node gửi lại danh sách user của mình
+    "registry_ttl": 30,           # Node im lặng quá lâu thì coi như đã chết, bỏ các user của nó
+    "delivery_workers": 4,        # Thread gửi tin từ bus tới client của node (chia theo user, giữ thứ tự)
+    "broker_queue_size": 10000    # Số frame chờ gửi tối đa cho mỗi node ở broker; đầy thì bỏ frame của node đó
+}
+
+CLIENT_STORE_CONFIG = {
+    "directory": "client_data",   # Mỗi user 1 file SQLite lưu tin đã tải, mở lại hội thoại không tải lại từ đầu
+    "page_size": 50               # Số tin mỗi lần tải vào khung chat (mở hội thoại, cuộn lên đầu)
+}
+
+MEDIA_CACHE_CONFIG = {
+    "directory": "client_data/media",   # File media đã giải mã, tên theo hash nội dung
+    "max_bytes": 512 * 1024 * 1024      # Vượt quá thì xóa file lâu chưa dùng nhất (LRU)
+}
@@ -0,0 +1,167 @@
+# server/controllers/action_router.py
+import threading
+import time
+import logging
+from server.utils.metrics import REGISTRY
+
+ACTION_SECONDS = REGISTRY.histogram(
+    "chat_action_duration_seconds", "Thời gian xử lý mỗi action", labels=("action",)
+)
+ACTION_ERRORS = REGISTRY.counter(
+    "chat_action_errors_total", "Số action trả về lỗi hoặc ném exception", labels=("action",)
+)
+
+logger = logging.getLogger(__name__)
+
+UNAUTHORIZED = {"status": "error", "message": "Không xác định user"}
+
+
+class RequestContext:
+    """Thông tin của 1 request đang được xử lý"""
+
+    def __init__(self, controller, client_socket, request, size):
+        self.controller = controller
+        self.client_socket = client_socket
+        self.request = request
+        self.size = size  # Số bytes của frame JSON
+        self.action = request.get("action")
+
+    @property
+    def user_id(self):
+        return self.controller.clients.get(self.client_socket)
+
+    @property
+    def peer_ip(self):
+        """IP của client, None nếu không xác định được"""
+        conn = self.controller.connections.get(self.client_socket)
+        if conn is not None and conn.address:
+            return conn.address[0]
+        try:
+            return self.client_socket.getpeername()[0]
+        except (OSError, AttributeError, IndexError):
+            return None
+
+    def get(self, key, default=None):
+        return self.request.get(key, default)
+
+
+class ActionHandler:
+    """1 action: hàm xử lý + chuỗi middleware + độ trễ/lỗi đo riêng"""
+
+    def __init__(self, name, func, middlewares=()):
+        self.name = name
+        self.func = func
+        self.middlewares = list(middlewares)
+
+        # Ghép middleware từ ngoài vào trong: middlewares[0] chạy đầu tiên
+        call = func
+        for middleware in reversed(self.middlewares):
+            call = self._wrap(middleware, call)
+        self.call = call
+
+    @staticmethod
+    def _wrap(middleware, call_next):
+        return lambda ctx: middleware(ctx, call_next)
+
+    def __call__(self, ctx):
+        start = time.perf_counter()
+        try:
+            response = self.call(ctx)
+        except Exception:
+            ACTION_SECONDS.observe(time.perf_counter() - start, self.name)
+            ACTION_ERRORS.inc(1, self.name)
+            raise
+        ACTION_SECONDS.observe(time.perf_counter() - start, self.name)
+        if isinstance(response, dict) and response.get("status") == "error":
+            ACTION_ERRORS.inc(1, self.name)
+        return response
+
+    def stats(self):
+        return {
+            **ACTION_SECONDS.snapshot().get(self.name, {"count": 0}),
+            "errors": ACTION_ERRORS.get(self.name)
+        }
+
+
+class ActionRouter:
+    """Bảng ánh xạ action -> handler, thay cho chuỗi if/elif trong handle_client.
+
+    Handler nhận RequestContext, trả về dict response hoặc None nếu không cần trả lời.
+    Middleware có dạng middleware(ctx, call_next) và có thể trả lời sớm thay cho handler.
+    """
+
+    def __init__(self, middlewares=()):
+        self.middlewares = list(middlewares)  # Áp dụng cho mọi action
+        self.handlers = {}
+
+    def register(self, action, func, middlewares=()):
+        if action in self.handlers:
+            raise ValueError(f"Action {action} đã được đăng ký")
+        self.handlers[action] = ActionHandler(action, func, self.middlewares + list(middlewares))
+        return self.handlers[action]
+
+    def dispatch(self, ctx):
+        handler = self.handlers.get(ctx.action)
+        if handler is None:
+            return {"status": "error", "message": "Hành động không hợp lệ"}
+        return handler(ctx)
+
+    def stats(self):
+        return {name: handler.stats() for name, handler in self.handlers.items()}
+
+
+# === Middleware dùng chung ===
+
+def require_auth(ctx, call_next):
+    """Chỉ cho phép socket đã đăng nhập"""
+    if ctx.user_id is None:
+        return dict(UNAUTHORIZED)
+    return call_next(ctx)
+
+
+def max_size(limit):
+    """Từ chối request có frame lớn hơn limit bytes"""
+    def middleware(ctx, call_next):
+        if ctx.size > limit:
+            logger.warning("Request %s too large: %d bytes", ctx.action, ctx.size)
+            return {"status": "error", "message": "Dữ liệu quá lớn"}
+        return call_next(ctx)
+    return middleware
+
+
+def rate_limit(rate, burst, shared=False, per_connection_ips=()):
+    """Token bucket theo user, hoặc theo IP nếu chưa đăng nhập (mở kết nối mới không được bucket
+    mới, nên login/register không bị dò mật khẩu hàng loạt): rate request/giây.
+    shared=True: 1 bucket chung cho mọi kết nối.
+    per_connection_ips: IP dùng chung cho nhiều client thật (load test, proxy) thì tính theo kết nối"""
+    buckets = {}  # key -> [số token, thời điểm cập nhật]
+    lock = threading.Lock()
+    per_connection_ips = frozenset(per_connection_ips)
+
+    def middleware(ctx, call_next):
+        if shared:
+            key = None
+        elif ctx.user_id is not None:
+            key = ctx.user_id
+        else:
+            ip = ctx.peer_ip
+            if ip is None or ip in per_connection_ips:
+                key = ("conn", id(ctx.client_socket))
+            else:
+                key = ("ip", ip)
+        now = time.monotonic()
+        with lock:
+            tokens, updated = buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens < 1:
+                buckets[key] = (tokens, now)
+                retry_after = round((1 - tokens) / rate, 2)
+                return {"status": "error", "message": "Bạn thao tác quá nhanh, vui lòng thử lại",
+                        "retry_after": retry_after}
+            buckets[key] = (tokens - 1, now)
+            if len(buckets) > 10000:
+                # Bỏ các bucket đã đầy lại (lâu không dùng)
+                for k in [k for k, (t, u) in buckets.items() if t + (now - u) * rate >= burst]:
+                    del buckets[k]
+        return call_next(ctx)
+    return middleware
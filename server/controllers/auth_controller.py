@@ -1,375 +1,786 @@
 # server/controllers/auth_controller.py
 import json
+import os
 import socket
 import struct
-from config.config import SERVER_CONFIG
-import logging
-import threading
+import subprocess
+import sys
 import time
-
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    filename='server.log',
-    filemode='a'
+from config.config import (
+    SERVER_CONFIG, REQUEST_LIMITS_CONFIG, METRICS_CONFIG, STORAGE_CONFIG, SEARCH_CONFIG, ARCHIVE_CONFIG,
+    HEARTBEAT_CONFIG, RECONNECT_CONFIG, SHUTDOWN_CONFIG, CLUSTER_CONFIG
 )
+import logging
+import threading
+from functools import partial
+from server.controllers.action_router import ActionRouter, RequestContext, require_auth, max_size, rate_limit
+from server.controllers.voice_room_controller import VoiceRoomManager
+from server.controllers.presence_controller import PresencePublisher
+from server.controllers.typing_controller import TypingCoalescer
+from server.controllers.search_controller import MessageSearchIndex, direct_key, group_key
+from server.controllers.heartbeat_controller import ConnectionState, HeartbeatMonitor
+from server.controllers.cluster_controller import ClusterRouter
+from server.utils.metrics import REGISTRY, start_metrics_server
+from server.utils.logging_setup import setup_logging
+from server.utils.session_tokens import SessionTokens
+from server.utils.password_hasher import HASHER
+from server.utils.message_bus import create_bus
+from server.models.storage import create_model
+from server.models.archive import ArchiveJob
+
+setup_logging()
 logger = logging.getLogger(__name__)
 
+# Tên file mặc định theo loại tin nhắn (nhóm và 1-1)
+GROUP_MESSAGE_DEFAULT_NAMES = {
+    "text": None,
+    "image": "image.jpg",
+    "voice": "voice.wav",
+    "video": "video.mp4"
+}
+
+# Câu trả lời khi gửi thành công tin nhắn 1-1 theo loại
+DIRECT_MESSAGE_REPLIES = {
+    "text": "Tin nhắn đã gửi",
+    "image": "Ảnh đã gửi",
+    "voice": "Tin nhắn thoại đã gửi",
+    "video": "Video đã gửi"
+}
+
+REQUEST_BYTES = REGISTRY.counter("chat_request_bytes_total", "Số bytes request nhận theo action", labels=("action",))
+RESPONSE_BYTES = REGISTRY.counter("chat_response_bytes_total", "Số bytes response trả lời theo action", labels=("action",))
+SENT_BYTES = REGISTRY.counter("chat_sent_bytes_total", "Tổng số bytes server đã gửi (cả push và fanout)")
+ACTIVE_CONNECTIONS = REGISTRY.gauge("chat_active_connections", "Số kết nối TCP đang mở")
+
 
 class ChatController:
-    def __init__(self):
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.server_socket.bind((SERVER_CONFIG["host"], SERVER_CONFIG["port"]))
-        self.server_socket.listen(5)
+    def __init__(self, host=SERVER_CONFIG["host"], port=SERVER_CONFIG["port"], model=None, bus=None):
+        self.server_socket = self._open_listener(host, port)
+        self.host, self.port = self.server_socket.getsockname()  # port=0 -> port hệ thống cấp
+        self.accepting = False
+        self.accept_stopped = threading.Event()
+        self.handlers_running = 0  # Thread handle_client đã tạo nhưng chưa kết thúc
+        self.draining = False  # Đang tắt: không nhận request mới
+        self.shutdown_done = threading.Event()
+        self.metrics_server = None
+        self.archive_job = None
         self.clients = {}
+        self.connections = {}  # socket -> ConnectionState (cả kết nối chưa đăng nhập)
         self.user_sockets = {}
         self.offline_messages = {}
         self.lock = threading.Lock()
-        try:
-            from server.models.user_model import UserModel
-            self.model = UserModel()
-            logger.info("UserModel initialized successfully")
-        except Exception as e:
-            logger.error(f"Không thể khởi tạo UserModel: {str(e)}")
-            raise
+        self.voice_rooms = VoiceRoomManager()
+        # Nhiều node: tin cho user ở node khác đi qua message bus (bus truyền vào dùng cho thử nghiệm)
+        if bus is None and CLUSTER_CONFIG["enabled"]:
+            bus = create_bus()
+        # Mỗi node đánh seq presence riêng -> multicast chỉ dùng khi chạy 1 node, cluster đẩy qua TCP
+        self.presence = PresencePublisher(multicast=bus is None)
+        self.presence_tcp_sockets = set()  # Client không nhận được multicast -> đẩy qua TCP
+        self.presence.add_tcp_listener(self.push_presence_tcp)
+        self.typing = TypingCoalescer()
+        self.search_index = MessageSearchIndex()
+        self.sessions = SessionTokens()
+        self.heartbeat = HeartbeatMonitor(self)
+        self.cluster = ClusterRouter(self, bus) if bus is not None else None
+        self.router = ActionRouter()
+        self._register_actions()
+        self._register_gauges()
+        if model is not None:
+            self.model = model  # Model truyền từ ngoài (vd: SQLite :memory: cho load test)
+        else:
+            try:
+                self.model = create_model()
+                logger.info("Storage backend %s initialized successfully", STORAGE_CONFIG["backend"])
+            except Exception as e:
+                logger.error(f"Không thể khởi tạo model lưu trữ: {str(e)}")
+                raise
+        # Dựng chỉ mục tìm kiếm nền; tin mới trong lúc dựng vẫn được thêm (trùng thì bỏ qua)
+        threading.Thread(target=self.search_index.build, args=(self.model,), daemon=True).start()
+        self._load_offline_spool()
+
+    def _open_listener(self, host, port):
+        """Socket listen mới, hoặc socket process cũ truyền lại khi handoff (không từ chối kết nối nào)"""
+        inherited_fd = os.environ.pop(SHUTDOWN_CONFIG["listen_fd_env"], None)
+        if inherited_fd is not None:
+            logger.info("Using inherited listening socket (fd %s)", inherited_fd)
+            return socket.socket(fileno=int(inherited_fd))
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if SERVER_CONFIG["reuse_port"] and hasattr(socket, "SO_REUSEPORT"):
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        server_socket.bind((host, port))
+        server_socket.listen(socket.SOMAXCONN)  # Nhiều client kết nối cùng lúc (load test)
+        return server_socket
 
     def _send_all(self, sock, data):
-        """Gửi tất cả dữ liệu, đảm bảo gửi đủ"""
+        """Gửi tất cả dữ liệu, đảm bảo gửi đủ; chỉ bỏ cuộc khi peer ngừng nhận quá stall_timeout"""
         total_sent = 0
+        last_progress = time.monotonic()
         while total_sent < len(data):
-            sent = sock.send(data[total_sent:])
+            try:
+                sent = sock.send(data[total_sent:])
+            except socket.timeout:
+                if time.monotonic() - last_progress > HEARTBEAT_CONFIG["stall_timeout"]:
+                    raise
+                continue
             if sent == 0:
                 raise socket.error("Socket connection broken")
             total_sent += sent
+            last_progress = time.monotonic()
+        SENT_BYTES.inc(total_sent)
         return total_sent
 
-    def _recv_all(self, sock, length):
-        """Nhận đủ số bytes cần thiết"""
+    def _recv_all(self, sock, length, conn=None):
+        """Nhận đủ số bytes cần thiết; timeout ngắn chỉ để kiểm tra tiến độ của kết nối"""
         data = b''
         while len(data) < length:
-            chunk = sock.recv(min(length - len(data), 10485760))  # 10MB chunks
+            try:
+                chunk = sock.recv(min(length - len(data), 10485760))  # 10MB chunks
+            except socket.timeout:
+                if conn is None or conn.stalled():
+                    raise
+                continue
             if not chunk:
                 raise socket.error("Socket connection broken")
+            if conn is not None:
+                conn.touch()
             data += chunk
         return data
 
-    def send_to_client(self, client_socket, message):
+    def encode_frame(self, message):
+        """JSON + length prefix; encode 1 lần rồi gửi cùng bytes cho nhiều socket"""
+        data = json.dumps(message).encode('utf-8')
+        return struct.pack('>I', len(data)) + data
+
+    def send_frame(self, client_socket, frame, blocking=True):
+        conn = self.connections.get(client_socket)
         try:
             if client_socket.fileno() != -1:
-                data = json.dumps(message).encode('utf-8')
-                # Gửi với length prefix
-                length = struct.pack('>I', len(data))
-                self._send_all(client_socket, length + data)
+                if conn is None:
+                    self._send_all(client_socket, frame)
+                    return True
+                # Không để frame của các thread khác xen giữa
+                if not conn.send_lock.acquire(blocking):
+                    return False
+                try:
+                    self._send_all(client_socket, frame)
+                finally:
+                    conn.send_lock.release()
                 return True
         except Exception as e:
             logger.error(f"Lỗi gửi message: {str(e)}")
             return False
         return False
 
-    def handle_client(self, client_socket):
-        client_socket.settimeout(600)  # Tăng timeout cho video lớn (10 phút)
+    def send_to_client(self, client_socket, message):
+        try:
+            frame = self.encode_frame(message)
+        except Exception as e:
+            logger.error(f"Lỗi gửi message: {str(e)}")
+            return False
+        return self.send_frame(client_socket, frame)
+
+    def fanout_frame(self, frame, user_ids, route=True, message_id=None):
+        """Gửi cùng 1 frame cho nhiều user; user offline giữ chung 1 tham chiếu tới frame.
+        route: user không kết nối tới node này thì chuyển qua cluster trước khi xếp hàng offline.
+        message_id: id tin nhóm của frame (None: sự kiện), xếp hàng kèm frame để resume bỏ bản trùng.
+        Chỉ giữ self.lock lúc lấy socket: 1 thành viên nhận chậm (tới stall_timeout) không được
+        chặn đăng nhập, deliver của user khác hay heartbeat"""
+        with self.lock:
+            targets = [(user_id, self.user_sockets.get(user_id)) for user_id in user_ids]
+        delivered = 0
+        missing, failed = [], []
+        for user_id, user_socket in targets:
+            if user_socket is None:
+                (missing if route and self.cluster is not None else failed).append(user_id)
+            elif self.send_frame(user_socket, frame):
+                delivered += 1
+            else:
+                failed.append(user_id)
+        if missing:
+            unrouted = self.cluster.fanout(frame, missing, message_id)
+            delivered += len(missing) - len(unrouted)
+            failed.extend(unrouted)
+        if failed:
+            entry = (message_id, frame)
+            with self.lock:
+                for user_id in failed:
+                    self.offline_messages.setdefault(user_id, []).append(entry)
+        return delivered
+
+    def notify_voice_room(self, room_info):
+        """Báo danh sách thành viên mới cho mọi người trong phòng thoại"""
+        event = {"action": "voice_room_update", **room_info}
+        with self.lock:
+            member_sockets = [self.user_sockets.get(m) for m in room_info["members"]]
+        for member_socket in member_sockets:
+            if member_socket:
+                self.send_to_client(member_socket, event)
+
+    def push_presence_tcp(self, event):
+        """Gửi sự kiện presence qua TCP cho các client đã đăng ký fallback"""
+        with self.lock:
+            sockets = list(self.presence_tcp_sockets)
+        frame = self.encode_frame(event)
+        dead = [sock for sock in sockets if not self.send_frame(sock, frame)]
+        if dead:
+            with self.lock:
+                self.presence_tcp_sockets.difference_update(dead)
+
+    def deliver(self, receiver_id, msg_data, route=True):
+        """Gửi tin cho 1 user (qua node khác nếu user ở đó); offline hoặc gửi lỗi thì xếp vào hàng đợi offline"""
+        with self.lock:
+            receiver_socket = self.user_sockets.get(receiver_id)
+        if receiver_socket and self.send_to_client(receiver_socket, msg_data):
+            logger.debug("Message sent to user %s", receiver_id)
+            return True
+        if receiver_socket is None and route and self.cluster is not None \
+                and self.cluster.deliver(receiver_id, msg_data):
+            logger.debug("Message for user %s routed to another node", receiver_id)
+            return True
+        with self.lock:
+            self.offline_messages.setdefault(receiver_id, []).append(msg_data)
+        logger.debug("User %s offline, message saved", receiver_id)
+        return False
+
+    def send_event_to_user(self, user_id, event, route=True):
+        """Sự kiện tạm thời (vd: typing): gửi nếu user online ở đâu đó, không xếp hàng offline"""
+        with self.lock:
+            user_socket = self.user_sockets.get(user_id)
+        if user_socket:
+            return self.send_to_client(user_socket, event)
+        if route and self.cluster is not None:
+            return self.cluster.deliver(user_id, event, queue=False)
+        return False
+
+    def _register_gauges(self):
+        # Tính khi scrape, không tốn gì trên đường xử lý request
+        REGISTRY.gauge("chat_threads", "Số thread đang chạy", threading.active_count)
+        REGISTRY.gauge("chat_authenticated_users", "Số user đã đăng nhập", lambda: len(self.user_sockets))
+        REGISTRY.gauge(
+            "chat_offline_queue_depth", "Tổng số tin chờ gửi cho user offline",
+            lambda: sum(len(q) for q in list(self.offline_messages.values()))
+        )
+
+    # === Đăng ký action ===
+
+    def _register_actions(self):
+        limits = REQUEST_LIMITS_CONFIG
+        control = max_size(limits["max_control_bytes"])
+        media = max_size(limits["max_media_bytes"])
+
+        def limited(action):
+            middlewares = []
+            config = limits["global_rate_limits"].get(action)
+            if config:
+                middlewares.append(rate_limit(config["rate"], config["burst"], shared=True))
+            config = limits["rate_limits"].get(action)
+            if config:
+                middlewares.append(rate_limit(config["rate"], config["burst"],
+                                              per_connection_ips=limits["per_connection_ips"]))
+            return middlewares
+
+        public = {
+            "register": self.handle_register,
+            "login": self.handle_login,
+            "get_users": self.handle_get_users,
+            "get_user": self.handle_get_user,
+            "resume_session": self.handle_resume_session,
+            "get_voice_rooms": self.handle_get_voice_rooms,
+            "get_presence": self.handle_get_presence,
+            "subscribe_presence": self.handle_subscribe_presence,
+            "pong": self.handle_pong,
+            "hello": self.handle_hello
+        }
+        for action, func in public.items():
+            self.router.register(action, func, [control] + limited(action))
+
+        authed = {
+            "typing": self.handle_typing,
+            "get_chat_history": self.handle_get_chat_history,
+            "get_recent_chats": self.handle_get_recent_chats,
+            "message": partial(self.handle_direct_message, kind="text"),
+            "get_profile": self.handle_get_profile,
+            "change_password": self.handle_change_password,
+            "mark_read": self.handle_mark_read,
+            "get_unread_counts": self.handle_get_unread_counts,
+            "create_group": self.handle_create_group,
+            "get_groups": self.handle_get_groups,
+            "get_group_history": self.handle_get_group_history,
+            "join_voice_room": self.handle_join_voice_room,
+            "leave_voice_room": self.handle_leave_voice_room,
+            "search_messages": self.handle_search_messages,
+            "get_metrics": self.handle_get_metrics,
+            "logout": self.handle_logout
+        }
+        for action, func in authed.items():
+            self.router.register(action, func, [require_auth, control] + limited(action))
+
+        # Các action mang media được phép frame lớn
+        authed_media = {
+            "send_image": partial(self.handle_direct_message, kind="image"),
+            "send_voice": partial(self.handle_direct_message, kind="voice"),
+            "send_video": partial(self.handle_direct_message, kind="video"),
+            "send_group_message": self.handle_send_group_message,
+            "update_profile": self.handle_update_profile
+        }
+        for action, func in authed_media.items():
+            self.router.register(action, func, [require_auth, media] + limited(action))
+
+    # === Tài khoản ===
+
+    def handle_register(self, ctx):
+        response = self.model.register_user(ctx.get("display_name"), ctx.get("email"), ctx.get("password"))
+        if response.get("status") == "success":
+            new_user_id = self.model.get_user_id(ctx.get("email"))
+            if new_user_id:
+                self.presence.directory_changed(new_user_id)
+                if self.cluster is not None:
+                    self.cluster.directory_changed(new_user_id)
+        return response
+
+    def _bind_session(self, client_socket, user_id, response, catch_up=None):
+        """Gắn socket với user sau khi xác thực, trả lời rồi mới gửi tin bị lỡ và tin chờ offline
+        (client đọc frame đầu tiên làm phản hồi đăng nhập).
+        catch_up: (after_id, after_group_id) mốc tin cuối client đã nhận khi resume"""
+        if self.clients.get(client_socket) not in (None, user_id):
+            self._unbind_session(client_socket)  # Đăng nhập tài khoản khác trên cùng kết nối
+        with self.lock:
+            self.clients[client_socket] = user_id
+            self.user_sockets[user_id] = client_socket
+        self.presence.user_online(user_id)
+        if self.cluster is not None:
+            self.cluster.user_online(user_id)
+        self.send_to_client(client_socket, response)
+        conn = self.connections.get(client_socket)
+        if conn is not None:
+            conn.ping_enabled = True
+
+        # Tin có id <= mốc (1-1, nhóm) đã được gửi lại từ database, bỏ bản trùng trong hàng đợi
+        caught_up = self._send_missed(client_socket, user_id, *catch_up) if catch_up else None
+
+        with self.lock:
+            pending = self.offline_messages.pop(user_id, [])
+        for msg in pending:
+            if isinstance(msg, tuple):
+                # Tin/sự kiện nhóm xếp hàng dạng (message_id, frame đã encode sẵn)
+                message_id, frame = msg
+                if caught_up is None or message_id is None or message_id > caught_up[1]:
+                    self.send_frame(client_socket, frame)
+            elif caught_up is not None and msg.get("action") == "message" \
+                    and (msg.get("message_id") or 0) <= caught_up[1 if "group_id" in msg else 0]:
+                continue
+            else:
+                self.send_to_client(client_socket, msg)
+
+    def _send_missed(self, client_socket, user_id, after_id, after_group_id):
+        """Gửi lại mọi tin bị lỡ sau mốc, từng trang catch_up_limit tin mỗi loại (không giữ hết
+        trong RAM) tới khi hết; trả về mốc (id tin 1-1, id tin nhóm) cuối cùng đã gửi"""
+        limit = RECONNECT_CONFIG["catch_up_limit"]
+        while True:
+            direct, group = self.model.get_missed_messages(user_id, after_id, after_group_id, limit)
+            if direct:
+                after_id = direct[-1]["id"]
+            if group:
+                after_group_id = group[-1]["id"]
+            for m in direct + group:
+                if not self.send_to_client(client_socket, {"action": "message", "message_id": m.pop("id"), **m}):
+                    return after_id, after_group_id  # Client đã ngắt: lần resume sau gửi tiếp từ mốc của nó
+            if len(direct) < limit and len(group) < limit:
+                return after_id, after_group_id
+
+    def _unbind_session(self, client_socket):
+        """Tách user khỏi socket (đăng xuất hoặc mất kết nối); socket vẫn có thể đăng nhập lại"""
+        with self.lock:
+            user_id = self.clients.pop(client_socket, None)
+            if user_id is None:
+                return
+            logger.info("User %s disconnected", user_id)
+            if self.user_sockets.get(user_id) is not client_socket:
+                return  # User đã kết nối lại bằng socket khác trước khi socket cũ đóng
+            del self.user_sockets[user_id]
+        if self.cluster is None:
+            self.presence.user_offline(user_id)
+        else:
+            if self.cluster.owner(user_id) is None:
+                self.presence.user_offline(user_id)  # User đã kết nối lại ở node khác thì vẫn online
+            self.cluster.user_offline(user_id)
+        room_info = self.voice_rooms.leave(user_id)
+        if room_info:
+            self.notify_voice_room(room_info)
+
+    def handle_hello(self, ctx):
+        """Client giữ kết nối từ trước khi đăng nhập báo đã sẵn sàng nhận ping"""
+        conn = self.connections.get(ctx.client_socket)
+        if conn is not None:
+            conn.ping_enabled = True
+        return None
+
+    def handle_logout(self, ctx):
+        self._unbind_session(ctx.client_socket)
+        return {"status": "success", "message": "Đã đăng xuất"}
+
+    def handle_login(self, ctx):
+        response = self.model.login_user(ctx.get("email"), ctx.get("password"))
+        if response.get("status") != "success":
+            return response
+
+        user_id = self.model.get_user_id(ctx.get("email"))
+        if not user_id:
+            return {"status": "error", "message": "Không tìm thấy user_id"}
+
+        response["user_id"] = user_id
+        response["display_name"] = self.model.get_display_name(user_id)
+        response["avatar"] = self.model.get_avatar(user_id)
+        response["unread"] = self.model.get_unread_counts(user_id)
+        # Mốc để resume_session chỉ gửi lại tin bị lỡ
+        response["last_message_id"], response["last_group_message_id"] = self.model.get_last_message_ids(user_id)
+        # Token để reconnect không phải đăng nhập (bcrypt) lại
+        response["session_token"], response["token_expires"] = self.sessions.issue(user_id)
+        logger.info("User %s logged in", user_id)
+        self._bind_session(ctx.client_socket, user_id, response)
+        return None  # Đã trả lời trong _bind_session
+
+    def handle_resume_session(self, ctx):
+        """Khôi phục session khi client reconnect, chỉ chấp nhận token đã ký.
+        Client gửi kèm id tin cuối đã nhận thì server gửi lại các tin bị lỡ sau mốc đó."""
+        user_id = self.sessions.verify(ctx.get("token"))
+        if user_id is None:
+            return {"status": "error", "message": "Phiên đăng nhập không hợp lệ hoặc đã hết hạn"}
+        response = {"status": "success", "message": "Đã khôi phục phiên", "user_id": user_id}
+
+        after_id, after_group_id = ctx.get("last_message_id"), ctx.get("last_group_message_id")
+        catch_up = None
+        if isinstance(after_id, int) and isinstance(after_group_id, int):
+            catch_up = (after_id, after_group_id)
+        self._bind_session(ctx.client_socket, user_id, response, catch_up)
+        return None
+
+    def handle_get_users(self, ctx):
+        return {"status": "success", "users": self.model.get_all_users()}
+
+    def handle_get_user(self, ctx):
+        """1 user vừa đổi (sự kiện presence "directory"), không tải lại cả danh bạ"""
+        user_id = ctx.get("user_id")
+        user = self.model.get_user(user_id) if isinstance(user_id, int) else None
+        if user is None:
+            return {"status": "error", "message": "Không tìm thấy người dùng"}
+        return {"status": "success", "user": user}
+
+    def handle_get_profile(self, ctx):
+        return self.model.get_profile(ctx.user_id)
+
+    def handle_update_profile(self, ctx):
+        response = self.model.update_profile(
+            ctx.user_id,
+            display_name=ctx.get("display_name"),
+            avatar_data=ctx.get("avatar")
+        )
+        if response.get("status") == "success":
+            self.presence.directory_changed(ctx.user_id)
+            if self.cluster is not None:
+                self.cluster.directory_changed(ctx.user_id)
+        return response
+
+    def handle_change_password(self, ctx):
+        return self.model.change_password(ctx.user_id, ctx.get("old_password", ""), ctx.get("new_password", ""))
+
+    # === Tin nhắn 1-1 ===
+
+    def handle_get_chat_history(self, ctx):
+        receiver_id = ctx.get("receiver_id")
+        # before_id + limit: phân trang ngược (trang cũ có thể nằm trong kho lưu trữ)
+        # after_id: chỉ tin mới hơn bản client đã lưu
+        before_id, limit, after_id = ctx.get("before_id"), ctx.get("limit"), ctx.get("after_id")
+        if not all(isinstance(v, (int, type(None))) for v in (before_id, limit, after_id)):
+            return {"status": "error", "message": "Phân trang không hợp lệ"}
+        history = self.model.get_chat_history(ctx.user_id, receiver_id, before_id, limit, after_id)
+        logger.debug("Chat history sent for receiver %s", receiver_id)
+        return {"status": "success", "history": history}
+
+    def handle_get_recent_chats(self, ctx):
+        return {"status": "success", "chats": self.model.get_recent_chats(ctx.user_id)}
+
+    def handle_direct_message(self, ctx, kind):
+        """message/send_image/send_voice/send_video: lưu, rồi gửi hoặc xếp hàng offline"""
+        sender_id = ctx.user_id
+        receiver_id = ctx.get("receiver_id")
+
+        if kind == "text":
+            message = ctx.get("message")
+            message_id = self.model.save_message(sender_id, receiver_id, message)
+        else:
+            media_data = ctx.get(f"{kind}_data")
+            filename = ctx.get("filename", GROUP_MESSAGE_DEFAULT_NAMES[kind])
+            save = getattr(self.model, f"save_{kind}_message")
+            message_id = save(sender_id, receiver_id, media_data, filename)
+        if message_id is None:
+            # Không lưu được thì không gửi: người nhận sẽ có tin không tải lại/đánh dấu đọc được
+            return {"status": "error", "message": "Không thể lưu tin nhắn, vui lòng thử lại"}
+        text = message if kind == "text" else filename
+        self.search_index.add_direct(message_id, sender_id, receiver_id, text, kind)
+        if self.cluster is not None:
+            self.cluster.index("direct", message_id, sender_id, receiver_id, text, kind)
+
+        msg_data = {
+            "action": "message",
+            "message_id": message_id,
+            "sender_id": sender_id,
+            "sender_name": self.model.get_display_name(sender_id),
+            "sender_avatar": self.model.get_avatar(sender_id),
+            "receiver_id": receiver_id
+        }
+        if kind == "text":
+            msg_data["message"] = message
+            msg_data["is_image"] = False
+        else:
+            msg_data[f"{kind}_data"] = media_data
+            msg_data[f"is_{kind}"] = True
+
+        self.deliver(receiver_id, msg_data)
+        return {"status": "success", "message": DIRECT_MESSAGE_REPLIES[kind], "message_id": message_id}
+
+    def handle_typing(self, ctx):
+        """Sự kiện tạm thời: không lưu, không trả lời, không xếp hàng offline"""
+        receiver_id = ctx.get("receiver_id")
+        typing = bool(ctx.get("typing", True))
+        if self.typing.should_forward(ctx.user_id, receiver_id, typing):
+            self.send_event_to_user(receiver_id, {"action": "typing", "sender_id": ctx.user_id, "typing": typing})
+        return None
+
+    # === Đã đọc / chưa đọc ===
+
+    def handle_mark_read(self, ctx):
+        """quiet: client gửi kiểu sự kiện (không chờ), không trả lời để khỏi lẫn với phản hồi của request khác"""
+        group_id, peer_id, last_read_id = ctx.get("group_id"), ctx.get("peer_id"), ctx.get("last_read_id")
+        if not isinstance(last_read_id, (int, type(None))):
+            response = {"status": "error", "message": "Mốc đã đọc không hợp lệ"}
+        elif group_id is not None:
+            if not isinstance(group_id, int) or ctx.user_id not in self.model.get_group_members(group_id):
+                response = {"status": "error", "message": "Bạn không ở trong nhóm này"}
+            else:
+                response = self.model.mark_read(ctx.user_id, "group", group_id, last_read_id)
+        elif isinstance(peer_id, int):
+            response = self.model.mark_read(ctx.user_id, "user", peer_id, last_read_id)
+        else:
+            response = {"status": "error", "message": "Thiếu hội thoại cần đánh dấu"}
+        return None if ctx.get("quiet") else response
+
+    def handle_get_unread_counts(self, ctx):
+        return {"status": "success", "unread": self.model.get_unread_counts(ctx.user_id)}
+
+    # === Nhóm chat ===
+
+    def handle_create_group(self, ctx):
+        name = (ctx.get("name") or "").strip()
+        member_ids = ctx.get("member_ids") or []
+        if not name:
+            return {"status": "error", "message": "Tên nhóm không được để trống"}
+        if not isinstance(member_ids, list) or not all(isinstance(uid, int) for uid in member_ids):
+            return {"status": "error", "message": "Danh sách thành viên không hợp lệ"}
+        # Id không tồn tại sẽ làm frame nhóm nằm mãi trong hàng đợi offline
+        if set(member_ids) - self.model.get_existing_user_ids(member_ids):
+            return {"status": "error", "message": "Thành viên không tồn tại"}
+        response = self.model.create_group(name, ctx.user_id, member_ids)
+        if response.get("status") == "success":
+            event = {"action": "group_created", "group_id": response["group_id"],
+                     "name": name, "members": response["members"]}
+            self.fanout_frame(self.encode_frame(event), [m for m in response["members"] if m != ctx.user_id])
+        return response
+
+    def handle_get_groups(self, ctx):
+        return {"status": "success", "groups": self.model.get_user_groups(ctx.user_id)}
+
+    def handle_get_group_history(self, ctx):
+        group_id = ctx.get("group_id")
+        if ctx.user_id not in self.model.get_group_members(group_id):
+            return {"status": "error", "message": "Bạn không ở trong nhóm này"}
+        before_id, limit, after_id = ctx.get("before_id"), ctx.get("limit"), ctx.get("after_id")
+        if not all(isinstance(v, (int, type(None))) for v in (before_id, limit, after_id)):
+            return {"status": "error", "message": "Phân trang không hợp lệ"}
+        history = self.model.get_group_history(group_id, after_id, before_id, limit)
+        return {"status": "success", "history": history}
+
+    def handle_send_group_message(self, ctx):
+        sender_id = ctx.user_id
+        group_id = ctx.get("group_id")
+        kind = ctx.get("kind", "text")
+        if kind not in GROUP_MESSAGE_DEFAULT_NAMES:
+            return {"status": "error", "message": "Loại tin nhắn không hợp lệ"}
+        members = self.model.get_group_members(group_id)
+        if sender_id not in members:
+            return {"status": "error", "message": "Bạn không ở trong nhóm này"}
+
+        if kind == "text":
+            message, media_data = ctx.get("message"), None
+        else:
+            message = ctx.get("filename", GROUP_MESSAGE_DEFAULT_NAMES[kind])
+            media_data = ctx.get(f"{kind}_data")
+
+        # Lưu 1 lần, encode 1 lần, cùng bytes gửi cho mọi thành viên
+        message_id = self.model.save_group_message(group_id, sender_id, message, kind, media_data)
+        if message_id is None:
+            return {"status": "error", "message": "Không thể lưu tin nhắn, vui lòng thử lại"}
+        self.search_index.add_group(message_id, group_id, sender_id, message, kind)
+        if self.cluster is not None:
+            self.cluster.index("group", message_id, group_id, sender_id, message, kind)
+        msg_data = {
+            "action": "message",
+            "group_id": group_id,
+            "message_id": message_id,
+            "sender_id": sender_id,
+            "sender_name": self.model.get_display_name(sender_id),
+            "sender_avatar": self.model.get_avatar(sender_id),
+            "message": message
+        }
+        if kind != "text":
+            msg_data[f"is_{kind}"] = True
+            msg_data[f"{kind}_data"] = media_data
+        frame = self.encode_frame(msg_data)
+        delivered = self.fanout_frame(frame, [m for m in members if m != sender_id], message_id=message_id)
+        logger.debug("Group message %s delivered to %d/%d members", message_id, delivered, len(members) - 1)
+        return {"status": "success", "message": "Tin nhắn nhóm đã gửi", "message_id": message_id}
+
+    # === Tìm kiếm ===
+
+    def handle_search_messages(self, ctx):
+        """Tìm trong 1 hội thoại (peer_id hoặc group_id) hoặc mọi hội thoại của user"""
+        query = (ctx.get("query") or "").strip()
+        if not query:
+            return {"status": "error", "message": "Vui lòng nhập từ khóa"}
+        try:
+            offset = max(0, int(ctx.get("offset", 0)))
+            limit = min(SEARCH_CONFIG["max_page_size"], max(1, int(ctx.get("limit", SEARCH_CONFIG["page_size"]))))
+        except (TypeError, ValueError):
+            return {"status": "error", "message": "Phân trang không hợp lệ"}
+
+        user_id = ctx.user_id
+        group_id, peer_id = ctx.get("group_id"), ctx.get("peer_id")
+        # Khóa trong chỉ mục là số: id dạng chuỗi sẽ không khớp hội thoại nào
+        if not all(isinstance(v, (int, type(None))) for v in (group_id, peer_id)):
+            return {"status": "error", "message": "Hội thoại không hợp lệ"}
+        if group_id is not None:
+            if user_id not in self.model.get_group_members(group_id):
+                return {"status": "error", "message": "Bạn không ở trong nhóm này"}
+            conv_keys = [group_key(group_id)]
+        elif peer_id is not None:
+            conv_keys = [direct_key(user_id, peer_id)]
+        else:
+            conv_keys = self.search_index.direct_conversations(user_id) + [
+                group_key(group["group_id"]) for group in self.model.get_user_groups(user_id)
+            ]
+
+        total, results = self.search_index.search(user_id, query, conv_keys, offset, limit)
+        return {
+            "status": "success",
+            "results": results,
+            "total": total,
+            "offset": offset,
+            "complete": self.search_index.ready  # False: chỉ mục còn đang dựng, kết quả có thể thiếu
+        }
+
+    # === Phòng thoại: server chỉ quản lý thành viên, âm thanh đi qua multicast ===
+
+    def handle_join_voice_room(self, ctx):
+        response, changed = self.voice_rooms.join(ctx.user_id, ctx.get("room"))
+        for room_info in changed:
+            self.notify_voice_room(room_info)
+        return response
+
+    def handle_leave_voice_room(self, ctx):
+        room_info = self.voice_rooms.leave(ctx.user_id)
+        if room_info:
+            self.notify_voice_room(room_info)
+        return {"status": "success", "message": "Đã rời phòng thoại"}
+
+    def handle_get_voice_rooms(self, ctx):
+        return {"status": "success", "rooms": self.voice_rooms.list_rooms()}
+
+    # === Presence ===
+
+    def handle_get_presence(self, ctx):
+        """Trạng thái đầy đủ hoặc các sự kiện bị thiếu (khi client thấy hổng seq)"""
+        since = ctx.get("since")
+        events = self.presence.events_since(since) if isinstance(since, int) else None
+        if events is not None:
+            return {"status": "success", "events": events}
+        return {"status": "success", **self.presence.snapshot()}
+
+    def handle_subscribe_presence(self, ctx):
+        # Client không join được multicast, hoặc server chạy nhiều node -> nhận sự kiện presence qua TCP
+        with self.lock:
+            if ctx.get("tcp") or not self.presence.multicast:
+                self.presence_tcp_sockets.add(ctx.client_socket)
+            else:
+                self.presence_tcp_sockets.discard(ctx.client_socket)
+        return {"status": "success", **self.presence.snapshot()}
+
+    # === Giám sát ===
+
+    def handle_pong(self, ctx):
+        conn = self.connections.get(ctx.client_socket)
+        if conn is not None:
+            self.heartbeat.record_pong(conn, ctx.get("ts"))
+        return None
+
+    def handle_get_metrics(self, ctx):
+        if ctx.user_id not in METRICS_CONFIG["admin_user_ids"]:
+            return {"status": "error", "message": "Không có quyền xem thống kê"}
+        return {"status": "success", "actions": self.router.stats(), "metrics": REGISTRY.snapshot()}
+
+    # === Vòng lặp kết nối ===
+
+    def handle_client(self, client_socket, address=None):
+        # Timeout ngắn chỉ để kiểm tra tiến độ; kết nối bị đóng khi không còn byte nào
+        # (kể cả pong) trong stall_timeout giây, video lớn đang truyền thì không bị cắt
+        client_socket.settimeout(HEARTBEAT_CONFIG["poll_interval"])
+        conn = ConnectionState(client_socket, address)
+        with self.lock:
+            self.connections[client_socket] = conn
         logger.info("New client session started")
-        current_user_id = None
+        ACTIVE_CONNECTIONS.inc()
 
         try:
             while True:
+                conn.in_request = False
                 try:
                     # Nhận length prefix (4 bytes)
-                    length_data = self._recv_all(client_socket, 4)
-                    if not length_data:
-                        logger.info("No data received, closing connection")
-                        break
-                    
-                    # Unpack length
+                    length_data = self._recv_all(client_socket, 4, conn)
                     data_length = struct.unpack('>I', length_data)[0]
-                    
-                    # Kiểm tra kích thước hợp lệ (tối đa 100MB)
-                    if data_length > 100 * 1024 * 1024:
+                    # Request đã bắt đầu thì được làm nốt khi tắt (kể cả upload lớn)
+                    conn.in_request = True
+
+                    # Kiểm tra kích thước hợp lệ (giới hạn chi tiết theo action nằm ở router)
+                    if data_length > REQUEST_LIMITS_CONFIG["max_frame_bytes"]:
                         logger.error(f"Data too large: {data_length} bytes")
                         self.send_to_client(
                             client_socket,
                             {"status": "error", "message": "Dữ liệu quá lớn"}
                         )
                         break
-                    
-                    # Nhận đủ dữ liệu
-                    data = self._recv_all(client_socket, data_length)
-                    message = data.decode('utf-8')
-                    
-                    request = json.loads(message)
-                    action = request.get("action")
-                    logger.debug(f"Received action: {action} from client")
-
-                    response = {"status": "error", "message": "Hành động không hợp lệ"}
-
-                    if action == "register":
-                        response = self.model.register_user(
-                            request.get("display_name"),
-                            request.get("email"),
-                            request.get("password")
-                        )
 
-                    elif action == "login":
-                        response = self.model.login_user(
-                            request.get("email"),
-                            request.get("password")
-                        )
-                        if response.get("status") == "success":
-                            user_id = self.model.get_user_id(request.get("email"))
-                            if user_id:
-                                with self.lock:
-                                    self.clients[client_socket] = user_id
-                                    self.user_sockets[user_id] = client_socket
-                                    current_user_id = user_id
-
-                                response["user_id"] = user_id
-                                response["display_name"] = self.model.get_display_name(user_id)
-                                response["avatar"] = self.model.get_avatar(user_id)
-                                logger.info(f"User {user_id} logged in")
-
-                                if user_id in self.offline_messages:
-                                    for msg in self.offline_messages[user_id]:
-                                        self.send_to_client(client_socket, msg)
-                                    del self.offline_messages[user_id]
-                            else:
-                                response = {"status": "error", "message": "Không tìm thấy user_id"}
-
-                    elif action == "get_users":
-                        response = {"status": "success", "users": self.model.get_all_users()}
-
-                    elif action == "get_chat_history":
-                        if client_socket in self.clients:
-                            receiver_id = request.get("receiver_id")
-                            history = self.model.get_chat_history(
-                                self.clients[client_socket],
-                                receiver_id
-                            )
-                            response = {"status": "success", "history": history}
-                            logger.debug(f"Chat history sent for receiver {receiver_id}")
-                        else:
-                            response = {"status": "error", "message": "Không xác định user"}
-
-                    elif action == "get_recent_chats":
-                        if client_socket in self.clients:
-                            user_id = self.clients[client_socket]
-                            response = {
-                                "status": "success",
-                                "chats": self.model.get_recent_chats(user_id)
-                            }
-                        else:
-                            response = {"status": "error", "message": "Không xác định user"}
-
-                    elif action == "message":
-                        if client_socket in self.clients:
-                            sender_id = self.clients[client_socket]
-                            receiver_id = request.get("receiver_id")
-                            message = request.get("message")
-
-                            self.model.save_message(sender_id, receiver_id, message)
-
-                            msg_data = {
-                                "action": "message",
-                                "sender_id": sender_id,
-                                "sender_name": self.model.get_display_name(sender_id),
-                                "sender_avatar": self.model.get_avatar(sender_id),
-                                "receiver_id": receiver_id,
-                                "message": message,
-                                "is_image": False
-                            }
-
-                            with self.lock:
-                                if receiver_id in self.user_sockets:
-                                    receiver_socket = self.user_sockets[receiver_id]
-                                    if not self.send_to_client(receiver_socket, msg_data):
-                                        if receiver_id not in self.offline_messages:
-                                            self.offline_messages[receiver_id] = []
-                                        self.offline_messages[receiver_id].append(msg_data)
-                                    else:
-                                        logger.debug(f"Message sent to user {receiver_id}")
-                                else:
-                                    if receiver_id not in self.offline_messages:
-                                        self.offline_messages[receiver_id] = []
-                                    self.offline_messages[receiver_id].append(msg_data)
-                                    logger.debug(f"User {receiver_id} offline, message saved")
-
-                            response = {"status": "success", "message": "Tin nhắn đã gửi"}
-                        else:
-                            response = {"status": "error", "message": "Không xác định user"}
-
-                    elif action == "send_voice":
-                        if client_socket in self.clients:
-                            sender_id = self.clients[client_socket]
-                            receiver_id = request.get("receiver_id")
-                            voice_data = request.get("voice_data")
-                            filename = request.get("filename", "voice.wav")
-
-                            # Lưu voice vào database
-                            self.model.save_voice_message(sender_id, receiver_id, voice_data, filename)
-
-                            # Tạo message data
-                            msg_data = {
-                                "action": "message",
-                                "sender_id": sender_id,
-                                "sender_name": self.model.get_display_name(sender_id),
-                                "sender_avatar": self.model.get_avatar(sender_id),
-                                "receiver_id": receiver_id,
-                                "voice_data": voice_data,
-                                "is_voice": True
-                            }
-
-                            # Gửi đến receiver
-                            with self.lock:
-                                if receiver_id in self.user_sockets:
-                                    receiver_socket = self.user_sockets[receiver_id]
-                                    if not self.send_to_client(receiver_socket, msg_data):
-                                        if receiver_id not in self.offline_messages:
-                                            self.offline_messages[receiver_id] = []
-                                        self.offline_messages[receiver_id].append(msg_data)
-                                    else:
-                                        logger.debug(f"Voice sent to user {receiver_id}")
-                                else:
-                                    if receiver_id not in self.offline_messages:
-                                        self.offline_messages[receiver_id] = []
-                                    self.offline_messages[receiver_id].append(msg_data)
-                                    logger.debug(f"User {receiver_id} offline, voice saved")
-
-                            response = {"status": "success", "message": "Tin nhắn thoại đã gửi"}
-                        else:
-                            response = {"status": "error", "message": "Không xác định user"}
-
-
-
-
-
-                    elif action == "send_image":
-                        if client_socket in self.clients:
-                            sender_id = self.clients[client_socket]
-                            receiver_id = request.get("receiver_id")
-                            image_data = request.get("image_data")
-                            filename = request.get("filename", "image.jpg")
-
-                            # Lưu ảnh vào database
-                            self.model.save_image_message(sender_id, receiver_id, image_data, filename)
-
-                            # Tạo message data
-                            msg_data = {
-                                "action": "message",
-                                "sender_id": sender_id,
-                                "sender_name": self.model.get_display_name(sender_id),
-                                "sender_avatar": self.model.get_avatar(sender_id),
-                                "receiver_id": receiver_id,
-                                "image_data": image_data,
-                                "is_image": True
-                            }
-
-                            # Gửi đến receiver
-                            with self.lock:
-                                if receiver_id in self.user_sockets:
-                                    receiver_socket = self.user_sockets[receiver_id]
-                                    if not self.send_to_client(receiver_socket, msg_data):
-                                        if receiver_id not in self.offline_messages:
-                                            self.offline_messages[receiver_id] = []
-                                        self.offline_messages[receiver_id].append(msg_data)
-                                    else:
-                                        logger.debug(f"Image sent to user {receiver_id}")
-                                else:
-                                    if receiver_id not in self.offline_messages:
-                                        self.offline_messages[receiver_id] = []
-                                    self.offline_messages[receiver_id].append(msg_data)
-                                    logger.debug(f"User {receiver_id} offline, image saved")
-
-                            response = {"status": "success", "message": "Ảnh đã gửi"}
-                        else:
-                            response = {"status": "error", "message": "Không xác định user"}
-
-                    elif action == "send_video":
-                        if client_socket in self.clients:
-                            sender_id = self.clients[client_socket]
-                            receiver_id = request.get("receiver_id")
-                            video_data = request.get("video_data")
-                            filename = request.get("filename", "video.mp4")
-
-                            # Lưu video vào database
-                            self.model.save_video_message(sender_id, receiver_id, video_data, filename)
-
-                            # Tạo message data
-                            msg_data = {
-                                "action": "message",
-                                "sender_id": sender_id,
-                                "sender_name": self.model.get_display_name(sender_id),
-                                "sender_avatar": self.model.get_avatar(sender_id),
-                                "receiver_id": receiver_id,
-                                "video_data": video_data,
-                                "is_video": True
-                            }
-
-                            # Gửi đến receiver
-                            with self.lock:
-                                if receiver_id in self.user_sockets:
-                                    receiver_socket = self.user_sockets[receiver_id]
-                                    if not self.send_to_client(receiver_socket, msg_data):
-                                        if receiver_id not in self.offline_messages:
-                                            self.offline_messages[receiver_id] = []
-                                        self.offline_messages[receiver_id].append(msg_data)
-                                    else:
-                                        logger.debug(f"Video sent to user {receiver_id}")
-                                else:
-                                    if receiver_id not in self.offline_messages:
-                                        self.offline_messages[receiver_id] = []
-                                    self.offline_messages[receiver_id].append(msg_data)
-                                    logger.debug(f"User {receiver_id} offline, video saved")
-
-                            response = {"status": "success", "message": "Video đã gửi"}
-                        else:
-                            response = {"status": "error", "message": "Không xác định user"}
-
-                    # Hồ sơ người dùng
-                    elif action == "get_profile":
-                        if client_socket in self.clients:
-                            user_id = self.clients[client_socket]
-                            response = self.model.get_profile(user_id)
-                        else:
-                            response = {"status": "error", "message": "Không xác định user"}
-
-                    elif action == "update_profile":
-                        if client_socket in self.clients:
-                            user_id = self.clients[client_socket]
-                            response = self.model.update_profile(
-                                user_id,
-                                display_name=request.get("display_name"),
-                                avatar_data=request.get("avatar")
-                            )
-                        else:
-                            response = {"status": "error", "message": "Không xác định user"}
-
-                    elif action == "change_password":
-                        if client_socket in self.clients:
-                            user_id = self.clients[client_socket]
-                            response = self.model.change_password(
-                                user_id,
-                                request.get("old_password", ""),
-                                request.get("new_password", "")
-                            )
-                        else:
-                            response = {"status": "error", "message": "Không xác định user"}
-
-                    # Khôi phục session khi client reconnect
-                    elif action == "resume_session":
-                        user_id = request.get("user_id")
-                        if user_id:
-                            with self.lock:
-                                self.clients[client_socket] = user_id
-                                self.user_sockets[user_id] = client_socket
-                            response = {"status": "success", "message": "Đã khôi phục phiên"}
-                        else:
-                            response = {"status": "error", "message": "Thiếu user_id"}
-
-                    time.sleep(0.05)
-                    if not self.send_to_client(client_socket, response):
-                        logger.warning("Client disconnected before sending response")
-                        break
-                    logger.debug(f"Response sent: {action}")
+                    # Nhận đủ dữ liệu
+                    data = self._recv_all(client_socket, data_length, conn)
+                    request = json.loads(data.decode('utf-8'))
+                    ctx = RequestContext(self, client_socket, request, data_length)
+                    logger.debug("Received action: %s from client", ctx.action)
+                    REQUEST_BYTES.inc(data_length, str(ctx.action))
+                    conn.busy = True  # Đang xử lý thì không đọc pong: reaper bỏ qua
+                    try:
+                        response = self.router.dispatch(ctx)
+                    finally:
+                        conn.busy = False
+                        conn.touch()
+                    # response None: action không cần trả lời (vd: typing)
+                    if response is not None:
+                        frame = self.encode_frame(response)
+                        RESPONSE_BYTES.inc(len(frame), str(ctx.action))
+                        if not self.send_frame(client_socket, frame):
+                            logger.warning("Client disconnected before sending response")
+                            break
+                        logger.debug("Response sent: %s", ctx.action)
+                    if self.draining:
+                        break  # Đang tắt: đã làm nốt request này, đóng kết nối
 
                 except json.JSONDecodeError:
                     logger.error("Invalid JSON data received")
@@ -378,7 +789,7 @@ class ChatController:
                         {"status": "error", "message": "Dữ liệu không hợp lệ"}
                     )
                 except socket.timeout:
-                    logger.warning("Connection timed out")
+                    self.heartbeat.reap(conn)
                     break
                 except socket.error as e:
                     logger.error(f"Socket error: {str(e)}")
@@ -391,28 +802,160 @@ class ChatController:
                     )
                     break
         finally:
+            ACTIVE_CONNECTIONS.dec()
+            conn.closed = True
             with self.lock:
-                if client_socket in self.clients:
-                    user_id = self.clients[client_socket]
-                    del self.clients[client_socket]
-                    if user_id in self.user_sockets:
-                        del self.user_sockets[user_id]
-                    logger.info(f"User {user_id} disconnected")
+                self.handlers_running -= 1
+                self.connections.pop(client_socket, None)
+                self.presence_tcp_sockets.discard(client_socket)
+            self._unbind_session(client_socket)
 
             if client_socket.fileno() != -1:
                 client_socket.close()
             logger.info("Client connection closed")
 
     def start(self):
-        print(f"Server started at {SERVER_CONFIG['host']}:{SERVER_CONFIG['port']}")
-        while True:
+        print(f"Server started at {self.host}:{self.port}")
+        if METRICS_CONFIG["http_enabled"]:
+            try:
+                self.metrics_server = start_metrics_server(METRICS_CONFIG["http_host"], METRICS_CONFIG["http_port"])
+            except OSError as e:
+                logger.error(f"Không mở được metrics endpoint: {e}")
+        if ARCHIVE_CONFIG["enabled"] and getattr(self.model, "archive", None) is not None:
+            self.archive_job = ArchiveJob(self.model)
+            self.archive_job.start()
+        self.heartbeat.start()
+        if self.cluster is not None:
+            self.cluster.start()
+        self.accepting = True
+        self.server_socket.settimeout(1)  # Để kiểm tra cờ dừng, không đóng socket đang listen
+        while self.accepting:
             try:
                 client_socket, address = self.server_socket.accept()
-                logger.info(f"New connection from {address}")
-                threading.Thread(
-                    target=self.handle_client,
-                    args=(client_socket,),
-                    daemon=True
-                ).start()
+            except socket.timeout:
+                # Khi handoff, process cũ ghi spool sau khi process này đã chạy
+                self._load_offline_spool()
+                continue
             except socket.error as e:
-                logger.error(f"Error accepting connection: {str(e)}")
\ No newline at end of file
+                if not self.accepting:
+                    break
+                logger.error(f"Error accepting connection: {str(e)}")
+                continue
+            logger.info("New connection from %s", address)
+            with self.lock:
+                self.handlers_running += 1
+            threading.Thread(
+                target=self.handle_client,
+                args=(client_socket, address),
+                daemon=True
+            ).start()
+        self.accept_stopped.set()
+
+    # === Tắt êm / chuyển giao ===
+
+    def _load_offline_spool(self):
+        """Nạp hàng đợi offline mà process trước ghi ra đĩa lúc tắt"""
+        path = SHUTDOWN_CONFIG["spool_file"]
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, encoding='utf-8') as f:
+                spool = json.load(f)
+            os.remove(path)
+        except (OSError, ValueError) as e:
+            logger.error(f"Không đọc được spool tin offline: {e}")
+            return
+        with self.lock:
+            for user_id, messages in spool.items():
+                # Tin trong spool cũ hơn tin vừa xếp hàng ở process này
+                self.offline_messages.setdefault(int(user_id), [])[:0] = messages
+        logger.info("Loaded %d spooled offline messages", sum(len(m) for m in spool.values()))
+
+    def _spool_offline_messages(self):
+        """Ghi hàng đợi offline ra đĩa (ghi file tạm rồi đổi tên); trả về số tin đã ghi"""
+        with self.lock:
+            pending, self.offline_messages = self.offline_messages, {}
+        # Frame đã encode (tin nhóm) lưu lại dạng JSON
+        spool = {
+            str(user_id): [json.loads(m[1][4:]) if isinstance(m, tuple) else m for m in messages]
+            for user_id, messages in pending.items() if messages
+        }
+        if not spool:
+            return 0
+        path = SHUTDOWN_CONFIG["spool_file"]
+        with open(path + ".tmp", "w", encoding='utf-8') as f:
+            json.dump(spool, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        return sum(len(m) for m in spool.values())
+
+    def shutdown(self, retry_after=None, drain_timeout=SHUTDOWN_CONFIG["drain_timeout"]):
+        """Tắt êm: ngừng accept, báo client kết nối lại sau retry_after giây, chờ các request
+        đang xử lý xong (tối đa drain_timeout), ghi hàng đợi offline ra đĩa rồi dừng các thread nền"""
+        if self.draining:
+            return
+        if retry_after is None:
+            retry_after = SHUTDOWN_CONFIG["retry_after"]
+        if self.accepting:
+            self.accepting = False
+            self.accept_stopped.wait(5)  # Kết nối vừa accept cũng phải được tính vào drain
+        self.draining = True
+        with self.lock:
+            connections = list(self.connections.values())
+        logger.info("Shutting down, draining %d connections", len(connections))
+        notice = self.encode_frame({
+            "action": "server_shutdown", "message": "Máy chủ đang khởi động lại",
+            "retry_after": retry_after
+        })
+        for conn in connections:
+            if conn.ping_enabled:  # Chỉ client đã vào phiên (đang đọc sự kiện server đẩy)
+                self.send_frame(conn.socket, notice)
+
+        deadline = time.monotonic() + drain_timeout
+        while connections or self.handlers_running > 0:
+            forced = time.monotonic() > deadline
+            for conn in connections:
+                # Kết nối rảnh quá poll_interval thì đóng (request vừa gửi tới vẫn kịp được đọc);
+                # đang có request thì để thread xử lý làm xong rồi tự đóng
+                if forced or (not conn.in_request and conn.idle_for() > HEARTBEAT_CONFIG["poll_interval"]):
+                    try:
+                        conn.socket.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+            if forced:
+                logger.warning("Drain timeout, closed %d busy connections", len(connections))
+                break
+            time.sleep(0.1)
+            with self.lock:
+                connections = list(self.connections.values())
+
+        self.heartbeat.stop()
+        if self.cluster is not None:
+            self.cluster.stop()
+        if self.archive_job is not None:
+            self.archive_job.stop()
+        self.presence.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+            self.metrics_server.server_close()
+        spooled = self._spool_offline_messages()
+        HASHER.shutdown()
+        self.model.close()
+        self.server_socket.close()  # Process mới (nếu handoff) vẫn giữ bản sao của socket
+        logger.info("Shutdown complete, %d offline messages spooled", spooled)
+        self.shutdown_done.set()
+
+    def handoff(self):
+        """Chạy process mới (cùng lệnh) nhận lại socket đang listen rồi tắt êm process này.
+        Kết nối tới trong lúc chuyển nằm trong backlog chung nên không bị từ chối."""
+        if self.metrics_server is not None:
+            # Nhả port metrics để process mới mở được
+            self.metrics_server.shutdown()
+            self.metrics_server.server_close()
+            self.metrics_server = None
+        fd = self.server_socket.fileno()
+        env = dict(os.environ, **{SHUTDOWN_CONFIG["listen_fd_env"]: str(fd)})
+        subprocess.Popen([sys.executable] + sys.argv, env=env, pass_fds=(fd,))
+        logger.info("Handed listening socket to new process")
+        self.shutdown(retry_after=0)  # Process mới đã nhận kết nối: client chỉ cần chờ jitter
\ No newline at end of file
@@ -0,0 +1,265 @@
+# server/controllers/cluster_controller.py
+import json
+import queue
+import socket
+import struct
+import threading
+import time
+import logging
+from functools import partial
+from config.config import CLUSTER_CONFIG
+from server.utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+ROUTED = REGISTRY.counter("chat_cluster_routed_total", "Số tin chuyển sang node khác qua bus", labels=("kind",))
+
+PRESENCE_TOPIC = "presence"
+SEARCH_TOPIC = "search"  # Tin mới lưu ở 1 node, mọi node thêm vào chỉ mục tìm kiếm của mình
+
+
+def node_topic(node_id):
+    return f"node.{node_id}"
+
+
+class PresenceRegistry:
+    """Bảng user -> node đang giữ kết nối của user, dựng từ sự kiện presence trên bus.
+
+    Mỗi node định kỳ gửi lại toàn bộ danh sách user của mình; node im lặng quá registry_ttl
+    (chết không kịp báo) thì các user của nó không còn được coi là online.
+    announce/node_down/expire trả về các user thay đổi để node cập nhật presence cho client.
+    """
+
+    def __init__(self, ttl=CLUSTER_CONFIG["registry_ttl"]):
+        self.ttl = ttl
+        self.owners = {}      # user_id -> node_id
+        self.last_seen = {}   # node_id -> thời điểm nhận tin gần nhất
+        self.lock = threading.Lock()
+
+    def online(self, node_id, user_id):
+        with self.lock:
+            self.owners[user_id] = node_id
+            self.last_seen[node_id] = time.monotonic()
+
+    def offline(self, node_id, user_id):
+        with self.lock:
+            # User đã chuyển sang node khác thì giữ nguyên
+            if self.owners.get(user_id) == node_id:
+                del self.owners[user_id]
+
+    def announce(self, node_id, user_ids):
+        """Trả về (user mới thuộc node, user không còn ở node)"""
+        with self.lock:
+            previous = {u for u, n in self.owners.items() if n == node_id}
+            for user_id in previous:
+                del self.owners[user_id]
+            for user_id in user_ids:
+                self.owners[user_id] = node_id
+            self.last_seen[node_id] = time.monotonic()
+            current = {u for u, n in self.owners.items() if n == node_id}
+        return current - previous, previous - current
+
+    def node_down(self, node_id):
+        with self.lock:
+            removed = [u for u, n in self.owners.items() if n == node_id]
+            for user_id in removed:
+                del self.owners[user_id]
+            self.last_seen.pop(node_id, None)
+        return removed
+
+    def expire(self):
+        """Bỏ các node im lặng quá ttl, trả về user của các node đó"""
+        now = time.monotonic()
+        with self.lock:
+            stale = {n for n, seen in self.last_seen.items() if now - seen > self.ttl}
+            removed = [u for u, n in self.owners.items() if n in stale]
+            for user_id in removed:
+                del self.owners[user_id]
+            for node_id in stale:
+                del self.last_seen[node_id]
+        return removed
+
+    def owner(self, user_id):
+        with self.lock:
+            node_id = self.owners.get(user_id)
+            if node_id is None or time.monotonic() - self.last_seen.get(node_id, 0) > self.ttl:
+                return None
+            return node_id
+
+
+class ClusterRouter:
+    """Chuyển tin cho user không kết nối tới node này sang node đang giữ user qua message bus"""
+
+    def __init__(self, controller, bus, node_id=None):
+        self.controller = controller
+        self.bus = bus
+        self.node_id = node_id or CLUSTER_CONFIG["node_id"] or f"{socket.gethostname()}:{controller.port}"
+        self.registry = PresenceRegistry()
+        self.running = False
+        # Mỗi worker 1 hàng đợi; tin của 1 user luôn vào cùng worker nên giữ đúng thứ tự
+        self.delivery_queues = [queue.Queue() for _ in range(CLUSTER_CONFIG["delivery_workers"])]
+        bus.subscribe(PRESENCE_TOPIC, self._on_presence)
+        bus.subscribe(node_topic(self.node_id), self._on_node_message)
+        bus.subscribe(SEARCH_TOPIC, self._on_search)
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._announce_loop, daemon=True).start()
+        for jobs in self.delivery_queues:
+            threading.Thread(target=self._delivery_loop, args=(jobs,), daemon=True).start()
+        logger.info("Cluster node %s started", self.node_id)
+
+    def _announce_loop(self):
+        while self.running:
+            with self.controller.lock:
+                user_ids = list(self.controller.user_sockets)
+            self.bus.publish(PRESENCE_TOPIC, {"type": "announce", "node": self.node_id, "users": user_ids})
+            self._sync_presence((), self.registry.expire())
+            time.sleep(CLUSTER_CONFIG["announce_interval"])
+
+    def stop(self):
+        """Báo các node khác bỏ user của node này ngay, không chờ hết registry_ttl"""
+        self.running = False
+        self.bus.publish(PRESENCE_TOPIC, {"type": "node_down", "node": self.node_id})
+        for jobs in self.delivery_queues:
+            jobs.put(None)
+
+    # === Presence ===
+
+    def user_online(self, user_id):
+        self.bus.publish(PRESENCE_TOPIC, {"type": "online", "node": self.node_id, "user_id": user_id})
+
+    def user_offline(self, user_id):
+        self.bus.publish(PRESENCE_TOPIC, {"type": "offline", "node": self.node_id, "user_id": user_id})
+
+    def directory_changed(self, user_id):
+        self.bus.publish(PRESENCE_TOPIC, {"type": "directory", "node": self.node_id, "user_id": user_id})
+
+    def _on_presence(self, event):
+        node_id = event["node"]
+        if node_id == self.node_id:
+            return
+        kind = event["type"]
+        if kind == "online":
+            self.registry.online(node_id, event["user_id"])
+            self._sync_presence((event["user_id"],), ())
+            self._forward_offline_queue(event["user_id"], node_id)
+        elif kind == "offline":
+            self.registry.offline(node_id, event["user_id"])
+            self._sync_presence((), (event["user_id"],))
+        elif kind == "announce":
+            self._sync_presence(*self.registry.announce(node_id, event["users"]))
+        elif kind == "node_down":
+            self._sync_presence((), self.registry.node_down(node_id))
+        elif kind == "directory":
+            self.controller.presence.directory_changed(event["user_id"])
+
+    def _sync_presence(self, came_online, went_offline):
+        """Đưa user của node khác vào presence của node này: client chỉ theo dõi 1 node
+        nên danh sách online (và seq) của mỗi node phải phủ cả cluster"""
+        presence = self.controller.presence
+        for user_id in came_online:
+            presence.user_online(user_id)
+        for user_id in went_offline:
+            # Còn kết nối ở node này hoặc đã chuyển sang node khác thì vẫn online
+            if user_id not in self.controller.user_sockets and self.registry.owner(user_id) is None:
+                presence.user_offline(user_id)
+
+    def _forward_offline_queue(self, user_id, node_id):
+        """User vừa online ở node khác: chuyển các tin đang chờ ở node này cho node đó"""
+        with self.controller.lock:
+            pending = self.controller.offline_messages.pop(user_id, [])
+        if not pending:
+            return
+        # Frame đã encode (tin nhóm) gửi lại dạng dict: node nhận xếp hàng lại được và vẫn lọc được theo id
+        messages = [json.loads(m[1][4:]) if isinstance(m, tuple) else m for m in pending]
+        if not self.bus.publish(node_topic(node_id), {"type": "deliver", "user_id": user_id, "messages": messages}):
+            with self.controller.lock:
+                self.controller.offline_messages.setdefault(user_id, [])[:0] = pending
+            return
+        ROUTED.inc(len(messages), "offline_queue")
+
+    # === Định tuyến ===
+
+    def owner(self, user_id):
+        """Node khác đang giữ kết nối của user, None nếu user không online ở node nào khác"""
+        node_id = self.registry.owner(user_id)
+        return node_id if node_id != self.node_id else None
+
+    def deliver(self, user_id, message, queue=True):
+        """Gửi 1 message cho user ở node khác; False nếu không có node nào giữ user"""
+        node_id = self.owner(user_id)
+        if node_id is None:
+            return False
+        routed = self.bus.publish(node_topic(node_id), {
+            "type": "deliver", "user_id": user_id, "messages": [message], "queue": queue
+        })
+        if routed:
+            ROUTED.inc(1, "deliver")
+        return routed
+
+    def fanout(self, frame, user_ids, message_id=None):
+        """Gửi 1 frame cho các user ở node khác, mỗi node 1 message; trả về các user không chuyển được"""
+        by_node = {}
+        unrouted = []
+        for user_id in user_ids:
+            node_id = self.owner(user_id)
+            if node_id is None:
+                unrouted.append(user_id)
+            else:
+                by_node.setdefault(node_id, []).append(user_id)
+        payload = frame[4:].decode('utf-8')
+        for node_id, members in by_node.items():
+            if self.bus.publish(node_topic(node_id), {
+                "type": "fanout", "user_ids": members, "payload": payload, "message_id": message_id
+            }):
+                ROUTED.inc(len(members), "fanout")
+            else:
+                unrouted.extend(members)
+        return unrouted
+
+    def _on_node_message(self, message):
+        """Chạy trên thread nhận của bus: chỉ chia việc cho các worker, vì gửi tới socket client
+        có thể chặn tới stall_timeout và làm kẹt mọi tin khác từ bus"""
+        if message["type"] == "deliver":
+            user_id = message["user_id"]
+            self._queue_for(user_id).put(partial(self._deliver_local, user_id, message))
+        elif message["type"] == "fanout":
+            payload = message["payload"].encode('utf-8')
+            frame = struct.pack('>I', len(payload)) + payload
+            by_queue = {}
+            for user_id in message["user_ids"]:
+                by_queue.setdefault(self._queue_for(user_id), []).append(user_id)
+            for jobs, user_ids in by_queue.items():
+                jobs.put(partial(self.controller.fanout_frame, frame, user_ids, route=False,
+                                 message_id=message.get("message_id")))
+
+    def _queue_for(self, user_id):
+        return self.delivery_queues[hash(user_id) % len(self.delivery_queues)]
+
+    def _deliver_local(self, user_id, message):
+        for msg in message["messages"]:
+            if message.get("queue", True):
+                self.controller.deliver(user_id, msg, route=False)
+            else:
+                self.controller.send_event_to_user(user_id, msg, route=False)
+
+    def _delivery_loop(self, jobs):
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            try:
+                job()
+            except Exception as e:
+                logger.error(f"Lỗi gửi tin từ bus: {e}")
+
+    # === Chỉ mục tìm kiếm ===
+
+    def index(self, conv_type, *args):
+        """conv_type "direct"/"group", args giống MessageSearchIndex.add_direct/add_group"""
+        self.bus.publish(SEARCH_TOPIC, {"node": self.node_id, "type": conv_type, "args": list(args)})
+
+    def _on_search(self, event):
+        if event["node"] != self.node_id:
+            getattr(self.controller.search_index, f"add_{event['type']}")(*event["args"])
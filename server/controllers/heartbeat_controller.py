@@ -0,0 +1,86 @@
+# server/controllers/heartbeat_controller.py
+import socket
+import threading
+import time
+import logging
+from config.config import HEARTBEAT_CONFIG
+from server.utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_RTT = REGISTRY.histogram("chat_heartbeat_rtt_seconds", "RTT đo bằng ping/pong ứng dụng")
+CONNECTIONS_REAPED = REGISTRY.counter("chat_connections_reaped_total", "Số kết nối bị đóng vì không phản hồi")
+
+
+class ConnectionState:
+    """Trạng thái 1 kết nối: thời điểm có tiến độ cuối cùng, RTT, khóa gửi"""
+
+    def __init__(self, client_socket, address=None):
+        self.socket = client_socket
+        self.address = address
+        self.last_activity = time.monotonic()
+        self.rtt = None
+        self.send_lock = threading.Lock()  # Nhiều thread (trả lời, chuyển tin, ping) cùng gửi 1 socket
+        self.busy = False  # Đang chạy handler: pong nằm chờ trong buffer, chưa được đọc
+        self.in_request = False  # Từ lúc nhận length prefix tới khi trả lời xong (để tắt êm)
+        self.ping_enabled = False  # Chỉ ping sau khi đã trả lời đăng nhập (client đọc frame đầu là phản hồi)
+        self.closed = False
+
+    def touch(self):
+        self.last_activity = time.monotonic()
+
+    def idle_for(self):
+        return time.monotonic() - self.last_activity
+
+    def stalled(self):
+        return not self.busy and self.idle_for() > HEARTBEAT_CONFIG["stall_timeout"]
+
+
+class HeartbeatMonitor:
+    """Ping định kỳ mọi kết nối và đóng kết nối không còn tiến độ.
+
+    Byte nhận được bất kỳ (request, chunk video, pong) đều tính là tiến độ nên upload
+    lớn không bị cắt, còn client chết mất tối đa stall_timeout giây để bị giải phóng.
+    """
+
+    def __init__(self, controller, interval=HEARTBEAT_CONFIG["ping_interval"]):
+        self.controller = controller
+        self.interval = interval
+        self.running = False
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def _loop(self):
+        while self.running:
+            time.sleep(self.interval)
+            with self.controller.lock:
+                connections = list(self.controller.connections.values())
+            ping = self.controller.encode_frame({"action": "ping", "ts": time.monotonic()})
+            for conn in connections:
+                if conn.stalled():
+                    self.reap(conn)
+                elif conn.ping_enabled:
+                    # Đang gửi frame khác (vd: video) thì bỏ lượt ping, không xếp hàng sau nó
+                    self.controller.send_frame(conn.socket, ping, blocking=False)
+
+    def reap(self, conn):
+        """Đánh thức thread đang chặn ở recv/send của kết nối này để nó tự dọn dẹp"""
+        if conn.closed:
+            return
+        conn.closed = True
+        CONNECTIONS_REAPED.inc()
+        logger.info("Reaping stalled connection %s (idle %.1fs)", conn.address, conn.idle_for())
+        try:
+            conn.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def record_pong(self, conn, ts):
+        if isinstance(ts, (int, float)):
+            conn.rtt = time.monotonic() - ts
+            HEARTBEAT_RTT.observe(conn.rtt)
+
+    def stop(self):
+        self.running = False
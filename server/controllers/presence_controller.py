@@ -0,0 +1,148 @@
+# server/controllers/presence_controller.py
+import socket
+import struct
+import threading
+import time
+import logging
+from collections import deque
+from config.config import MULTICAST_CONFIG, PRESENCE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Gói presence: magic, version, loại sự kiện, seq, user_id (heartbeat: số user online)
+PRESENCE_PACKET = struct.Struct('>2sBBII')
+PRESENCE_MAGIC = b'PS'
+PRESENCE_VERSION = 1
+
+EVENT_ONLINE = 1
+EVENT_OFFLINE = 2
+EVENT_DIRECTORY = 3  # User mới đăng ký hoặc đổi tên/avatar
+EVENT_HEARTBEAT = 4
+
+EVENT_NAMES = {
+    EVENT_ONLINE: "online",
+    EVENT_OFFLINE: "offline",
+    EVENT_DIRECTORY: "directory",
+    EVENT_HEARTBEAT: "heartbeat"
+}
+
+
+class PresencePublisher:
+    """Phát sự kiện online/offline/đổi danh bạ qua UDP multicast.
+
+    Một datagram tới được mọi client trong LAN thay vì N frame TCP. Mỗi sự kiện có
+    seq tăng dần; client thấy hổng seq thì gọi `get_presence` qua TCP để đồng bộ lại.
+
+    multicast=False (chạy nhiều node): seq là riêng của từng node nên các node không được
+    phát chung 1 group; sự kiện chỉ đẩy qua TCP cho client của node này.
+    """
+
+    def __init__(self, group=MULTICAST_CONFIG["group"], port=MULTICAST_CONFIG["port"],
+                 ttl=MULTICAST_CONFIG["ttl"], interface=MULTICAST_CONFIG["interface"], multicast=True):
+        self.address = (group, port)
+        self.multicast = multicast
+        self.seq = 0
+        self.online = set()
+        self.history = deque(maxlen=PRESENCE_CONFIG["history_size"])
+        self.lock = threading.Lock()
+        self.tcp_listeners = []  # Callback gửi sự kiện cho client không nhận được multicast
+        self.running = True
+        self.socket = None
+        if not multicast:
+            return
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        if interface != "0.0.0.0":
+            self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+
+        threading.Thread(target=self._heartbeat_loop, daemon=True).start()
+
+    def _send(self, event_type, seq, value):
+        if self.socket is None:
+            return
+        try:
+            self.socket.sendto(
+                PRESENCE_PACKET.pack(PRESENCE_MAGIC, PRESENCE_VERSION, event_type, seq, value),
+                self.address
+            )
+        except OSError as e:
+            logger.error(f"Lỗi gửi presence multicast: {e}")
+
+    def _publish(self, event_type, user_id):
+        with self.lock:
+            if event_type == EVENT_ONLINE:
+                if user_id in self.online:
+                    return
+                self.online.add(user_id)
+            elif event_type == EVENT_OFFLINE:
+                if user_id not in self.online:
+                    return
+                self.online.discard(user_id)
+            self.seq += 1
+            seq = self.seq
+            self.history.append((seq, event_type, user_id))
+            listeners = list(self.tcp_listeners)
+
+        self._send(event_type, seq, user_id)
+        event = {"action": "presence", "type": EVENT_NAMES[event_type], "seq": seq, "user_id": user_id}
+        for listener in listeners:
+            listener(event)
+
+    def user_online(self, user_id):
+        self._publish(EVENT_ONLINE, user_id)
+
+    def user_offline(self, user_id):
+        self._publish(EVENT_OFFLINE, user_id)
+
+    def directory_changed(self, user_id):
+        self._publish(EVENT_DIRECTORY, user_id)
+
+    def snapshot(self):
+        """Trạng thái đầy đủ để client đồng bộ lại"""
+        with self.lock:
+            return {
+                "seq": self.seq,
+                "online": sorted(self.online),
+                "group": self.address[0],
+                "port": self.address[1],
+                "multicast": self.multicast
+            }
+
+    def events_since(self, seq):
+        """Các sự kiện sau seq; None nếu đã trôi khỏi lịch sử (client cần lấy snapshot)"""
+        with self.lock:
+            if seq == self.seq:
+                return []
+            if seq > self.seq:
+                return None  # Server đã khởi động lại, seq bắt đầu lại từ 0
+            if not self.history or self.history[0][0] > seq + 1:
+                return None
+            return [
+                {"type": EVENT_NAMES[t], "seq": s, "user_id": uid}
+                for s, t, uid in self.history if s > seq
+            ]
+
+    def add_tcp_listener(self, listener):
+        with self.lock:
+            self.tcp_listeners.append(listener)
+
+    def remove_tcp_listener(self, listener):
+        with self.lock:
+            if listener in self.tcp_listeners:
+                self.tcp_listeners.remove(listener)
+
+    def _heartbeat_loop(self):
+        # Heartbeat mang seq hiện tại: client mất gói cuối cùng vẫn phát hiện được
+        interval = PRESENCE_CONFIG["heartbeat_interval"]
+        while self.running:
+            time.sleep(interval)
+            with self.lock:
+                seq, online_count = self.seq, len(self.online)
+            self._send(EVENT_HEARTBEAT, seq, online_count)
+
+    def stop(self):
+        self.running = False
+        if self.socket is not None:
+            self.socket.close()
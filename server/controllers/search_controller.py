@@ -0,0 +1,137 @@
+# server/controllers/search_controller.py
+import math
+import re
+import threading
+import time
+import unicodedata
+import logging
+from config.config import SEARCH_CONFIG
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"[^\W_]+")  # Tách cả "_" và "." trong tên file
+
+
+def normalize(text):
+    """Chữ thường, bỏ dấu tiếng Việt: gõ 'tin nhan' vẫn tìm được 'tin nhắn'"""
+    text = unicodedata.normalize("NFD", text.lower()).replace("đ", "d")
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(normalize(text or ""))
+
+
+def direct_key(user_a, user_b):
+    return ("user", min(user_a, user_b), max(user_a, user_b))
+
+
+def group_key(group_id):
+    return ("group", group_id)
+
+
+class MessageSearchIndex:
+    """Chỉ mục đảo trong RAM cho tin nhắn chữ và tên file media.
+
+    Posting chia theo hội thoại: term -> hội thoại -> {doc: số lần xuất hiện}, nên
+    truy vấn chỉ đụng tới các hội thoại user được xem thay vì toàn bộ tin nhắn.
+    Doc là ("user", message_id) hoặc ("group", message_id).
+    """
+
+    def __init__(self):
+        self.postings = {}    # term -> {conv_key: {doc_key: tf}}
+        self.doc_freq = {}    # term -> số doc chứa term (để tính idf)
+        self.docs = {}        # doc_key -> (conv_key, sender_id, đoạn trích, kind, timestamp)
+        self.user_convs = {}  # user_id -> set(conv_key) của hội thoại 1-1
+        self.lock = threading.RLock()
+        self.ready = False
+
+    def add(self, doc_key, conv_key, sender_id, text, kind="text", timestamp=None):
+        """Thêm 1 tin nhắn; gọi lại với cùng doc_key thì bỏ qua"""
+        terms = tokenize(text)
+        if not terms:
+            return
+        counts = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        with self.lock:
+            if doc_key in self.docs:
+                return
+            self.docs[doc_key] = (
+                conv_key, sender_id, (text or "")[:SEARCH_CONFIG["snippet_chars"]], kind,
+                timestamp or time.strftime("%Y-%m-%d %H:%M:%S")
+            )
+            for term, tf in counts.items():
+                self.postings.setdefault(term, {}).setdefault(conv_key, {})[doc_key] = tf
+                self.doc_freq[term] = self.doc_freq.get(term, 0) + 1
+            if conv_key[0] == "user":
+                self.user_convs.setdefault(conv_key[1], set()).add(conv_key)
+                self.user_convs.setdefault(conv_key[2], set()).add(conv_key)
+
+    def add_direct(self, message_id, sender_id, receiver_id, text, kind="text", timestamp=None):
+        self.add(("user", message_id), direct_key(sender_id, receiver_id), sender_id, text, kind, timestamp)
+
+    def add_group(self, message_id, group_id, sender_id, text, kind="text", timestamp=None):
+        self.add(("group", message_id), group_key(group_id), sender_id, text, kind, timestamp)
+
+    def build(self, model):
+        """Nạp toàn bộ tin nhắn từ database (chạy nền lúc server khởi động)"""
+        start = time.perf_counter()
+        rows = model.get_searchable_messages()
+        for row in rows:
+            if row["conv_type"] == "group":
+                self.add_group(row["id"], row["group_id"], row["sender_id"], row["message"], row["kind"], row["timestamp"])
+            else:
+                self.add_direct(row["id"], row["sender_id"], row["receiver_id"], row["message"], row["kind"], row["timestamp"])
+        self.ready = True
+        logger.info("Search index built: %d messages in %.1fs", len(rows), time.perf_counter() - start)
+
+    def direct_conversations(self, user_id):
+        with self.lock:
+            return list(self.user_convs.get(user_id, ()))
+
+    def search(self, user_id, query, conv_keys, offset=0, limit=20):
+        """Tìm tin chứa mọi từ trong query, trong các hội thoại conv_keys.
+        Xếp hạng theo tf-idf, bằng điểm thì tin mới hơn đứng trước."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return 0, []
+        with self.lock:
+            total_docs = max(1, len(self.docs))
+            idf = {t: math.log(1 + total_docs / self.doc_freq.get(t, 1)) for t in terms}
+            # Từ hiếm trước: tập ứng viên nhỏ nhất, giao nhanh nhất
+            terms.sort(key=lambda t: self.doc_freq.get(t, 0))
+
+            scored = []
+            for conv_key in conv_keys:
+                lists = [self.postings.get(t, {}).get(conv_key) for t in terms]
+                if not all(lists):
+                    continue
+                candidates = set(lists[0])
+                for docs in lists[1:]:
+                    candidates.intersection_update(docs)
+                    if not candidates:
+                        break
+                for doc_key in candidates:
+                    score = sum(docs[doc_key] * idf[t] for t, docs in zip(terms, lists))
+                    scored.append((score, doc_key))
+
+            scored.sort(key=lambda item: (-item[0], -item[1][1]))
+            page = scored[offset:offset + limit]
+            results = []
+            for score, doc_key in page:
+                conv_key, sender_id, snippet, kind, timestamp = self.docs[doc_key]
+                result = {
+                    "message_id": doc_key[1],
+                    "sender_id": sender_id,
+                    "message": snippet,
+                    "kind": kind,
+                    "timestamp": timestamp,
+                    "score": round(score, 3)
+                }
+                if conv_key[0] == "group":
+                    result["group_id"] = conv_key[1]
+                else:
+                    result["peer_id"] = conv_key[2] if conv_key[1] == user_id else conv_key[1]
+                results.append(result)
+            return len(scored), results
@@ -0,0 +1,38 @@
+# server/controllers/typing_controller.py
+import threading
+import time
+from config.config import TYPING_CONFIG
+
+
+class TypingCoalescer:
+    """Gộp sự kiện "đang nhập" theo từng cặp người gửi-nhận.
+
+    Không ghi database, không tra profile, không vào hàng đợi offline: mỗi cặp chỉ
+    được chuyển tiếp tối đa 1 sự kiện mỗi `interval` giây, phần còn lại bị bỏ.
+    """
+
+    def __init__(self, interval=TYPING_CONFIG["interval"]):
+        self.interval = interval
+        self.last_forward = {}  # (sender_id, receiver_id) -> thời điểm chuyển tiếp gần nhất
+        self.lock = threading.Lock()
+        self.last_prune = time.monotonic()
+
+    def should_forward(self, sender_id, receiver_id, typing=True):
+        now = time.monotonic()
+        key = (sender_id, receiver_id)
+        with self.lock:
+            if not typing:
+                # "Ngừng nhập" chỉ cần gửi nếu trước đó đã báo "đang nhập"
+                return self.last_forward.pop(key, None) is not None
+
+            last = self.last_forward.get(key)
+            if last is not None and now - last < self.interval:
+                return False
+            self.last_forward[key] = now
+
+            if now - self.last_prune > self.interval * 10:
+                # Dọn các cặp đã im lặng lâu để dict không phình ra
+                cutoff = now - self.interval * 5
+                self.last_forward = {k: t for k, t in self.last_forward.items() if t >= cutoff}
+                self.last_prune = now
+            return True
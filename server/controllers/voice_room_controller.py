@@ -0,0 +1,95 @@
+# server/controllers/voice_room_controller.py
+import threading
+import logging
+from config.config import MULTICAST_CONFIG, VOICE_ROOM_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class VoiceRoomManager:
+    """Quản lý thành viên phòng thoại.
+
+    Server chỉ làm signaling (ai đang ở phòng nào, phòng dùng port multicast nào).
+    Âm thanh đi trực tiếp giữa các client qua UDP multicast, không qua server.
+    """
+
+    def __init__(self, group=MULTICAST_CONFIG["group"], port_base=VOICE_ROOM_CONFIG["port_base"],
+                 max_rooms=VOICE_ROOM_CONFIG["max_rooms"], max_members=VOICE_ROOM_CONFIG["max_members"]):
+        self.group = group
+        self.port_base = port_base
+        self.max_rooms = max_rooms
+        self.max_members = max_members
+        self.rooms = {}  # room_name -> {"slot": int, "members": set(user_id)}
+        self.user_rooms = {}  # user_id -> room_name (mỗi user chỉ ở 1 phòng)
+        self.lock = threading.Lock()
+
+    def _room_info(self, room_name):
+        room = self.rooms[room_name]
+        return {
+            "room": room_name,
+            "group": self.group,
+            "port": self.port_base + room["slot"],
+            "members": sorted(room["members"]),
+            "sample_rate": VOICE_ROOM_CONFIG["sample_rate"],
+            "frame_ms": VOICE_ROOM_CONFIG["frame_ms"]
+        }
+
+    def _free_slot(self):
+        used = {room["slot"] for room in self.rooms.values()}
+        for slot in range(self.max_rooms):
+            if slot not in used:
+                return slot
+        return None
+
+    def join(self, user_id, room_name):
+        """Thêm user vào phòng, trả về (response, danh sách phòng bị thay đổi)"""
+        if not isinstance(room_name, str) or not room_name.strip() or len(room_name) > 64:
+            return {"status": "error", "message": "Tên phòng không hợp lệ"}, []
+
+        room_name = room_name.strip()
+        with self.lock:
+            changed = []
+            old_room = self.user_rooms.get(user_id)
+            if old_room == room_name:
+                return {"status": "success", **self._room_info(room_name)}, []
+
+            if room_name not in self.rooms:
+                slot = self._free_slot()
+                if slot is None:
+                    return {"status": "error", "message": "Đã hết phòng thoại trống"}, []
+                self.rooms[room_name] = {"slot": slot, "members": set()}
+            elif len(self.rooms[room_name]["members"]) >= self.max_members:
+                return {"status": "error", "message": "Phòng thoại đã đầy"}, []
+
+            if old_room is not None:
+                changed.append(self._remove_locked(user_id, old_room))
+
+            self.rooms[room_name]["members"].add(user_id)
+            self.user_rooms[user_id] = room_name
+            info = self._room_info(room_name)
+            changed.append(info)
+            logger.info("User %s joined voice room %s (port %s)", user_id, room_name, info['port'])
+            return {"status": "success", **info}, changed
+
+    def _remove_locked(self, user_id, room_name):
+        room = self.rooms[room_name]
+        room["members"].discard(user_id)
+        self.user_rooms.pop(user_id, None)
+        info = self._room_info(room_name)
+        if not room["members"]:
+            # Phòng trống -> giải phóng port cho phòng khác
+            del self.rooms[room_name]
+        return info
+
+    def leave(self, user_id):
+        """Xóa user khỏi phòng hiện tại, trả về thông tin phòng sau khi rời (hoặc None)"""
+        with self.lock:
+            room_name = self.user_rooms.get(user_id)
+            if room_name is None:
+                return None
+            logger.info("User %s left voice room %s", user_id, room_name)
+            return self._remove_locked(user_id, room_name)
+
+    def list_rooms(self):
+        with self.lock:
+            return [self._room_info(name) for name in self.rooms]
@@ -0,0 +1,149 @@
+# server/models/archive.py
+import gzip
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from config.config import ARCHIVE_CONFIG
+import logging
+
+logger = logging.getLogger(__name__)
+
+_SEGMENT_RE = re.compile(r"^(\d+)-(\d+)\.json\.gz$")
+
+
+class MessageArchive:
+    """Kho lạnh cho tin nhắn 1-1 cũ: mỗi cặp user 1 thư mục, mỗi segment là 1 file gzip JSON.
+
+    Tên file là khoảng id `first-last` nên đọc ngược theo trang không cần mở file thừa.
+    Mỗi dòng giữ đúng thứ tự cột của truy vấn lịch sử để ghép với dữ liệu nóng.
+    """
+
+    def __init__(self, directory=ARCHIVE_CONFIG["directory"], cache_segments=ARCHIVE_CONFIG["cache_segments"]):
+        self.directory = directory
+        self.segments = {}  # (user nhỏ, user lớn) -> [(first_id, last_id, path)] tăng dần
+        self.cache = OrderedDict()  # path -> rows, LRU các segment đã giải nén
+        self.cache_size = cache_segments
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load_manifest()
+
+    def _load_manifest(self):
+        for name in os.listdir(self.directory):
+            parts = name.split("_")
+            if len(parts) != 3 or parts[0] != "user":
+                continue
+            pair = (int(parts[1]), int(parts[2]))
+            pair_dir = os.path.join(self.directory, name)
+            for filename in os.listdir(pair_dir):
+                match = _SEGMENT_RE.match(filename)
+                if match:
+                    self.segments.setdefault(pair, []).append(
+                        (int(match.group(1)), int(match.group(2)), os.path.join(pair_dir, filename))
+                    )
+        for segments in self.segments.values():
+            segments.sort()
+        logger.info("Archive manifest loaded: %d conversations", len(self.segments))
+
+    def write_segment(self, pair, rows):
+        """Ghi 1 segment (rows đã sắp theo id) và fsync trước khi nơi gọi xóa bản nóng"""
+        first_id, last_id = rows[0][9], rows[-1][9]
+        pair_dir = os.path.join(self.directory, f"user_{pair[0]}_{pair[1]}")
+        os.makedirs(pair_dir, exist_ok=True)
+        path = os.path.join(pair_dir, f"{first_id}-{last_id}.json.gz")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=ARCHIVE_CONFIG["compress_level"]) as f:
+                f.write(json.dumps(rows, default=str).encode('utf-8'))
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, path)
+        with self.lock:
+            segments = self.segments.setdefault(pair, [])
+            segments.append((first_id, last_id, path))
+            segments.sort()
+
+    def _read_segment(self, path):
+        with self.lock:
+            rows = self.cache.get(path)
+            if rows is not None:
+                self.cache.move_to_end(path)
+                return rows
+        with gzip.open(path, "rb") as f:
+            rows = json.loads(f.read().decode('utf-8'))
+        with self.lock:
+            self.cache[path] = rows
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return rows
+
+    def has(self, pair):
+        return bool(self.segments.get(pair))
+
+    def read(self, pair, before_id=None, limit=None, after_id=None):
+        """Các dòng có after_id < id < before_id (mới nhất trước khi cắt limit), trả về theo id tăng dần"""
+        with self.lock:
+            segments = list(self.segments.get(pair, ()))
+        collected = []
+        seen = set()
+        for first_id, last_id, path in reversed(segments):
+            if before_id is not None and first_id >= before_id:
+                continue
+            if after_id is not None and last_id <= after_id:
+                break  # Các segment còn lại đều cũ hơn
+            for row in reversed(self._read_segment(path)):
+                if (before_id is not None and row[9] >= before_id) or row[9] in seen:
+                    continue
+                if after_id is not None and row[9] <= after_id:
+                    break
+                seen.add(row[9])  # Chạy lại job sau sự cố có thể ghi trùng
+                collected.append(row)
+                if limit is not None and len(collected) >= limit:
+                    return collected[::-1]
+        return collected[::-1]
+
+    def iter_pairs(self):
+        with self.lock:
+            return list(self.segments)
+
+
+class ArchiveJob:
+    """Chạy định kỳ: chuyển tin cũ hơn older_than_days từ bảng nóng sang kho lạnh"""
+
+    def __init__(self, model, interval=ARCHIVE_CONFIG["interval_hours"] * 3600):
+        self.model = model
+        self.interval = interval
+        self.running = False
+
+    def run_once(self):
+        cutoff = time.strftime(
+            "%Y-%m-%d %H:%M:%S", time.localtime(time.time() - ARCHIVE_CONFIG["older_than_days"] * 86400)
+        )
+        start = time.perf_counter()
+        total = 0
+        while True:
+            # Mỗi batch giữ db_lock ngắn để không chặn request lâu
+            moved = self.model.archive_messages(cutoff, ARCHIVE_CONFIG["batch_size"])
+            total += moved
+            if moved < ARCHIVE_CONFIG["batch_size"]:
+                break
+        if total:
+            logger.info("Archived %d messages older than %s in %.1fs", total, cutoff, time.perf_counter() - start)
+        return total
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def _loop(self):
+        while self.running:
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Archive job failed: {e}")
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
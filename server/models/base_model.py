@@ -0,0 +1,763 @@
+# server/models/base_model.py
+import functools
+import inspect
+import threading
+from config.config import STORAGE_CONFIG
+from server.utils.password_hasher import HASHER, HasherBusy
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+BUSY = {"status": "error", "message": "Máy chủ đang bận, vui lòng thử lại sau", "retry_after": 1}
+
+
+def synchronized(cls):
+    """Bọc mọi method public bằng db_lock: các thread client dùng chung 1 connection/cursor"""
+    for name, func in list(vars(cls).items()):
+        if name.startswith("_") or not inspect.isfunction(func) or getattr(func, "manual_lock", False):
+            continue
+        setattr(cls, name, _locked(func))
+    return cls
+
+
+def manual_lock(func):
+    """Method tự giữ db_lock từng đoạn (vd: không giữ lock trong lúc băm mật khẩu)"""
+    func.manual_lock = True
+    return func
+
+
+def _locked(func):
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self.db_lock:
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
+def _kind(is_image, is_voice, is_video):
+    if is_image:
+        return "image"
+    if is_voice:
+        return "voice"
+    if is_video:
+        return "video"
+    return "text"
+
+
+@synchronized
+class BaseUserModel:
+    """Phần truy vấn dùng chung của các backend lưu trữ.
+
+    Câu SQL viết theo placeholder %s; backend con cung cấp connection/cursor, lớp lỗi
+    `Error`, DDL trong `_ensure_tables` và 2 câu upsert khác nhau giữa các database.
+    """
+
+    Error = Exception
+
+    def __init__(self, bcrypt_rounds=STORAGE_CONFIG["bcrypt_rounds"], archive=None):
+        self.bcrypt_rounds = bcrypt_rounds
+        self.archive = archive  # MessageArchive: tin 1-1 cũ đã chuyển sang kho lạnh
+        self.db_lock = threading.RLock()
+        self.connection, self.cursor = self._connect()
+        self._ensure_tables()
+
+    def _connect(self):
+        """Trả về (connection, cursor)"""
+        raise NotImplementedError
+
+    def _ensure_tables(self):
+        raise NotImplementedError
+
+    def get_user_id(self, email):
+        try:
+            query = "SELECT id FROM users WHERE email = %s"
+            self.cursor.execute(query, (email,))
+            result = self.cursor.fetchone()
+            return result[0] if result else None
+        except self.Error as err:
+            logger.error(f"Error getting user_id: {err}")
+            return None
+
+    def get_display_name(self, user_id):
+        try:
+            query = "SELECT display_name FROM users WHERE id = %s"
+            self.cursor.execute(query, (user_id,))
+            result = self.cursor.fetchone()
+            return result[0] if result else "Unknown"
+        except self.Error as err:
+            logger.error(f"Error getting display_name: {err}")
+            return "Unknown"
+
+    def get_avatar(self, user_id):
+        try:
+            query = "SELECT avatar_data FROM users WHERE id = %s"
+            self.cursor.execute(query, (user_id,))
+            result = self.cursor.fetchone()
+            return result[0] if result and result[0] else None
+        except self.Error as err:
+            logger.error(f"Error getting avatar: {err}")
+            return None
+
+    def get_existing_user_ids(self, user_ids):
+        """Tập các id trong user_ids có tồn tại trong bảng users"""
+        if not user_ids:
+            return set()
+        try:
+            ids = list(set(user_ids))
+            query = f"SELECT id FROM users WHERE id IN ({', '.join(['%s'] * len(ids))})"
+            self.cursor.execute(query, tuple(ids))
+            return {row[0] for row in self.cursor.fetchall()}
+        except self.Error as err:
+            logger.error(f"Error checking user ids: {err}")
+            return set()
+
+    def get_user(self, user_id):
+        """1 dòng danh bạ (như get_all_users); None nếu không có"""
+        try:
+            self.cursor.execute("SELECT id, display_name, avatar_data FROM users WHERE id = %s", (user_id,))
+            row = self.cursor.fetchone()
+            return {"user_id": row[0], "display_name": row[1], "avatar": row[2]} if row else None
+        except self.Error as err:
+            logger.error(f"Error getting user: {err}")
+            return None
+
+    def get_all_users(self):
+        try:
+            query = "SELECT id, display_name, avatar_data FROM users"
+            self.cursor.execute(query)
+            return [
+                {"user_id": row[0], "display_name": row[1], "avatar": row[2]}
+                for row in self.cursor.fetchall()
+            ]
+        except self.Error as err:
+            logger.error(f"Error getting all users: {err}")
+            return []
+
+    @manual_lock
+    def register_user(self, display_name, email, password):
+        try:
+            with self.db_lock:
+                self.cursor.execute("SELECT email FROM users WHERE email = %s", (email,))
+                if self.cursor.fetchone():
+                    return {"status": "error", "message": "Email đã tồn tại"}
+
+            # Băm ở process pool, không giữ db_lock
+            password_hash = HASHER.hash(password, self.bcrypt_rounds)
+
+            with self.db_lock:
+                self.cursor.execute("SELECT email FROM users WHERE email = %s", (email,))
+                if self.cursor.fetchone():
+                    return {"status": "error", "message": "Email đã tồn tại"}
+                query = "INSERT INTO users (display_name, email, password_hash) VALUES (%s, %s, %s)"
+                self.cursor.execute(query, (display_name, email, password_hash))
+                self.connection.commit()
+
+            logger.info("User registered: %s", email)
+            return {"status": "success", "message": "Đăng ký thành công"}
+        except HasherBusy:
+            return dict(BUSY)
+        except self.Error as err:
+            logger.error(f"Database error during registration: {err}")
+            return {"status": "error", "message": f"Lỗi database: {err}"}
+        except Exception as e:
+            logger.error(f"Unexpected error during registration: {e}")
+            return {"status": "error", "message": f"Lỗi: {str(e)}"}
+
+    @manual_lock
+    def login_user(self, email, password):
+        try:
+            with self.db_lock:
+                query = "SELECT id, display_name, password_hash, avatar_data FROM users WHERE email = %s"
+                self.cursor.execute(query, (email,))
+                result = self.cursor.fetchone()
+
+            if result:
+                user_id, display_name, password_hash, avatar_data = result
+                try:
+                    if HASHER.check(password, password_hash):
+                        logger.info("User logged in: %s", email)
+                        return {"status": "success", "user_id": user_id, "display_name": display_name, "avatar": avatar_data}
+                    else:
+                        return {"status": "error", "message": "Mật khẩu sai"}
+                except ValueError as e:
+                    logger.error(f"Password hash error: {e}")
+                    return {"status": "error", "message": f"Lỗi mã hóa (Invalid salt): {str(e)}. Vui lòng đăng ký lại."}
+            else:
+                return {"status": "error", "message": "Tài khoản không tồn tại"}
+        except HasherBusy:
+            return dict(BUSY)
+        except self.Error as err:
+            logger.error(f"Database error during login: {err}")
+            return {"status": "error", "message": f"Lỗi database: {err}"}
+
+    def save_message(self, sender_id, receiver_id, message):
+        try:
+            query = "INSERT INTO chat_messages (sender_id, receiver_id, message, is_image) VALUES (%s, %s, %s, %s)"
+            self.cursor.execute(query, (sender_id, receiver_id, message, False))
+            message_id = self.cursor.lastrowid
+            self._increment_unread(receiver_id, sender_id)
+            self.connection.commit()
+            logger.debug("Message saved: %s -> %s", sender_id, receiver_id)
+            return message_id
+        except self.Error as err:
+            logger.error(f"Error saving message: {err}")
+            return None
+
+    def save_image_message(self, sender_id, receiver_id, image_data, filename):
+        """Lưu tin nhắn ảnh vào database"""
+        try:
+            query = """
+                    INSERT INTO chat_messages (sender_id, receiver_id, message, is_image, image_data)
+                    VALUES (%s, %s, %s, %s, %s) \
+                    """
+            self.cursor.execute(query, (sender_id, receiver_id, filename, True, image_data))
+            message_id = self.cursor.lastrowid
+            self._increment_unread(receiver_id, sender_id)
+            self.connection.commit()
+            logger.debug("Image message saved: %s -> %s", sender_id, receiver_id)
+            return message_id
+        except self.Error as err:
+            logger.error(f"Error saving image message: {err}")
+            return None
+
+    def save_voice_message(self, sender_id, receiver_id, voice_data, filename):
+        """Lưu tin nhắn voice vào database"""
+        try:
+            query = """
+                    INSERT INTO chat_messages (sender_id, receiver_id, message, is_voice, voice_data)
+                    VALUES (%s, %s, %s, %s, %s)
+                    """
+            self.cursor.execute(query, (sender_id, receiver_id, filename, True, voice_data))
+            message_id = self.cursor.lastrowid
+            self._increment_unread(receiver_id, sender_id)
+            self.connection.commit()
+            logger.debug("Voice message saved: %s -> %s", sender_id, receiver_id)
+            return message_id
+        except self.Error as err:
+            logger.error(f"Error saving voice message: {err}")
+            return None
+
+    def save_video_message(self, sender_id, receiver_id, video_data, filename):
+        """Lưu tin nhắn video vào database"""
+        try:
+            query = """
+                    INSERT INTO chat_messages (sender_id, receiver_id, message, is_video, video_data)
+                    VALUES (%s, %s, %s, %s, %s)
+                    """
+            self.cursor.execute(query, (sender_id, receiver_id, filename, True, video_data))
+            message_id = self.cursor.lastrowid
+            self._increment_unread(receiver_id, sender_id)
+            self.connection.commit()
+            logger.debug("Video message saved: %s -> %s", sender_id, receiver_id)
+            return message_id
+        except self.Error as err:
+            logger.error(f"Error saving video message: {err}")
+            return None
+
+
+    def get_chat_history(self, sender_id, receiver_id, before_id=None, limit=None, after_id=None):
+        """Lịch sử 1-1 theo id tăng dần; có limit thì lấy limit tin mới nhất trước before_id.
+        after_id: chỉ lấy tin mới hơn (client đồng bộ phần chênh với bản lưu cục bộ).
+        Trang vượt qua ranh giới nóng/lạnh thì đọc tiếp từ kho lưu trữ."""
+        try:
+            query = """
+                    SELECT sender_id, message, timestamp, is_image, image_data, is_voice, voice_data, is_video, video_data, id
+                    FROM chat_messages
+                    WHERE ((sender_id = %s AND receiver_id = %s)
+                       OR (sender_id = %s AND receiver_id = %s))
+                    """
+            params = [sender_id, receiver_id, receiver_id, sender_id]
+            if before_id is not None:
+                query += " AND id < %s"
+                params.append(before_id)
+            if after_id is not None:
+                query += " AND id > %s"
+                params.append(after_id)
+            query += " ORDER BY id DESC"
+            if limit is not None:
+                query += " LIMIT %s"
+                params.append(limit)
+            self.cursor.execute(query, tuple(params))
+            rows = self.cursor.fetchall()[::-1]
+
+            pair = (min(sender_id, receiver_id), max(sender_id, receiver_id))
+            if self.archive is not None and self.archive.has(pair) and (limit is None or len(rows) < limit):
+                cold_before = rows[0][9] if rows else before_id
+                cold_limit = None if limit is None else limit - len(rows)
+                rows = self.archive.read(pair, cold_before, cold_limit, after_id) + rows
+
+            senders = {}
+            history = []
+            for row in rows:
+                if row[0] not in senders:
+                    senders[row[0]] = (self.get_display_name(row[0]), self.get_avatar(row[0]))
+                msg = {
+                    "id": row[9],
+                    "sender_id": row[0],
+                    "sender_name": senders[row[0]][0],
+                    "sender_avatar": senders[row[0]][1],
+                    "timestamp": str(row[2]),
+                    "is_image": bool(row[3]) if row[3] is not None else False,
+                    "is_voice": bool(row[5]) if row[5] is not None else False,
+                    "is_video": bool(row[7]) if row[7] is not None else False,
+                    "message": row[1]  # Nội dung hoặc tên file
+                }
+
+                if msg["is_image"]:
+                    msg["image_data"] = row[4]
+                elif msg["is_voice"]:
+                    msg["voice_data"] = row[6]
+                elif msg["is_video"]:
+                    msg["video_data"] = row[8]
+
+                history.append(msg)
+
+            return history
+        except self.Error as err:
+            logger.error(f"Error getting chat history: {err}")
+            return []
+
+    def archive_messages(self, cutoff, batch_size):
+        """Chuyển tối đa batch_size tin 1-1 cũ hơn cutoff sang kho lạnh; trả về số tin đã chuyển"""
+        if self.archive is None:
+            return 0
+        try:
+            self.cursor.execute(
+                """
+                SELECT sender_id, message, timestamp, is_image, image_data, is_voice, voice_data, is_video, video_data, id,
+                       receiver_id
+                FROM chat_messages
+                WHERE timestamp < %s
+                ORDER BY id
+                LIMIT %s
+                """,
+                (cutoff, batch_size)
+            )
+            rows = self.cursor.fetchall()
+            if not rows:
+                return 0
+
+            by_pair = {}
+            for row in rows:
+                pair = (min(row[0], row[10]), max(row[0], row[10]))
+                by_pair.setdefault(pair, []).append([str(v) if i == 2 else v for i, v in enumerate(row)])
+            # Ghi file (đã fsync) xong mới xóa bản nóng: sự cố giữa chừng chỉ gây trùng, không mất tin
+            for pair, pair_rows in by_pair.items():
+                self.archive.write_segment(pair, pair_rows)
+
+            ids = [row[9] for row in rows]
+            self.cursor.execute(
+                f"DELETE FROM chat_messages WHERE id IN ({', '.join(['%s'] * len(ids))})", tuple(ids)
+            )
+            self.connection.commit()
+            return len(rows)
+        except self.Error as err:
+            logger.error(f"Error archiving messages: {err}")
+            return 0
+
+    # === Nhóm chat ===
+    def create_group(self, name, creator_id, member_ids):
+        """member_ids: id user đã kiểm tra tồn tại (ở handle_create_group)"""
+        try:
+            members = {creator_id} | set(member_ids)
+            self.cursor.execute(
+                "INSERT INTO chat_groups (name, created_by) VALUES (%s, %s)",
+                (name, creator_id)
+            )
+            group_id = self.cursor.lastrowid
+            self.cursor.executemany(
+                "INSERT INTO chat_group_members (group_id, user_id) VALUES (%s, %s)",
+                [(group_id, uid) for uid in members]
+            )
+            # Tạo sẵn dòng đếm chưa đọc để tin nhóm chỉ cần 1 câu UPDATE
+            self.cursor.executemany(
+                "INSERT INTO conversation_reads (user_id, conv_type, conv_id) VALUES (%s, 'group', %s)",
+                [(uid, group_id) for uid in members]
+            )
+            self.connection.commit()
+            logger.info("Group %s created by %s with %d members", group_id, creator_id, len(members))
+            return {"status": "success", "group_id": group_id, "name": name, "members": sorted(members)}
+        except self.Error as err:
+            logger.error(f"Error creating group: {err}")
+            return {"status": "error", "message": f"Lỗi database: {err}"}
+
+    def get_group_members(self, group_id):
+        try:
+            self.cursor.execute("SELECT user_id FROM chat_group_members WHERE group_id = %s", (group_id,))
+            return [row[0] for row in self.cursor.fetchall()]
+        except self.Error as err:
+            logger.error(f"Error getting group members: {err}")
+            return []
+
+    def get_user_groups(self, user_id):
+        try:
+            query = """
+                    SELECT g.id, g.name
+                    FROM chat_groups g
+                             JOIN chat_group_members m ON m.group_id = g.id
+                    WHERE m.user_id = %s
+                    ORDER BY g.id
+                    """
+            self.cursor.execute(query, (user_id,))
+            groups = [{"group_id": row[0], "name": row[1]} for row in self.cursor.fetchall()]
+            for group in groups:
+                group["members"] = self.get_group_members(group["group_id"])
+            return groups
+        except self.Error as err:
+            logger.error(f"Error getting user groups: {err}")
+            return []
+
+    def save_group_message(self, group_id, sender_id, message, kind="text", media_data=None):
+        """Lưu tin nhắn nhóm 1 lần; kind: text/image/voice/video, message là nội dung hoặc tên file"""
+        try:
+            columns = ["group_id", "sender_id", "message"]
+            values = [group_id, sender_id, message]
+            if kind != "text":
+                columns += [f"is_{kind}", f"{kind}_data"]
+                values += [True, media_data]
+            query = f"INSERT INTO group_messages ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(values))})"
+            self.cursor.execute(query, tuple(values))
+            message_id = self.cursor.lastrowid
+            self.cursor.execute(
+                """
+                UPDATE conversation_reads SET unread_count = unread_count + 1
+                WHERE conv_type = 'group' AND conv_id = %s AND user_id != %s
+                """,
+                (group_id, sender_id)
+            )
+            self.connection.commit()
+            logger.debug("Group message saved: %s -> group %s", sender_id, group_id)
+            return message_id
+        except self.Error as err:
+            logger.error(f"Error saving group message: {err}")
+            return None
+
+    def get_group_history(self, group_id, after_id=None, before_id=None, limit=None):
+        """Lịch sử nhóm theo id tăng dần; có limit thì lấy limit tin mới nhất trước before_id"""
+        try:
+            query = """
+                    SELECT id, sender_id, message, timestamp, is_image, image_data, is_voice, voice_data, is_video, video_data
+                    FROM group_messages
+                    WHERE group_id = %s AND id > %s
+                    """
+            params = [group_id, after_id or 0]
+            if before_id is not None:
+                query += " AND id < %s"
+                params.append(before_id)
+            query += " ORDER BY id DESC"
+            if limit is not None:
+                query += " LIMIT %s"
+                params.append(limit)
+            self.cursor.execute(query, tuple(params))
+            rows = self.cursor.fetchall()[::-1]
+
+            # Tra tên/avatar 1 lần cho mỗi người gửi thay vì mỗi tin nhắn
+            senders = {}
+            for row in rows:
+                if row[1] not in senders:
+                    senders[row[1]] = (self.get_display_name(row[1]), self.get_avatar(row[1]))
+
+            history = []
+            for row in rows:
+                msg = {
+                    "id": row[0],
+                    "group_id": group_id,
+                    "sender_id": row[1],
+                    "sender_name": senders[row[1]][0],
+                    "sender_avatar": senders[row[1]][1],
+                    "message": row[2],
+                    "timestamp": str(row[3]),
+                    "is_image": bool(row[4]),
+                    "is_voice": bool(row[6]),
+                    "is_video": bool(row[8])
+                }
+                if msg["is_image"]:
+                    msg["image_data"] = row[5]
+                elif msg["is_voice"]:
+                    msg["voice_data"] = row[7]
+                elif msg["is_video"]:
+                    msg["video_data"] = row[9]
+                history.append(msg)
+            return history
+        except self.Error as err:
+            logger.error(f"Error getting group history: {err}")
+            return []
+
+    def get_last_message_ids(self, user_id):
+        """(id tin 1-1 mới nhất user nhận, id tin nhóm mới nhất trong các nhóm của user):
+        mốc để client resume chỉ nhận phần tin bị lỡ"""
+        try:
+            self.cursor.execute("SELECT MAX(id) FROM chat_messages WHERE receiver_id = %s", (user_id,))
+            last_direct = self.cursor.fetchone()[0] or 0
+            self.cursor.execute(
+                """
+                SELECT MAX(gm.id) FROM group_messages gm
+                JOIN chat_group_members m ON m.group_id = gm.group_id
+                WHERE m.user_id = %s
+                """,
+                (user_id,)
+            )
+            last_group = self.cursor.fetchone()[0] or 0
+            return last_direct, last_group
+        except self.Error as err:
+            logger.error(f"Error getting last message ids: {err}")
+            return 0, 0
+
+    def get_missed_messages(self, user_id, after_id, after_group_id, limit):
+        """Tin 1-1 gửi tới user có id > after_id và tin nhóm (người khác gửi) có id > after_group_id,
+        mỗi loại tối đa limit tin, theo id tăng dần"""
+        try:
+            self.cursor.execute(
+                """
+                SELECT id, sender_id, message, timestamp, is_image, image_data, is_voice, voice_data, is_video, video_data
+                FROM chat_messages
+                WHERE receiver_id = %s AND id > %s
+                ORDER BY id ASC LIMIT %s
+                """,
+                (user_id, after_id, limit)
+            )
+            direct_rows = self.cursor.fetchall()
+            self.cursor.execute(
+                """
+                SELECT gm.id, gm.sender_id, gm.message, gm.timestamp, gm.is_image, gm.image_data,
+                       gm.is_voice, gm.voice_data, gm.is_video, gm.video_data, gm.group_id
+                FROM group_messages gm
+                JOIN chat_group_members m ON m.group_id = gm.group_id
+                WHERE m.user_id = %s AND gm.id > %s AND gm.sender_id != %s
+                ORDER BY gm.id ASC LIMIT %s
+                """,
+                (user_id, after_group_id, user_id, limit)
+            )
+            group_rows = self.cursor.fetchall()
+        except self.Error as err:
+            logger.error(f"Error getting missed messages: {err}")
+            return [], []
+
+        senders = {}
+
+        def to_message(row):
+            if row[1] not in senders:
+                senders[row[1]] = (self.get_display_name(row[1]), self.get_avatar(row[1]))
+            msg = {
+                "id": row[0],
+                "sender_id": row[1],
+                "sender_name": senders[row[1]][0],
+                "sender_avatar": senders[row[1]][1],
+                "message": row[2],
+                "timestamp": str(row[3]),
+                "is_image": bool(row[4]),
+                "is_voice": bool(row[6]),
+                "is_video": bool(row[8])
+            }
+            if msg["is_image"]:
+                msg["image_data"] = row[5]
+            elif msg["is_voice"]:
+                msg["voice_data"] = row[7]
+            elif msg["is_video"]:
+                msg["video_data"] = row[9]
+            return msg
+
+        direct = [dict(to_message(row), receiver_id=user_id) for row in direct_rows]
+        group = [dict(to_message(row), group_id=row[10]) for row in group_rows]
+        return direct, group
+
+    def get_searchable_messages(self):
+        """Phần chữ của mọi tin nhắn (text hoặc tên file media) để dựng chỉ mục tìm kiếm"""
+        try:
+            messages = []
+            self.cursor.execute("""
+                SELECT id, sender_id, receiver_id, message, is_image, is_voice, is_video, timestamp
+                FROM chat_messages
+                WHERE message IS NOT NULL
+            """)
+            for row in self.cursor.fetchall():
+                messages.append({
+                    "conv_type": "user", "id": row[0], "sender_id": row[1], "receiver_id": row[2],
+                    "message": row[3], "kind": _kind(row[4], row[5], row[6]), "timestamp": str(row[7])
+                })
+            if self.archive is not None:
+                for pair in self.archive.iter_pairs():
+                    for row in self.archive.read(pair):
+                        messages.append({
+                            "conv_type": "user", "id": row[9], "sender_id": row[0], "receiver_id": row[10],
+                            "message": row[1], "kind": _kind(row[3], row[5], row[7]), "timestamp": row[2]
+                        })
+            self.cursor.execute("""
+                SELECT id, sender_id, group_id, message, is_image, is_voice, is_video, timestamp
+                FROM group_messages
+                WHERE message IS NOT NULL
+            """)
+            for row in self.cursor.fetchall():
+                messages.append({
+                    "conv_type": "group", "id": row[0], "sender_id": row[1], "group_id": row[2],
+                    "message": row[3], "kind": _kind(row[4], row[5], row[6]), "timestamp": str(row[7])
+                })
+            return messages
+        except self.Error as err:
+            logger.error(f"Error loading searchable messages: {err}")
+            return []
+
+    # === Đã đọc / chưa đọc ===
+    def _increment_unread(self, user_id, peer_id):
+        """+1 tin chưa đọc của user_id trong hội thoại với peer_id (chưa commit)"""
+        raise NotImplementedError
+
+    def _save_read_marker(self, user_id, conv_type, conv_id, last_read_id, unread):
+        """Ghi marker đã đọc; marker không bao giờ lùi lại (chưa commit)"""
+        raise NotImplementedError
+
+    def mark_read(self, user_id, conv_type, conv_id, last_read_id=None):
+        """Đánh dấu đã đọc tới last_read_id (mặc định: tin mới nhất), trả về số tin còn chưa đọc"""
+        try:
+            if conv_type == "group":
+                latest_query = "SELECT MAX(id) FROM group_messages WHERE group_id = %s"
+                latest_params = (conv_id,)
+                count_query = "SELECT COUNT(*) FROM group_messages WHERE group_id = %s AND sender_id != %s AND id > %s"
+                count_params = (conv_id, user_id)
+            else:
+                latest_query = "SELECT MAX(id) FROM chat_messages WHERE sender_id = %s AND receiver_id = %s"
+                latest_params = (conv_id, user_id)
+                count_query = "SELECT COUNT(*) FROM chat_messages WHERE sender_id = %s AND receiver_id = %s AND id > %s"
+                count_params = (conv_id, user_id)
+
+            self.cursor.execute(latest_query, latest_params)
+            latest_id = self.cursor.fetchone()[0] or 0
+            if last_read_id is None or last_read_id >= latest_id:
+                last_read_id, unread = latest_id, 0
+            else:
+                # Đọc dở: chỉ đếm phần đuôi sau marker (dùng index theo id)
+                self.cursor.execute(count_query, count_params + (last_read_id,))
+                unread = self.cursor.fetchone()[0]
+
+            self._save_read_marker(user_id, conv_type, conv_id, last_read_id, unread)
+            self.connection.commit()
+            return {"status": "success", "last_read_id": last_read_id, "unread": unread}
+        except self.Error as err:
+            logger.error(f"Error marking read: {err}")
+            return {"status": "error", "message": f"Lỗi database: {err}"}
+
+    def get_unread_counts(self, user_id):
+        """Số tin chưa đọc của mọi hội thoại, 1 truy vấn theo khóa chính"""
+        try:
+            self.cursor.execute(
+                """
+                SELECT conv_type, conv_id, unread_count, last_read_id
+                FROM conversation_reads
+                WHERE user_id = %s AND unread_count > 0
+                """,
+                (user_id,)
+            )
+            return [
+                {"conv_type": row[0], "conv_id": row[1], "unread": row[2], "last_read_id": row[3]}
+                for row in self.cursor.fetchall()
+            ]
+        except self.Error as err:
+            logger.error(f"Error getting unread counts: {err}")
+            return []
+
+    def get_recent_chats(self, user_id):
+        try:
+            query = """
+                    SELECT DISTINCT u2.id as user_id, u2.display_name, u2.avatar_data, m.message as last_message
+                    FROM users u2
+                             LEFT JOIN chat_messages m ON (m.sender_id = u2.id AND m.receiver_id = %s)
+                        OR (m.sender_id = %s AND m.receiver_id = u2.id)
+                    WHERE u2.id != %s
+                    ORDER BY m.timestamp DESC
+                        LIMIT 10 \
+                    """
+            self.cursor.execute(query, (user_id, user_id, user_id))
+            return [
+                {
+                    "user_id": row[0],
+                    "display_name": row[1],
+                    "avatar": row[2],
+                    "last_message": row[3] if row[3] else "Chưa có tin nhắn"
+                }
+                for row in self.cursor.fetchall()
+            ]
+        except self.Error as err:
+            logger.error(f"Error getting recent chats: {err}")
+            return []
+
+    def get_profile(self, user_id):
+        try:
+            query = "SELECT display_name, email, avatar_data FROM users WHERE id = %s"
+            self.cursor.execute(query, (user_id,))
+            result = self.cursor.fetchone()
+            if not result:
+                return {"status": "error", "message": "Không tìm thấy người dùng"}
+            return {
+                "status": "success",
+                "display_name": result[0],
+                "email": result[1],
+                "avatar": result[2]
+            }
+        except self.Error as err:
+            logger.error(f"Error getting profile: {err}")
+            return {"status": "error", "message": f"Lỗi database: {err}"}
+
+    def update_profile(self, user_id, display_name=None, avatar_data=None):
+        try:
+            fields = []
+            values = []
+            if display_name is not None:
+                fields.append("display_name = %s")
+                values.append(display_name)
+            if avatar_data is not None:
+                fields.append("avatar_data = %s")
+                values.append(avatar_data)
+            if not fields:
+                return {"status": "error", "message": "Không có dữ liệu cập nhật"}
+            values.append(user_id)
+            query = f"UPDATE users SET {', '.join(fields)} WHERE id = %s"
+            self.cursor.execute(query, tuple(values))
+            self.connection.commit()
+            return {"status": "success", "message": "Cập nhật thành công"}
+        except self.Error as err:
+            logger.error(f"Error updating profile: {err}")
+            return {"status": "error", "message": f"Lỗi database: {err}"}
+
+    @manual_lock
+    def change_password(self, user_id, old_password, new_password):
+        try:
+            # Lấy hash hiện tại
+            with self.db_lock:
+                self.cursor.execute("SELECT password_hash FROM users WHERE id = %s", (user_id,))
+                row = self.cursor.fetchone()
+            if not row:
+                return {"status": "error", "message": "Không tìm thấy người dùng"}
+            current_hash = row[0]
+            if not HASHER.check(old_password, current_hash):
+                return {"status": "error", "message": "Mật khẩu hiện tại không đúng"}
+
+            new_hash = HASHER.hash(new_password, self.bcrypt_rounds)
+            with self.db_lock:
+                self.cursor.execute("UPDATE users SET password_hash = %s WHERE id = %s", (new_hash, user_id))
+                self.connection.commit()
+            return {"status": "success", "message": "Đổi mật khẩu thành công"}
+        except HasherBusy:
+            return dict(BUSY)
+        except self.Error as err:
+            logger.error(f"Error changing password: {err}")
+            return {"status": "error", "message": f"Lỗi database: {err}"}
+
+    def close(self):
+        """Đóng connection khi server tắt (SQLite ghi checkpoint WAL lúc đóng)"""
+        if self.cursor:
+            self.cursor.close()
+        if self.connection:
+            self.connection.close()
+        self.cursor = self.connection = None
+        logger.info("Database connection closed")
+
+    def __del__(self):
+        try:
+            if hasattr(self, 'cursor') and self.cursor:
+                self.cursor.close()
+            if hasattr(self, 'connection') and self.connection:
+                self.connection.close()
+            logger.info("Database connection closed")
+        except Exception as e:
+            logger.error(f"Error closing database connection: {e}")
\ No newline at end of file
@@ -0,0 +1,156 @@
+# server/models/sqlite_model.py
+import sqlite3
+from config.config import STORAGE_CONFIG
+from server.models.base_model import BaseUserModel
+from server.utils.metrics import instrument_db_calls
+import logging
+
+logger = logging.getLogger(__name__)
+
+# WAL: đọc không chặn ghi; synchronous=NORMAL đủ an toàn với WAL và nhanh hơn FULL nhiều
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -65536",      # 64MB page cache
+    "PRAGMA mmap_size = 268435456",    # 256MB đọc qua mmap
+    "PRAGMA busy_timeout = 5000"
+)
+
+
+class _Cursor:
+    """Bọc cursor sqlite3 để dùng lại câu SQL viết theo placeholder %s"""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.queries = {}  # Câu gốc -> câu đã đổi placeholder
+
+    def _translate(self, query):
+        translated = self.queries.get(query)
+        if translated is None:
+            translated = self.queries[query] = query.replace("%s", "?")
+        return translated
+
+    def execute(self, query, params=()):
+        return self.cursor.execute(self._translate(query), params)
+
+    def executemany(self, query, seq_of_params):
+        return self.cursor.executemany(self._translate(query), seq_of_params)
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    def close(self):
+        self.cursor.close()
+
+
+@instrument_db_calls
+class SQLiteUserModel(BaseUserModel):
+    """Backend SQLite nhúng: chạy server không cần MySQL (test, benchmark, triển khai nhỏ)"""
+
+    Error = sqlite3.Error
+
+    def __init__(self, path=STORAGE_CONFIG["sqlite_path"], **kwargs):
+        self.path = path
+        super().__init__(**kwargs)
+
+    def _connect(self):
+        # Mọi thread client dùng chung connection, tuần tự hóa qua db_lock
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        for pragma in PRAGMAS:
+            connection.execute(pragma)
+        logger.info("SQLite database opened: %s", self.path)
+        return connection, _Cursor(connection.cursor())
+
+    def _ensure_tables(self):
+        """Tạo các bảng nếu chưa có"""
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                display_name TEXT NOT NULL,
+                email TEXT NOT NULL UNIQUE,
+                password_hash TEXT NOT NULL,
+                avatar_data TEXT
+            );
+            CREATE TABLE IF NOT EXISTS chat_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sender_id INTEGER NOT NULL,
+                receiver_id INTEGER NOT NULL,
+                message TEXT,
+                is_image INTEGER DEFAULT 0,
+                image_data TEXT,
+                is_voice INTEGER DEFAULT 0,
+                voice_data TEXT,
+                is_video INTEGER DEFAULT 0,
+                video_data TEXT,
+                timestamp TEXT DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE INDEX IF NOT EXISTS idx_chat_messages_pair ON chat_messages (sender_id, receiver_id, id);
+            CREATE INDEX IF NOT EXISTS idx_chat_messages_receiver ON chat_messages (receiver_id, id);
+            CREATE TABLE IF NOT EXISTS chat_groups (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                created_by INTEGER NOT NULL,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE TABLE IF NOT EXISTS chat_group_members (
+                group_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                joined_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (group_id, user_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_group_members_user ON chat_group_members (user_id);
+            CREATE TABLE IF NOT EXISTS group_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                group_id INTEGER NOT NULL,
+                sender_id INTEGER NOT NULL,
+                message TEXT,
+                is_image INTEGER DEFAULT 0,
+                image_data TEXT,
+                is_voice INTEGER DEFAULT 0,
+                voice_data TEXT,
+                is_video INTEGER DEFAULT 0,
+                video_data TEXT,
+                timestamp TEXT DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE INDEX IF NOT EXISTS idx_group_messages_group ON group_messages (group_id, id);
+            CREATE TABLE IF NOT EXISTS conversation_reads (
+                user_id INTEGER NOT NULL,
+                conv_type TEXT NOT NULL,
+                conv_id INTEGER NOT NULL,
+                last_read_id INTEGER NOT NULL DEFAULT 0,
+                unread_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, conv_type, conv_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_conversation_reads_conv ON conversation_reads (conv_type, conv_id);
+        """)
+
+    def _increment_unread(self, user_id, peer_id):
+        self.cursor.execute(
+            """
+            INSERT INTO conversation_reads (user_id, conv_type, conv_id, unread_count)
+            VALUES (%s, 'user', %s, 1)
+            ON CONFLICT (user_id, conv_type, conv_id) DO UPDATE SET unread_count = unread_count + 1
+            """,
+            (user_id, peer_id)
+        )
+
+    def _save_read_marker(self, user_id, conv_type, conv_id, last_read_id, unread):
+        self.cursor.execute(
+            """
+            INSERT INTO conversation_reads (user_id, conv_type, conv_id, last_read_id, unread_count)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (user_id, conv_type, conv_id) DO UPDATE SET
+                unread_count = CASE WHEN excluded.last_read_id >= last_read_id
+                                    THEN excluded.unread_count ELSE unread_count END,
+                last_read_id = MAX(last_read_id, excluded.last_read_id)
+            """,
+            (user_id, conv_type, conv_id, last_read_id, unread)
+        )
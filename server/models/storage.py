@@ -0,0 +1,17 @@
+# server/models/storage.py
+from config.config import STORAGE_CONFIG, ARCHIVE_CONFIG
+
+
+def create_model(backend=None, **options):
+    """Tạo model theo STORAGE_CONFIG["backend"]; import trễ để backend này không cần thư viện của backend kia"""
+    backend = backend or STORAGE_CONFIG["backend"]
+    if "archive" not in options and ARCHIVE_CONFIG["enabled"]:
+        from server.models.archive import MessageArchive
+        options["archive"] = MessageArchive()
+    if backend == "mysql":
+        from server.models.user_model import UserModel
+        return UserModel(**options)
+    if backend == "sqlite":
+        from server.models.sqlite_model import SQLiteUserModel
+        return SQLiteUserModel(**options)
+    raise ValueError(f"Backend lưu trữ không hỗ trợ: {backend}")
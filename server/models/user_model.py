@@ -1,289 +1,141 @@
 # server/models/user_model.py
 import mysql.connector
-import bcrypt
 from config.config import DATABASE_CONFIG
+from server.models.base_model import BaseUserModel
+from server.utils.metrics import instrument_db_calls
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-class UserModel:
-    def __init__(self):
+@instrument_db_calls
+class UserModel(BaseUserModel):
+    """Backend MySQL"""
+
+    Error = mysql.connector.Error
+
+    def _connect(self):
         try:
-            self.connection = mysql.connector.connect(**DATABASE_CONFIG)
-            self.cursor = self.connection.cursor()
+            connection = mysql.connector.connect(**DATABASE_CONFIG)
             logger.info("Database connection established")
+            return connection, connection.cursor()
         except mysql.connector.Error as err:
             logger.error(f"Database connection failed: {err}")
             raise
 
-    def get_user_id(self, email):
-        try:
-            query = "SELECT id FROM users WHERE email = %s"
-            self.cursor.execute(query, (email,))
-            result = self.cursor.fetchone()
-            return result[0] if result else None
-        except mysql.connector.Error as err:
-            logger.error(f"Error getting user_id: {err}")
-            return None
-
-    def get_display_name(self, user_id):
-        try:
-            query = "SELECT display_name FROM users WHERE id = %s"
-            self.cursor.execute(query, (user_id,))
-            result = self.cursor.fetchone()
-            return result[0] if result else "Unknown"
-        except mysql.connector.Error as err:
-            logger.error(f"Error getting display_name: {err}")
-            return "Unknown"
-
-    def get_avatar(self, user_id):
-        try:
-            query = "SELECT avatar_data FROM users WHERE id = %s"
-            self.cursor.execute(query, (user_id,))
-            result = self.cursor.fetchone()
-            return result[0] if result and result[0] else None
-        except mysql.connector.Error as err:
-            logger.error(f"Error getting avatar: {err}")
-            return None
-
-    def get_all_users(self):
-        try:
-            query = "SELECT id, display_name, avatar_data FROM users"
-            self.cursor.execute(query)
-            return [
-                {"user_id": row[0], "display_name": row[1], "avatar": row[2]}
-                for row in self.cursor.fetchall()
-            ]
-        except mysql.connector.Error as err:
-            logger.error(f"Error getting all users: {err}")
-            return []
-
-    def register_user(self, display_name, email, password):
-        try:
-            query = "SELECT email FROM users WHERE email = %s"
-            self.cursor.execute(query, (email,))
-            if self.cursor.fetchone():
-                return {"status": "error", "message": "Email đã tồn tại"}
-
-            salt = bcrypt.gensalt()
-            password_hash = bcrypt.hashpw(password.encode('utf-8'), salt)
-
-            query = "INSERT INTO users (display_name, email, password_hash) VALUES (%s, %s, %s)"
-            self.cursor.execute(query, (display_name, email, password_hash.decode('utf-8')))
-            self.connection.commit()
-
-            logger.info(f"User registered: {email}")
-            return {"status": "success", "message": "Đăng ký thành công"}
-        except mysql.connector.Error as err:
-            logger.error(f"Database error during registration: {err}")
-            return {"status": "error", "message": f"Lỗi database: {err}"}
-        except Exception as e:
-            logger.error(f"Unexpected error during registration: {e}")
-            return {"status": "error", "message": f"Lỗi: {str(e)}"}
-
-    def login_user(self, email, password):
-        try:
-            query = "SELECT id, display_name, password_hash, avatar_data FROM users WHERE email = %s"
-            self.cursor.execute(query, (email,))
-            result = self.cursor.fetchone()
-
-            if result:
-                user_id, display_name, password_hash, avatar_data = result
-                try:
-                    if bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8')):
-                        logger.info(f"User logged in: {email}")
-                        return {"status": "success", "user_id": user_id, "display_name": display_name, "avatar": avatar_data}
-                    else:
-                        return {"status": "error", "message": "Mật khẩu sai"}
-                except ValueError as e:
-                    logger.error(f"Password hash error: {e}")
-                    return {"status": "error", "message": f"Lỗi mã hóa (Invalid salt): {str(e)}. Vui lòng đăng ký lại."}
-            else:
-                return {"status": "error", "message": "Tài khoản không tồn tại"}
-        except mysql.connector.Error as err:
-            logger.error(f"Database error during login: {err}")
-            return {"status": "error", "message": f"Lỗi database: {err}"}
-
-    def save_message(self, sender_id, receiver_id, message):
-        try:
-            query = "INSERT INTO chat_messages (sender_id, receiver_id, message, is_image) VALUES (%s, %s, %s, %s)"
-            self.cursor.execute(query, (sender_id, receiver_id, message, False))
+    def _ensure_tables(self):
+        """Tạo các bảng nếu chưa có"""
+        try:
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS users (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    display_name VARCHAR(100) NOT NULL,
+                    email VARCHAR(255) NOT NULL UNIQUE,
+                    password_hash VARCHAR(255) NOT NULL,
+                    avatar_data LONGTEXT
+                )
+            """)
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS chat_messages (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    sender_id INT NOT NULL,
+                    receiver_id INT NOT NULL,
+                    message TEXT,
+                    is_image BOOLEAN DEFAULT FALSE,
+                    image_data LONGTEXT,
+                    is_voice BOOLEAN DEFAULT FALSE,
+                    voice_data LONGTEXT,
+                    is_video BOOLEAN DEFAULT FALSE,
+                    video_data LONGTEXT,
+                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS chat_groups (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    name VARCHAR(100) NOT NULL,
+                    created_by INT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS chat_group_members (
+                    group_id INT NOT NULL,
+                    user_id INT NOT NULL,
+                    joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (group_id, user_id),
+                    INDEX idx_group_members_user (user_id)
+                )
+            """)
+            # Tin nhắn nhóm lưu 1 lần cho cả nhóm, không nhân bản theo người nhận
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS group_messages (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    group_id INT NOT NULL,
+                    sender_id INT NOT NULL,
+                    message TEXT,
+                    is_image BOOLEAN DEFAULT FALSE,
+                    image_data LONGTEXT,
+                    is_voice BOOLEAN DEFAULT FALSE,
+                    voice_data LONGTEXT,
+                    is_video BOOLEAN DEFAULT FALSE,
+                    video_data LONGTEXT,
+                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    INDEX idx_group_messages_group (group_id, id)
+                )
+            """)
+            # Mỗi user x hội thoại: tin cuối đã đọc + số tin chưa đọc (cập nhật dần, không đếm lại)
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS conversation_reads (
+                    user_id INT NOT NULL,
+                    conv_type VARCHAR(5) NOT NULL,
+                    conv_id INT NOT NULL,
+                    last_read_id INT NOT NULL DEFAULT 0,
+                    unread_count INT NOT NULL DEFAULT 0,
+                    PRIMARY KEY (user_id, conv_type, conv_id),
+                    INDEX idx_conversation_reads_conv (conv_type, conv_id)
+                )
+            """)
             self.connection.commit()
-            logger.debug(f"Message saved: {sender_id} -> {receiver_id}")
         except mysql.connector.Error as err:
-            logger.error(f"Error saving message: {err}")
+            logger.error(f"Error creating tables: {err}")
 
-    def save_image_message(self, sender_id, receiver_id, image_data, filename):
-        """Lưu tin nhắn ảnh vào database"""
         try:
-            query = """
-                    INSERT INTO chat_messages (sender_id, receiver_id, message, is_image, image_data)
-                    VALUES (%s, %s, %s, %s, %s) \
-                    """
-            self.cursor.execute(query, (sender_id, receiver_id, filename, True, image_data))
+            # Index cho truy vấn theo cặp người gửi/nhận (lịch sử, tin mới nhất)
+            self.cursor.execute(
+                "CREATE INDEX idx_chat_messages_pair ON chat_messages (sender_id, receiver_id, id)"
+            )
             self.connection.commit()
-            logger.debug(f"Image message saved: {sender_id} -> {receiver_id}")
-        except mysql.connector.Error as err:
-            logger.error(f"Error saving image message: {err}")
+        except mysql.connector.Error:
+            pass  # Index đã tồn tại
 
-    def save_voice_message(self, sender_id, receiver_id, voice_data, filename):
-        """Lưu tin nhắn voice vào database"""
         try:
-            query = """
-                    INSERT INTO chat_messages (sender_id, receiver_id, message, is_voice, voice_data)
-                    VALUES (%s, %s, %s, %s, %s)
-                    """
-            self.cursor.execute(query, (sender_id, receiver_id, filename, True, voice_data))
+            # Index cho resume: tin gửi tới user sau 1 id (bắt kịp tin bị lỡ)
+            self.cursor.execute(
+                "CREATE INDEX idx_chat_messages_receiver ON chat_messages (receiver_id, id)"
+            )
             self.connection.commit()
-            logger.debug(f"Voice message saved: {sender_id} -> {receiver_id}")
-        except mysql.connector.Error as err:
-            logger.error(f"Error saving voice message: {err}")
-
-    def save_video_message(self, sender_id, receiver_id, video_data, filename):
-        """Lưu tin nhắn video vào database"""
-        try:
-            query = """
-                    INSERT INTO chat_messages (sender_id, receiver_id, message, is_video, video_data)
-                    VALUES (%s, %s, %s, %s, %s)
-                    """
-            self.cursor.execute(query, (sender_id, receiver_id, filename, True, video_data))
-            self.connection.commit()
-            logger.debug(f"Video message saved: {sender_id} -> {receiver_id}")
-        except mysql.connector.Error as err:
-            logger.error(f"Error saving video message: {err}")
-
-
-    def get_chat_history(self, sender_id, receiver_id):
-        try:
-            query = """
-                    SELECT sender_id, message, timestamp, is_image, image_data, is_voice, voice_data, is_video, video_data
-                    FROM chat_messages
-                    WHERE (sender_id = %s AND receiver_id = %s)
-                       OR (sender_id = %s AND receiver_id = %s)
-                    ORDER BY timestamp ASC
-                    """
-            self.cursor.execute(query, (sender_id, receiver_id, receiver_id, sender_id))
-
-            history = []
-            for row in self.cursor.fetchall():
-                msg = {
-                    "sender_id": row[0],
-                    "sender_name": self.get_display_name(row[0]),
-                    "sender_avatar": self.get_avatar(row[0]),
-                    "timestamp": str(row[2]),
-                    "is_image": bool(row[3]) if row[3] is not None else False,
-                    "is_voice": bool(row[5]) if row[5] is not None else False,
-                    "is_video": bool(row[7]) if len(row) > 7 and row[7] is not None else False
-                }
-
-                if msg["is_image"]:
-                    msg["image_data"] = row[4]
-                    msg["message"] = row[1]  # filename
-                elif msg["is_voice"]:
-                    msg["voice_data"] = row[6]
-                    msg["message"] = row[1]  # filename
-                elif msg["is_video"]:
-                    msg["video_data"] = row[8] if len(row) > 8 else None
-                    msg["message"] = row[1]  # filename
-                else:
-                    msg["message"] = row[1]
-
-                history.append(msg)
-
-            return history
-        except mysql.connector.Error as err:
-            logger.error(f"Error getting chat history: {err}")
-            return []
-
-    def get_recent_chats(self, user_id):
-        try:
-            query = """
-                    SELECT DISTINCT u2.id as user_id, u2.display_name, u2.avatar_data, m.message as last_message
-                    FROM users u2
-                             LEFT JOIN chat_messages m ON (m.sender_id = u2.id AND m.receiver_id = %s)
-                        OR (m.sender_id = %s AND m.receiver_id = u2.id)
-                    WHERE u2.id != %s
-                    ORDER BY m.timestamp DESC
-                        LIMIT 10 \
-                    """
-            self.cursor.execute(query, (user_id, user_id, user_id))
-            return [
-                {
-                    "user_id": row[0],
-                    "display_name": row[1],
-                    "avatar": row[2],
-                    "last_message": row[3] if row[3] else "Chưa có tin nhắn"
-                }
-                for row in self.cursor.fetchall()
-            ]
-        except mysql.connector.Error as err:
-            logger.error(f"Error getting recent chats: {err}")
-            return []
-
-    def get_profile(self, user_id):
-        try:
-            query = "SELECT display_name, email, avatar_data FROM users WHERE id = %s"
-            self.cursor.execute(query, (user_id,))
-            result = self.cursor.fetchone()
-            if not result:
-                return {"status": "error", "message": "Không tìm thấy người dùng"}
-            return {
-                "status": "success",
-                "display_name": result[0],
-                "email": result[1],
-                "avatar": result[2]
-            }
-        except mysql.connector.Error as err:
-            logger.error(f"Error getting profile: {err}")
-            return {"status": "error", "message": f"Lỗi database: {err}"}
-
-    def update_profile(self, user_id, display_name=None, avatar_data=None):
-        try:
-            fields = []
-            values = []
-            if display_name is not None:
-                fields.append("display_name = %s")
-                values.append(display_name)
-            if avatar_data is not None:
-                fields.append("avatar_data = %s")
-                values.append(avatar_data)
-            if not fields:
-                return {"status": "error", "message": "Không có dữ liệu cập nhật"}
-            values.append(user_id)
-            query = f"UPDATE users SET {', '.join(fields)} WHERE id = %s"
-            self.cursor.execute(query, tuple(values))
-            self.connection.commit()
-            return {"status": "success", "message": "Cập nhật thành công"}
-        except mysql.connector.Error as err:
-            logger.error(f"Error updating profile: {err}")
-            return {"status": "error", "message": f"Lỗi database: {err}"}
-
-    def change_password(self, user_id, old_password, new_password):
-        try:
-            # Lấy hash hiện tại
-            self.cursor.execute("SELECT password_hash FROM users WHERE id = %s", (user_id,))
-            row = self.cursor.fetchone()
-            if not row:
-                return {"status": "error", "message": "Không tìm thấy người dùng"}
-            current_hash = row[0]
-            if not bcrypt.checkpw(old_password.encode('utf-8'), current_hash.encode('utf-8')):
-                return {"status": "error", "message": "Mật khẩu hiện tại không đúng"}
-
-            new_hash = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-            self.cursor.execute("UPDATE users SET password_hash = %s WHERE id = %s", (new_hash, user_id))
-            self.connection.commit()
-            return {"status": "success", "message": "Đổi mật khẩu thành công"}
-        except mysql.connector.Error as err:
-            logger.error(f"Error changing password: {err}")
-            return {"status": "error", "message": f"Lỗi database: {err}"}
-
-    def __del__(self):
-        try:
-            if hasattr(self, 'cursor') and self.cursor:
-                self.cursor.close()
-            if hasattr(self, 'connection') and self.connection:
-                self.connection.close()
-            logger.info("Database connection closed")
-        except Exception as e:
-            logger.error(f"Error closing database connection: {e}")
\ No newline at end of file
+        except mysql.connector.Error:
+            pass  # Index đã tồn tại
+
+    def _increment_unread(self, user_id, peer_id):
+        self.cursor.execute(
+            """
+            INSERT INTO conversation_reads (user_id, conv_type, conv_id, unread_count)
+            VALUES (%s, 'user', %s, 1)
+            ON DUPLICATE KEY UPDATE unread_count = unread_count + 1
+            """,
+            (user_id, peer_id)
+        )
+
+    def _save_read_marker(self, user_id, conv_type, conv_id, last_read_id, unread):
+        self.cursor.execute(
+            """
+            INSERT INTO conversation_reads (user_id, conv_type, conv_id, last_read_id, unread_count)
+            VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                unread_count = IF(VALUES(last_read_id) >= last_read_id, VALUES(unread_count), unread_count),
+                last_read_id = GREATEST(last_read_id, VALUES(last_read_id))
+            """,
+            (user_id, conv_type, conv_id, last_read_id, unread)
+        )
@@ -1,11 +1,25 @@
 # server/run_server.py
+import signal
 import sys
+import threading
 sys.path.append("D:/Python_VsCode/DoAnLTM-3-11")  # Thêm đường dẫn gốc của dự án
 
 def main():
     from controllers.auth_controller import ChatController
     server = ChatController()
+
+    def on_stop(signum, frame):
+        # Tắt trong thread thường (không daemon): process chờ drain xong mới thoát
+        threading.Thread(target=server.shutdown).start()
+
+    def on_reload(signum, frame):
+        threading.Thread(target=server.handoff).start()
+
+    signal.signal(signal.SIGINT, on_stop)
+    signal.signal(signal.SIGTERM, on_stop)
+    if hasattr(signal, "SIGHUP"):  # Không có trên Windows
+        signal.signal(signal.SIGHUP, on_reload)
     server.start()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,124 @@
+# server/utils/logging_setup.py
+import atexit
+import logging
+import queue
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from config.config import LOGGING_CONFIG
+from server.utils.metrics import REGISTRY
+
+LOG_DROPPED = REGISTRY.counter(
+    "chat_log_dropped_total", "Số bản ghi log bị bỏ (lấy mẫu, giới hạn tốc độ, hàng đợi đầy)", labels=("reason",)
+)
+
+_listener = None
+_queue_handler = None
+_setup_lock = threading.Lock()
+
+
+def _category(name):
+    return name.rsplit(".", 1)[-1]
+
+
+class CategoryFilter(logging.Filter):
+    """Lấy mẫu DEBUG và giới hạn số bản ghi/giây theo nhóm, chạy ngay trên thread gọi log"""
+
+    def __init__(self, sampling, rate_limits):
+        super().__init__()
+        self.sampling = sampling
+        self.rate_limits = rate_limits
+        self.windows = {}  # nhóm -> [giây hiện tại, số bản ghi trong giây đó]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR:
+            return True
+        category = _category(record.name)
+
+        rate = self.sampling.get(category)
+        if rate is not None and record.levelno <= logging.DEBUG and random.random() >= rate:
+            LOG_DROPPED.inc(1, "sampled")
+            return False
+
+        limit = self.rate_limits.get(category)
+        if limit is not None:
+            second = int(time.monotonic())
+            with self.lock:
+                window = self.windows.get(category)
+                if window is None or window[0] != second:
+                    window = self.windows[category] = [second, 0]
+                window[1] += 1
+                if window[1] > limit:
+                    LOG_DROPPED.inc(1, "rate_limited")
+                    return False
+        return True
+
+
+class LazyQueueHandler(QueueHandler):
+    """Đưa bản ghi vào hàng đợi mà không format; thread ghi file mới ghép chuỗi"""
+
+    def prepare(self, record):
+        # QueueHandler gốc format message ở thread gọi log -> bỏ, giữ msg/args nguyên
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None  # Không giữ traceback (và các frame) trong hàng đợi
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc(1, "queue_full")
+
+
+class _DrainingQueueListener(QueueListener):
+    """Khi dừng mà hàng đợi đầy thì chờ thread nền ghi bớt thay vì ném queue.Full"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+def setup_logging(config=LOGGING_CONFIG):
+    """Cấu hình root logger: handler chỉ đẩy vào hàng đợi, 1 thread nền ghi ra file xoay vòng.
+
+    Gọi nhiều lần vẫn chỉ cấu hình 1 lần.
+    """
+    global _listener, _queue_handler
+    with _setup_lock:
+        if _listener is not None:
+            return _listener
+
+        file_handler = RotatingFileHandler(
+            config["filename"],
+            maxBytes=config["max_bytes"],
+            backupCount=config["backup_count"],
+            encoding="utf-8"
+        )
+        file_handler.setFormatter(logging.Formatter(config["format"]))
+
+        log_queue = queue.Queue(maxsize=config["queue_size"])
+        _queue_handler = LazyQueueHandler(log_queue)
+        _queue_handler.addFilter(CategoryFilter(config["sampling"], config["rate_limits"]))
+
+        root = logging.getLogger()
+        root.setLevel(config["level"])
+        root.addHandler(_queue_handler)
+
+        _listener = _DrainingQueueListener(log_queue, file_handler)
+        _listener.start()
+        REGISTRY.gauge("chat_log_queue_depth", "Số bản ghi log đang chờ ghi", log_queue.qsize)
+        atexit.register(stop_logging)
+        return _listener
+
+
+def stop_logging():
+    """Ghi nốt các bản ghi còn trong hàng đợi rồi dừng thread nền"""
+    global _listener, _queue_handler
+    with _setup_lock:
+        if _listener is not None:
+            logging.getLogger().removeHandler(_queue_handler)
+            _listener.stop()
+            _listener = None
+            _queue_handler = None
@@ -0,0 +1,277 @@
+# server/utils/message_bus.py
+"""Message bus giữa các node chat: publish tới topic, các node đã subscribe nhận callback.
+
+Có 2 bản: InProcessBus (các node chạy chung 1 process) và TcpBus nối tới BusBroker,
+broker tham chiếu chạy riêng bằng:
+    python -m server.utils.message_bus --host 0.0.0.0 --port 5100
+"""
+import argparse
+import json
+import queue
+import random
+import socket
+import struct
+import threading
+import time
+from config.config import CLUSTER_CONFIG
+from server.utils.metrics import REGISTRY
+import logging
+
+logger = logging.getLogger(__name__)
+
+BUS_MESSAGES = REGISTRY.counter(
+    "chat_bus_messages_total", "Số message qua bus theo chiều (published/received/dropped)", labels=("direction",)
+)
+
+
+def _encode(message):
+    data = json.dumps(message).encode('utf-8')
+    return struct.pack('>I', len(data)) + data
+
+
+def _recv_exact(sock, length):
+    data = b''
+    while len(data) < length:
+        chunk = sock.recv(min(length - len(data), 10485760))
+        if not chunk:
+            raise socket.error("Socket connection broken")
+        data += chunk
+    return data
+
+
+def _recv_frame(sock):
+    """Trả về (bytes của frame, message đã parse)"""
+    header = _recv_exact(sock, 4)
+    data = _recv_exact(sock, struct.unpack('>I', header)[0])
+    return header + data, json.loads(data.decode('utf-8'))
+
+
+class MessageBus:
+    """Giao diện chung. Callback chạy trên thread của bus, không phải thread publish."""
+
+    def __init__(self):
+        self.subscribers = {}  # topic -> [callback]
+        self.lock = threading.Lock()
+
+    def subscribe(self, topic, callback):
+        with self.lock:
+            self.subscribers.setdefault(topic, []).append(callback)
+
+    def publish(self, topic, message):
+        """True nếu đã chuyển cho bus (không đảm bảo node đích còn sống)"""
+        raise NotImplementedError
+
+    def _dispatch(self, topic, message):
+        BUS_MESSAGES.inc(1, "received")
+        with self.lock:
+            callbacks = list(self.subscribers.get(topic, ()))
+        for callback in callbacks:
+            try:
+                callback(message)
+            except Exception as e:
+                logger.error(f"Lỗi xử lý message bus ({topic}): {e}")
+
+    def close(self):
+        pass
+
+
+class InProcessBus(MessageBus):
+    """Bus trong RAM: 1 thread phát lại theo thứ tự publish"""
+
+    def __init__(self):
+        super().__init__()
+        self.queue = queue.Queue()
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def publish(self, topic, message):
+        BUS_MESSAGES.inc(1, "published")
+        self.queue.put((topic, message))
+        return True
+
+    def _loop(self):
+        while True:
+            topic, message = self.queue.get()
+            self._dispatch(topic, message)
+
+
+class TcpBus(MessageBus):
+    """Client của BusBroker; mất kết nối thì tự nối lại (backoff có jitter) và subscribe lại"""
+
+    def __init__(self, host=CLUSTER_CONFIG["broker_host"], port=CLUSTER_CONFIG["broker_port"]):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.socket = None
+        self.send_lock = threading.Lock()
+        self.connected = threading.Event()
+        self.running = True
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def _send(self, message):
+        with self.send_lock:
+            if self.socket is None:
+                return False
+            try:
+                self.socket.sendall(_encode(message))
+                return True
+            except OSError as e:
+                logger.error(f"Lỗi gửi tới message broker: {e}")
+                return False
+
+    def subscribe(self, topic, callback):
+        super().subscribe(topic, callback)
+        self._send({"op": "sub", "topic": topic})
+
+    def publish(self, topic, message):
+        if self._send({"op": "pub", "topic": topic, "message": message}):
+            BUS_MESSAGES.inc(1, "published")
+            return True
+        BUS_MESSAGES.inc(1, "dropped")
+        return False
+
+    def _loop(self):
+        attempt = 0
+        while self.running:
+            try:
+                sock = socket.create_connection((self.host, self.port), timeout=10)
+                sock.settimeout(None)
+            except OSError as e:
+                delay = random.uniform(0, min(30, 0.5 * 2 ** attempt))
+                attempt += 1
+                logger.warning("Message broker unreachable (%s), retry in %.1fs", e, delay)
+                time.sleep(delay)
+                continue
+            attempt = 0
+            with self.lock:
+                topics = list(self.subscribers)
+            with self.send_lock:
+                self.socket = sock
+                for topic in topics:
+                    sock.sendall(_encode({"op": "sub", "topic": topic}))
+            self.connected.set()
+            logger.info("Connected to message broker %s:%s", self.host, self.port)
+            try:
+                while self.running:
+                    _, frame = _recv_frame(sock)
+                    self._dispatch(frame["topic"], frame["message"])
+            except (OSError, ValueError) as e:
+                if self.running:
+                    logger.error(f"Mất kết nối message broker: {e}")
+            self.connected.clear()
+            with self.send_lock:
+                self.socket = None
+            sock.close()
+
+    def close(self):
+        self.running = False
+        with self.send_lock:
+            if self.socket is not None:
+                try:
+                    self.socket.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+class BusBroker:
+    """Broker tham chiếu: mỗi pub được chuyển nguyên frame tới mọi kết nối đã sub topic đó.
+
+    Mỗi node có hàng đợi gửi và thread gửi riêng: thread của node publish chỉ xếp frame vào
+    hàng đợi, 1 node nhận chậm không làm chậm các node khác. Hàng đợi đầy thì bỏ frame của
+    node đó (như publish khi mất kết nối).
+    """
+
+    def __init__(self, host=CLUSTER_CONFIG["broker_host"], port=CLUSTER_CONFIG["broker_port"],
+                 queue_size=CLUSTER_CONFIG["broker_queue_size"]):
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((host, port))
+        self.host, self.port = self.server_socket.getsockname()
+        self.server_socket.listen(socket.SOMAXCONN)
+        self.queue_size = queue_size
+        self.topics = {}  # topic -> set(socket)
+        self.outboxes = {}  # socket -> Queue các frame chờ gửi
+        self.lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def serve_forever(self):
+        logger.info("Message broker listening on %s:%s", self.host, self.port)
+        while True:
+            sock, address = self.server_socket.accept()
+            outbox = queue.Queue(self.queue_size)
+            with self.lock:
+                self.outboxes[sock] = outbox
+            threading.Thread(target=self._write_loop, args=(sock, outbox), daemon=True).start()
+            threading.Thread(target=self._handle, args=(sock, address), daemon=True).start()
+
+    def _write_loop(self, sock, outbox):
+        while True:
+            raw = outbox.get()
+            if raw is None:
+                return
+            try:
+                sock.sendall(raw)
+            except OSError:
+                return  # Thread _handle của node đó sẽ tự dọn khi recv lỗi
+
+    def _handle(self, sock, address):
+        logger.info("Bus node connected: %s", address)
+        try:
+            while True:
+                raw, frame = _recv_frame(sock)
+                if frame.get("op") == "sub":
+                    with self.lock:
+                        self.topics.setdefault(frame["topic"], set()).add(sock)
+                elif frame.get("op") == "pub":
+                    with self.lock:
+                        outboxes = [self.outboxes[s] for s in self.topics.get(frame["topic"], ())]
+                    for outbox in outboxes:
+                        try:
+                            outbox.put_nowait(raw)  # Không encode lại: gửi đúng bytes đã nhận
+                        except queue.Full:
+                            BUS_MESSAGES.inc(1, "dropped")
+                            logger.warning("Bus subscriber queue full, dropping frame (%s)", frame["topic"])
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self.lock:
+                for subscribers in self.topics.values():
+                    subscribers.discard(sock)
+                outbox = self.outboxes.pop(sock, None)
+            sock.close()  # Thread gửi đang kẹt ở sendall (nếu có) thoát vì lỗi socket
+            if outbox is not None:
+                try:
+                    outbox.put_nowait(None)
+                except queue.Full:
+                    pass  # Thread gửi đã dừng vì lỗi socket
+            logger.info("Bus node disconnected: %s", address)
+
+
+_LOCAL_BUS = None
+
+
+def create_bus(kind=None):
+    """Tạo bus theo CLUSTER_CONFIG; "memory" dùng chung 1 bus cho mọi node trong process"""
+    global _LOCAL_BUS
+    kind = kind or CLUSTER_CONFIG["bus"]
+    if kind == "memory":
+        if _LOCAL_BUS is None:
+            _LOCAL_BUS = InProcessBus()
+        return _LOCAL_BUS
+    if kind == "tcp":
+        return TcpBus()
+    raise ValueError(f"Loại message bus không hỗ trợ: {kind}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Message broker tham chiếu cho cụm server chat")
+    parser.add_argument("--host", default=CLUSTER_CONFIG["broker_host"])
+    parser.add_argument("--port", type=int, default=CLUSTER_CONFIG["broker_port"])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    BusBroker(args.host, args.port).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+# server/utils/metrics.py
+import bisect
+import functools
+import inspect
+import threading
+import time
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Bucket (giây) cho độ trễ: từ 0.5ms tới 10s
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.values = {}  # tuple(label values) -> float
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, *label_values):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def get(self, *label_values):
+        return self.values.get(label_values, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+    def snapshot(self):
+        with self.lock:
+            return {",".join(map(str, k)) or "total": v for k, v in self.values.items()}
+
+
+class Gauge:
+    """Giá trị tức thời; có thể set trực tiếp hoặc tính khi scrape qua callback"""
+
+    def __init__(self, name, help_text, callback=None):
+        self.name = name
+        self.help = help_text
+        self.callback = callback
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self.lock:
+            self.value -= amount
+
+    def get(self):
+        if self.callback is not None:
+            try:
+                return self.callback()
+            except Exception as e:
+                logger.error(f"Gauge {self.name} callback failed: {e}")
+                return 0
+        return self.value
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.get()}"]
+
+    def snapshot(self):
+        return self.get()
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}  # tuple(label values) -> [counts theo bucket..., +Inf], sum, count
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, *label_values):
+        """Dùng với `with`: đo thời gian khối lệnh"""
+        return _Timer(self, label_values)
+
+    def quantile(self, q, *label_values):
+        """Ước lượng phân vị từ bucket (cận trên của bucket chứa phân vị)"""
+        with self.lock:
+            series = self.series.get(label_values)
+            if not series or not series[2]:
+                return 0.0
+            counts, total = list(series[0]), series[2]
+        rank = q * total
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float("inf")
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = sorted((k, [list(v[0]), v[1], v[2]]) for k, v in self.series.items())
+        for label_values, (counts, total_sum, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, ('le', le))} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {total_sum}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+    def snapshot(self):
+        with self.lock:
+            keys = list(self.series)
+        result = {}
+        for key in keys:
+            with self.lock:
+                _, total_sum, count = self.series[key]
+            result[",".join(map(str, key)) or "total"] = {
+                "count": count,
+                "avg_ms": round(total_sum / count * 1000, 3) if count else 0.0,
+                "p50_ms": self.quantile(0.5, *key) * 1000,
+                "p99_ms": self.quantile(0.99, *key) * 1000
+            }
+        return result
+
+
+class _Timer:
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+        return False
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = cls(name, *args, **kwargs)
+            return self.metrics[name]
+
+    def counter(self, name, help_text, labels=()):
+        return self._get_or_create(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text, callback=None):
+        gauge = self._get_or_create(Gauge, name, help_text)
+        if callback is not None:
+            gauge.callback = callback
+        return gauge
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help_text, labels, buckets)
+
+    def render_prometheus(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        with self.lock:
+            metrics = list(self.metrics.items())
+        return {name: metric.snapshot() for name, metric in metrics}
+
+
+# Registry dùng chung cho cả server
+REGISTRY = MetricsRegistry()
+
+DB_CALL_SECONDS = REGISTRY.histogram(
+    "chat_db_call_duration_seconds", "Thời gian mỗi lời gọi UserModel", labels=("method",)
+)
+
+
+def _timed_db_call(func, name):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            DB_CALL_SECONDS.observe(time.perf_counter() - start, name)
+    return wrapper
+
+
+def instrument_db_calls(cls):
+    """Bọc mọi method public của model (kể cả kế thừa) để đo thời gian gọi database"""
+    for name in dir(cls):
+        func = getattr(cls, name)
+        if name.startswith("_") or not inspect.isfunction(func):
+            continue
+        setattr(cls, name, _timed_db_call(func, name))
+    return cls
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Không ghi log mỗi lần scrape
+
+
+def start_metrics_server(host, port, registry=REGISTRY):
+    """Mở endpoint HTTP /metrics (định dạng text Prometheus) trong thread riêng"""
+    handler = type("MetricsRequestHandler", (_MetricsRequestHandler,), {"registry": registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Metrics endpoint at http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,101 @@
+# server/utils/password_hasher.py
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+import bcrypt
+from config.config import PASSWORD_CONFIG
+from server.utils.metrics import REGISTRY
+import logging
+
+logger = logging.getLogger(__name__)
+
+HASH_SECONDS = REGISTRY.histogram(
+    "chat_password_hash_seconds", "Thời gian bcrypt trong process worker", labels=("op",)
+)
+HASH_REJECTED = REGISTRY.counter(
+    "chat_password_rejected_total", "Số lần từ chối vì hàng đợi bcrypt đầy", labels=("op",)
+)
+
+
+class HasherBusy(Exception):
+    """Hàng đợi băm mật khẩu đã đầy: trả lỗi ngay thay vì để request xếp hàng"""
+
+
+# Hàm chạy trong process worker: trả về cả thời gian tính để đo riêng phần bcrypt
+def _hashpw(password, rounds):
+    start = time.perf_counter()
+    password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+    return password_hash, time.perf_counter() - start
+
+
+def _checkpw(password, password_hash):
+    start = time.perf_counter()
+    ok = bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+    return ok, time.perf_counter() - start
+
+
+class PasswordHasher:
+    """bcrypt chạy trong process pool giới hạn.
+
+    Tối đa max_pending yêu cầu đang chờ/chạy; vượt quá thì `HasherBusy` ngay lập tức,
+    để cơn bão đăng nhập không chiếm hết thread xử lý của server.
+    """
+
+    def __init__(self, workers=PASSWORD_CONFIG["workers"], max_pending=PASSWORD_CONFIG["max_pending"],
+                 timeout=PASSWORD_CONFIG["timeout"]):
+        self.workers = workers
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.pending = 0
+        self.executor = None
+        self.lock = threading.Lock()
+        REGISTRY.gauge("chat_password_pending", "Số yêu cầu bcrypt đang chờ hoặc đang chạy", lambda: self.pending)
+
+    def _get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                # spawn: không fork cả server đang có nhiều thread và socket
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self.executor
+
+    def _run(self, op, func, *args):
+        if not self.slots.acquire(blocking=False):
+            HASH_REJECTED.inc(1, op)
+            raise HasherBusy()
+        with self.lock:
+            self.pending += 1
+        try:
+            result, seconds = self._get_executor().submit(func, *args).result(self.timeout)
+        except BrokenProcessPool:
+            logger.error("Password hasher pool broken, restarting")
+            with self.lock:
+                self.executor = None
+            raise
+        except FutureTimeout:
+            raise HasherBusy()
+        finally:
+            with self.lock:
+                self.pending -= 1
+            self.slots.release()
+        HASH_SECONDS.observe(seconds, op)
+        return result
+
+    def hash(self, password, rounds):
+        return self._run("hash", _hashpw, password, rounds)
+
+    def check(self, password, password_hash):
+        """ValueError nếu hash lưu trong database không hợp lệ (giống bcrypt.checkpw)"""
+        return self._run("check", _checkpw, password, password_hash)
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
+
+
+HASHER = PasswordHasher()
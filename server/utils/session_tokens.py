@@ -0,0 +1,66 @@
+# server/utils/session_tokens.py
+import base64
+import hashlib
+import hmac
+import os
+import time
+from config.config import SESSION_CONFIG
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def load_or_create_secret(path=SESSION_CONFIG["secret_file"]):
+    """Đọc khóa HMAC từ file; chưa có thì sinh ngẫu nhiên và lưu lại (chỉ chủ sở hữu đọc được)"""
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            secret = f.read().strip()
+        if secret:
+            return secret
+    secret = base64.urlsafe_b64encode(os.urandom(32))
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(secret)
+    logger.info("Created new session secret at %s", path)
+    return secret
+
+
+class SessionTokens:
+    """Token phiên dạng `user_id.hết_hạn.chữ_ký` ký bằng HMAC-SHA256.
+
+    Kiểm tra chỉ cần 1 lần HMAC (micro giây), không cần database hay bcrypt, và vẫn
+    hợp lệ sau khi server khởi động lại vì khóa được lưu ra file.
+    """
+
+    def __init__(self, secret=None, ttl=SESSION_CONFIG["ttl"]):
+        self.secret = secret if secret is not None else load_or_create_secret()
+        self.ttl = ttl
+
+    def _sign(self, payload):
+        digest = hmac.new(self.secret, payload.encode('utf-8'), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).decode('ascii').rstrip("=")
+
+    def issue(self, user_id):
+        """Trả về (token, thời điểm hết hạn dạng unix time)"""
+        expires = int(time.time()) + self.ttl
+        payload = f"{user_id}.{expires}"
+        return f"{payload}.{self._sign(payload)}", expires
+
+    def verify(self, token):
+        """user_id nếu token đúng chữ ký và chưa hết hạn, ngược lại None"""
+        if not isinstance(token, str):
+            return None
+        parts = token.split(".")
+        if len(parts) != 3:
+            return None
+        user_id, expires, signature = parts
+        try:
+            # So sánh bytes: compare_digest với str chứa ký tự không phải ASCII sẽ ném TypeError
+            expected = self._sign(f"{user_id}.{expires}").encode('ascii')
+            if not hmac.compare_digest(signature.encode('utf-8'), expected):
+                return None
+            if int(expires) < time.time():
+                return None
+            return int(user_id)
+        except ValueError:  # Gồm cả UnicodeEncodeError (surrogate lẻ từ JSON \ud800)
+            return None
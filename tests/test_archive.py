@@ -0,0 +1,71 @@
+# tests/test_archive.py
+import pytest
+from server.models.archive import MessageArchive
+from server.models.storage import create_model
+
+
+def make_row(message_id, sender_id=1, receiver_id=2):
+    # Cùng thứ tự cột với truy vấn lịch sử: ..., id (cột 9), receiver_id
+    return [sender_id, f"tin {message_id}", "2020-01-01 00:00:00", 0, None, 0, None, 0, None, message_id, receiver_id]
+
+
+@pytest.fixture
+def model(tmp_path):
+    model = create_model("sqlite", path=":memory:", bcrypt_rounds=4, archive=MessageArchive(str(tmp_path)))
+    model.register_user("A", "a@example.com", "matkhau123")
+    model.register_user("B", "b@example.com", "matkhau123")
+    yield model
+    model.close()
+
+
+def test_read_pages_backwards_across_segments(tmp_path):
+    archive = MessageArchive(str(tmp_path))
+    archive.write_segment((1, 2), [make_row(i) for i in range(1, 6)])
+    archive.write_segment((1, 2), [make_row(i) for i in range(6, 11)])
+    assert [r[9] for r in archive.read((1, 2), before_id=8, limit=4)] == [4, 5, 6, 7]
+    assert [r[9] for r in archive.read((1, 2), limit=3)] == [8, 9, 10]
+    assert [r[9] for r in archive.read((1, 2), after_id=7)] == [8, 9, 10]
+    assert archive.read((1, 3)) == []
+
+
+def test_read_skips_rows_written_twice(tmp_path):
+    archive = MessageArchive(str(tmp_path))
+    archive.write_segment((1, 2), [make_row(i) for i in range(1, 6)])
+    archive.write_segment((1, 2), [make_row(i) for i in range(4, 9)])  # Job chạy lại sau sự cố
+    assert [r[9] for r in archive.read((1, 2))] == list(range(1, 9))
+
+
+def test_manifest_survives_restart(tmp_path):
+    MessageArchive(str(tmp_path)).write_segment((1, 2), [make_row(i) for i in range(1, 4)])
+    archive = MessageArchive(str(tmp_path))
+    assert archive.has((1, 2))
+    assert [r[9] for r in archive.read((1, 2))] == [1, 2, 3]
+
+
+def test_history_pages_across_hot_cold_boundary(model):
+    ids = [model.save_message(1 if i % 2 else 2, 2 if i % 2 else 1, f"tin {i}") for i in range(30)]
+    # 18 tin cũ nhất sang kho lạnh, 2 segment
+    assert model.archive_messages("9999-12-31 00:00:00", 9) == 9
+    assert model.archive_messages("9999-12-31 00:00:00", 9) == 9
+
+    pages = []
+    before_id = None
+    while True:
+        page = model.get_chat_history(1, 2, before_id=before_id, limit=7)
+        if not page:
+            break
+        pages.append([msg["id"] for msg in page])
+        before_id = page[0]["id"]
+    assert [len(page) for page in pages] == [7, 7, 7, 7, 2]
+    assert pages[1] == ids[16:23]  # Trang ghép 2 tin lạnh với 5 tin nóng
+    assert [i for page in reversed(pages) for i in page] == ids
+
+
+def test_full_history_and_after_id_include_cold_rows(model):
+    ids = [model.save_message(1, 2, f"tin {i}") for i in range(10)]
+    model.archive_messages("9999-12-31 00:00:00", 6)
+    history = model.get_chat_history(2, 1)
+    assert [msg["id"] for msg in history] == ids
+    assert history[0]["message"] == "tin 0"
+    assert history[0]["sender_name"] == "A"
+    assert [msg["id"] for msg in model.get_chat_history(1, 2, after_id=ids[3])] == ids[4:]
@@ -0,0 +1,28 @@
+# tests/test_media_cache.py
+import base64
+import os
+from client.controllers.media_cache import MediaCache, media_key
+
+
+def encode(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def test_startup_keeps_foreign_files(tmp_path):
+    (tmp_path / "notes.txt").write_text("không phải file của cache")
+    cache = MediaCache(str(tmp_path), max_bytes=1)
+    cache.path(encode(b"abc"), ".png")
+    cache.path(encode(b"defg"), ".png")  # Vượt giới hạn -> xóa file cũ, không đụng file lạ
+    assert (tmp_path / "notes.txt").exists()
+    assert not (tmp_path / (media_key(encode(b"abc")) + ".png")).exists()
+
+
+def test_unindexed_cache_files_are_adopted_not_deleted(tmp_path):
+    # Client khác cùng thư mục ghi file nhưng chỉ mục của nó không phải chỉ mục ta đọc
+    other = MediaCache(str(tmp_path))
+    path = other.path(encode(b"voice"), ".wav")
+    os.remove(tmp_path / "index.json")
+
+    cache = MediaCache(str(tmp_path))
+    assert cache.path(encode(b"voice"), ".wav") == path
+    assert cache.total == len(b"voice")
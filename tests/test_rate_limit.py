@@ -0,0 +1,106 @@
+# tests/test_rate_limit.py
+import pytest
+from server.controllers import action_router
+from server.controllers.action_router import ActionRouter, RequestContext, rate_limit
+
+
+class FakeConnection:
+    def __init__(self, address):
+        self.address = address
+
+
+class FakeController:
+    def __init__(self):
+        self.clients = {}      # socket -> user_id
+        self.connections = {}  # socket -> FakeConnection
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(action_router.time, "monotonic", clock)
+    return clock
+
+
+def make_router(**options):
+    router = ActionRouter()
+    router.register("ping", lambda ctx: {"status": "success"}, [rate_limit(**options)])
+    return router
+
+
+def connect(controller, ip, user_id=None):
+    sock = object()
+    controller.connections[sock] = FakeConnection((ip, 50000))
+    if user_id is not None:
+        controller.clients[sock] = user_id
+    return sock
+
+
+def call(router, controller, sock):
+    return router.dispatch(RequestContext(controller, sock, {"action": "ping"}, 10))
+
+
+def test_burst_then_refill(clock):
+    router, controller = make_router(rate=2, burst=3), FakeController()
+    sock = connect(controller, "10.0.0.1", user_id=1)
+    assert [call(router, controller, sock)["status"] for _ in range(4)] == ["success"] * 3 + ["error"]
+    response = call(router, controller, sock)
+    assert response["retry_after"] == 0.5
+    clock.now += 0.5
+    assert call(router, controller, sock)["status"] == "success"
+    assert call(router, controller, sock)["status"] == "error"
+
+
+def test_buckets_are_per_user(clock):
+    router, controller = make_router(rate=1, burst=1), FakeController()
+    first = connect(controller, "10.0.0.1", user_id=1)
+    second = connect(controller, "10.0.0.1", user_id=2)
+    assert call(router, controller, first)["status"] == "success"
+    assert call(router, controller, first)["status"] == "error"
+    assert call(router, controller, second)["status"] == "success"
+
+
+def test_same_user_shares_bucket_across_connections(clock):
+    router, controller = make_router(rate=1, burst=1), FakeController()
+    assert call(router, controller, connect(controller, "10.0.0.1", user_id=1))["status"] == "success"
+    assert call(router, controller, connect(controller, "10.0.0.2", user_id=1))["status"] == "error"
+
+
+def test_anonymous_connections_share_bucket_by_ip(clock):
+    router, controller = make_router(rate=1, burst=2), FakeController()
+    # Mở kết nối mới không được thêm lượt thử mật khẩu
+    statuses = [call(router, controller, connect(controller, "10.0.0.1"))["status"] for _ in range(3)]
+    assert statuses == ["success", "success", "error"]
+    assert call(router, controller, connect(controller, "10.0.0.2"))["status"] == "success"
+
+
+def test_per_connection_ips(clock):
+    router, controller = make_router(rate=1, burst=1, per_connection_ips=["127.0.0.1"]), FakeController()
+    first, second = connect(controller, "127.0.0.1"), connect(controller, "127.0.0.1")
+    assert call(router, controller, first)["status"] == "success"
+    assert call(router, controller, first)["status"] == "error"
+    assert call(router, controller, second)["status"] == "success"
+
+
+def test_shared_bucket(clock):
+    router, controller = make_router(rate=1, burst=1, shared=True), FakeController()
+    assert call(router, controller, connect(controller, "10.0.0.1", user_id=1))["status"] == "success"
+    assert call(router, controller, connect(controller, "10.0.0.2", user_id=2))["status"] == "error"
+
+
+def test_rejected_request_does_not_reach_handler(clock):
+    calls = []
+    router, controller = ActionRouter(), FakeController()
+    router.register("ping", lambda ctx: calls.append(ctx) or {"status": "success"}, [rate_limit(rate=1, burst=1)])
+    sock = connect(controller, "10.0.0.1", user_id=1)
+    call(router, controller, sock)
+    call(router, controller, sock)
+    assert len(calls) == 1
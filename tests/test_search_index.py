@@ -0,0 +1,77 @@
+# tests/test_search_index.py
+from server.controllers.search_controller import MessageSearchIndex, direct_key, group_key
+
+
+def make_index():
+    index = MessageSearchIndex()
+    index.add_direct(1, 1, 2, "hẹn gặp ở quán cà phê")
+    index.add_direct(2, 2, 1, "cà phê cà phê cà phê")
+    index.add_direct(3, 1, 3, "cà phê sáng mai nhé")
+    index.add_group(4, 10, 3, "nhóm uống cà phê")
+    index.add_direct(5, 2, 1, "tin không liên quan")
+    return index
+
+
+def test_ranks_by_term_frequency():
+    index = make_index()
+    total, results = index.search(1, "cà phê", [direct_key(1, 2)])
+    assert total == 2
+    assert [r["message_id"] for r in results] == [2, 1]
+    assert results[0]["score"] > results[1]["score"]
+
+
+def test_equal_scores_newest_first():
+    index = MessageSearchIndex()
+    for message_id in (7, 3, 9):
+        index.add_direct(message_id, 1, 2, "chào bạn")
+    _, results = index.search(1, "chào", [direct_key(1, 2)])
+    assert [r["message_id"] for r in results] == [9, 7, 3]
+
+
+def test_requires_every_term():
+    index = make_index()
+    total, results = index.search(1, "cà phê quán", [direct_key(1, 2)])
+    assert total == 1
+    assert results[0]["message_id"] == 1
+
+
+def test_ignores_accents_and_case():
+    index = make_index()
+    total, _ = index.search(1, "CA PHE", [direct_key(1, 2)])
+    assert total == 2
+
+
+def test_only_searches_given_conversations():
+    index = make_index()
+    # User 2 không ở hội thoại 1-3 và nhóm 10
+    conv_keys = index.direct_conversations(2)
+    assert set(conv_keys) == {direct_key(1, 2)}
+    _, results = index.search(2, "cà phê", conv_keys)
+    assert {r["message_id"] for r in results} == {1, 2}
+
+
+def test_results_name_the_conversation():
+    index = make_index()
+    _, results = index.search(3, "sáng", [direct_key(1, 3)])
+    assert results[0]["peer_id"] == 1
+    _, results = index.search(3, "nhóm", [group_key(10)])
+    assert results[0]["group_id"] == 10 and "peer_id" not in results[0]
+
+
+def test_paging():
+    index = MessageSearchIndex()
+    for message_id in range(1, 26):
+        index.add_group(message_id, 10, 1, "báo cáo tuần")
+    total, first = index.search(1, "báo cáo", [group_key(10)], offset=0, limit=10)
+    _, last = index.search(1, "báo cáo", [group_key(10)], offset=20, limit=10)
+    assert total == 25
+    assert [r["message_id"] for r in first] == list(range(25, 15, -1))
+    assert [r["message_id"] for r in last] == list(range(5, 0, -1))
+
+
+def test_duplicate_add_is_ignored():
+    index = MessageSearchIndex()
+    index.add_direct(1, 1, 2, "xin chào")
+    index.add_direct(1, 1, 2, "xin chào")
+    assert index.doc_freq["chao"] == 1
+    assert index.search(1, "chào", [direct_key(1, 2)])[0] == 1
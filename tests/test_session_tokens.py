@@ -0,0 +1,49 @@
+# tests/test_session_tokens.py
+import time
+from server.utils.session_tokens import SessionTokens, load_or_create_secret
+
+SECRET = b"khoa-thu-nghiem"
+
+
+def test_issued_token_verifies():
+    tokens = SessionTokens(SECRET, ttl=60)
+    token, expires = tokens.issue(42)
+    assert tokens.verify(token) == 42
+    assert expires > time.time()
+
+
+def test_tampered_token_is_rejected():
+    tokens = SessionTokens(SECRET, ttl=60)
+    token, _ = tokens.issue(42)
+    user_id, expires, signature = token.split(".")
+    assert tokens.verify(f"43.{expires}.{signature}") is None
+    assert tokens.verify(f"{user_id}.{int(expires) + 3600}.{signature}") is None
+    flipped = ("A" if signature[0] != "A" else "B") + signature[1:]
+    assert tokens.verify(f"{user_id}.{expires}.{flipped}") is None
+    assert SessionTokens(b"khoa-khac", ttl=60).verify(token) is None
+
+
+def test_expired_token_is_rejected():
+    tokens = SessionTokens(SECRET, ttl=-1)
+    token, _ = tokens.issue(42)
+    assert tokens.verify(token) is None
+
+
+def test_malformed_tokens_are_rejected():
+    tokens = SessionTokens(SECRET, ttl=60)
+    token, _ = tokens.issue(42)
+    user_id, expires, signature = token.split(".")
+    for bad in (None, 42, "", "a.b", token + ".x", f"{user_id}.{expires}.chữký",
+                f"{user_id}.{expires}.\ud800", f"abc.{expires}.{signature}"):
+        assert tokens.verify(bad) is None
+    # Chữ ký đúng nhưng user_id không phải số
+    payload = f"abc.{expires}"
+    assert tokens.verify(f"{payload}.{tokens._sign(payload)}") is None
+
+
+def test_secret_is_persisted(tmp_path):
+    path = str(tmp_path / "session.key")
+    secret = load_or_create_secret(path)
+    assert load_or_create_secret(path) == secret
+    token, _ = SessionTokens(secret, ttl=60).issue(7)
+    assert SessionTokens(load_or_create_secret(path), ttl=60).verify(token) == 7
@@ -0,0 +1,130 @@
+# tests/test_voice_room.py
+import math
+import socket
+import struct
+import time
+from array import array
+import pytest
+from client.controllers.voice_room_client import (
+    VoiceRoomClient, JitterBuffer, CODEC_PCM16, ulaw_decode, ulaw_encode
+)
+
+GROUP = "239.255.42.99"
+INTERFACE = "127.0.0.1"
+
+
+def free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("", 0))
+        return sock.getsockname()[1]
+
+
+def tone(frame_samples, index, frequency=440, sample_rate=8000):
+    """1 frame sóng sin, mỗi frame lệch pha để phân biệt"""
+    start = index * frame_samples
+    return array('h', [
+        int(8000 * math.sin(2 * math.pi * frequency * (start + i) / sample_rate)) for i in range(frame_samples)
+    ]).tobytes()
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+@pytest.fixture
+def port():
+    """Port trống; bỏ qua nếu máy chạy test không có multicast qua loopback"""
+    port = free_udp_port()
+    try:
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        receiver.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        receiver.bind(("", port))
+        receiver.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                            struct.pack('4s4s', socket.inet_aton(GROUP), socket.inet_aton(INTERFACE)))
+        receiver.settimeout(1)
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sender.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(INTERFACE))
+        sender.sendto(b"probe", (GROUP, port))
+        receiver.recvfrom(16)
+    except OSError as e:
+        pytest.skip(f"Không có multicast qua loopback: {e}")
+    finally:
+        receiver.close()
+        sender.close()
+    return port
+
+
+def make_pair(port, **options):
+    speaker = VoiceRoomClient(1, GROUP, port, interface=INTERFACE, **options)
+    listener = VoiceRoomClient(2, GROUP, port, interface=INTERFACE, **options)
+    listener.start()
+    return speaker, listener
+
+
+def received(listener, sender_id):
+    buffer = listener.buffers.get(sender_id)
+    return buffer.stats["received"] if buffer else 0
+
+
+def test_ulaw_frames_round_trip_through_jitter_buffer(port):
+    speaker, listener = make_pair(port)
+    try:
+        frames = [tone(speaker.frame_samples, i) for i in range(6)]
+        for frame in frames:
+            speaker.send_frame(frame)
+        assert wait_for(lambda: received(listener, 1) == len(frames))
+
+        played = [listener.read_mixed_frame() for _ in frames]
+        # mu-law mất chính xác: so với đúng bản đã qua encode/decode
+        assert played == [ulaw_decode(ulaw_encode(frame)) for frame in frames]
+        assert all(len(frame) == speaker.frame_bytes for frame in played)
+        # Hết gói: im lặng, không phải lặp lại frame cuối
+        assert listener.read_mixed_frame() == b'\x00' * listener.frame_bytes
+        assert listener.buffers[1].stats["lost"] == 0
+    finally:
+        speaker.stop()
+        listener.stop()
+
+
+def test_pcm_frames_round_trip_exactly(port):
+    speaker, listener = make_pair(port, codec=CODEC_PCM16)
+    try:
+        frames = [tone(speaker.frame_samples, i) for i in range(4)]
+        for frame in frames:
+            speaker.send_frame(frame)
+        assert wait_for(lambda: received(listener, 1) == len(frames))
+        assert [listener.read_mixed_frame() for _ in frames] == frames
+    finally:
+        speaker.stop()
+        listener.stop()
+
+
+def test_own_packets_are_ignored(port):
+    speaker, listener = make_pair(port)
+    speaker.start()
+    try:
+        speaker.send_frame(tone(speaker.frame_samples, 0))
+        assert wait_for(lambda: received(listener, 1) == 1)
+        assert 1 not in speaker.buffers
+    finally:
+        speaker.stop()
+        listener.stop()
+
+
+def test_jitter_buffer_reorders_and_conceals():
+    buffer = JitterBuffer(frame_bytes=4, depth=3, max_conceal=2)
+    frames = {seq: array('h', [1000 * (seq + 1)] * 2).tobytes() for seq in range(6)}
+    for seq in (0, 2, 1, 4, 5):  # Gói 3 mất, 1 và 2 đến đảo thứ tự
+        buffer.put(seq, frames[seq])
+    assert [buffer.pop() for _ in range(3)] == [frames[0], frames[1], frames[2]]
+    concealed = array('h', buffer.pop())
+    assert 0 < concealed[0] < 3000  # Lặp frame 2, nhỏ dần
+    assert buffer.pop() == frames[4]
+    buffer.put(3, frames[3])  # Đến muộn: bỏ
+    assert buffer.pop() == frames[5]
+    assert buffer.stats["late"] == 1 and buffer.stats["lost"] == 1
@@ -0,0 +1,185 @@
+# tools/benchmarks.py
+"""Micro-benchmark cho đường đi của mỗi frame: framing, JSON, base64.
+
+Baseline phụ thuộc máy nên không nằm trong repo: lần chạy đầu trên mỗi máy ghi kết quả làm
+baseline cục bộ, các lần sau so với nó.
+
+Ví dụ:
+    python tools/benchmarks.py                      # Chạy và so với baseline cục bộ (chưa có thì tạo)
+    python tools/benchmarks.py --save-baseline      # Ghi kết quả hiện tại làm baseline
+    python tools/benchmarks.py --only base64 --json result.json
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import socket
+import statistics
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from server.controllers.auth_controller import ChatController
+from client.controllers.auth_controller_client import AuthController
+
+BASELINE_FILE = os.path.join(ROOT, "tools", "benchmark_baseline.json")  # Riêng từng máy, không commit
+
+# Kích thước payload gốc (trước base64) theo loại tin nhắn
+PAYLOAD_SIZES = {
+    "text": 200,
+    "image": 200 * 1024,
+    "voice": 1024 * 1024,
+    "video": 10 * 1024 * 1024
+}
+
+# Dùng method thật nhưng không bind socket / không chạy thread nhận
+SERVER = ChatController.__new__(ChatController)
+CLIENT = AuthController.__new__(AuthController)
+
+
+def measure(func, size, min_time=0.5, min_runs=5):
+    """Chạy func lặp lại ít nhất min_time giây; trả về thống kê theo micro giây"""
+    func()  # Khởi động (cache, cấp phát)
+    timings = []
+    deadline = time.perf_counter() + min_time
+    while len(timings) < min_runs or time.perf_counter() < deadline:
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    median = statistics.median(timings)
+    return {
+        "runs": len(timings),
+        "median_us": round(median * 1e6, 2),
+        "min_us": round(min(timings) * 1e6, 2),
+        "mb_per_s": round(size / median / 1e6, 1) if size else None
+    }
+
+
+def media_payload(kind):
+    return base64.b64encode(os.urandom(PAYLOAD_SIZES[kind])).decode('utf-8')
+
+
+def media_message(kind):
+    if kind == "text":
+        return {"action": "message", "sender_id": 1, "sender_name": "Bench", "message": "x" * PAYLOAD_SIZES["text"]}
+    return {
+        "action": "message",
+        "sender_id": 1,
+        "sender_name": "Bench",
+        "message": f"bench.{kind}",
+        f"is_{kind}": True,
+        f"{kind}_data": media_payload(kind)
+    }
+
+
+def bench_framing():
+    """_send_all (server) -> _recv_all (client) qua socketpair, gồm cả length prefix"""
+    results = {}
+    for kind, size in PAYLOAD_SIZES.items():
+        frame = SERVER.encode_frame(media_message(kind))
+        server_sock, client_sock = socket.socketpair()
+
+        def round_trip():
+            sender = threading.Thread(target=SERVER._send_all, args=(server_sock, frame))
+            sender.start()
+            length = int.from_bytes(CLIENT._recv_all(client_sock, 4), "big")
+            CLIENT._recv_all(client_sock, length)
+            sender.join()
+
+        results[f"framing.socketpair.{kind}"] = measure(round_trip, len(frame))
+        server_sock.close()
+        client_sock.close()
+    return results
+
+
+def bench_json():
+    results = {}
+    for kind in PAYLOAD_SIZES:
+        message = media_message(kind)
+        frame = SERVER.encode_frame(message)
+        body = frame[4:]
+        results[f"json.encode_frame.{kind}"] = measure(lambda: SERVER.encode_frame(message), len(frame))
+        results[f"json.loads.{kind}"] = measure(lambda: json.loads(body.decode('utf-8')), len(body))
+    return results
+
+
+def bench_base64():
+    results = {}
+    for kind, size in PAYLOAD_SIZES.items():
+        if kind == "text":
+            continue
+        raw = os.urandom(size)
+        encoded = base64.b64encode(raw).decode('utf-8')
+        results[f"base64.encode.{kind}"] = measure(lambda: base64.b64encode(raw).decode('utf-8'), size)
+        results[f"base64.decode.{kind}"] = measure(lambda: base64.b64decode(encoded), size)
+    return results
+
+
+SUITES = {
+    "framing": bench_framing,
+    "json": bench_json,
+    "base64": bench_base64
+}
+
+
+def compare(results, baseline, threshold):
+    """Liệt kê benchmark chậm hơn baseline quá threshold (tỉ lệ, vd 0.1 = 10%)"""
+    regressions = {}
+    for name, result in results.items():
+        base = baseline.get("benchmarks", {}).get(name)
+        if not base:
+            continue
+        ratio = result["median_us"] / base["median_us"]
+        result["vs_baseline"] = round(ratio, 3)
+        if ratio > 1 + threshold:
+            regressions[name] = round(ratio, 3)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark framing/JSON/base64")
+    parser.add_argument("--only", choices=sorted(SUITES), action="append", help="Chỉ chạy nhóm này")
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="Ghi kết quả làm baseline mới")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Chậm hơn baseline bao nhiêu thì báo lỗi")
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.only or sorted(SUITES):
+        print(f"Đang chạy {name}...", file=sys.stderr)
+        results.update(SUITES[name]())
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "benchmarks": results
+    }
+
+    regressions = {}
+    if args.save_baseline or not os.path.exists(args.baseline):
+        # Lần đầu trên máy này: chưa có gì để so, kết quả hiện tại thành baseline
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"Đã lưu baseline: {args.baseline}", file=sys.stderr)
+    else:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        report["regressions"] = regressions
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    print(output)
+    if args.json:
+        with open(args.json, "w") as f:
+            f.write(output)
+    if regressions:
+        print(f"Chậm hơn baseline: {', '.join(sorted(regressions))}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
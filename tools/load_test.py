@@ -0,0 +1,253 @@
+# tools/load_test.py
+"""Giả lập nhiều client chat không cần giao diện, đo throughput và độ trễ theo action.
+
+Ví dụ:
+    python tools/load_test.py --local --users 500 --rate 1000 --duration 30
+    python tools/load_test.py --host 10.50.192.2 --port 5001 --users 200 --mix message=80,get_chat_history=20
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.config import SERVER_CONFIG
+from client.controllers.auth_controller_client import AuthController
+
+DEFAULT_MIX = "message=70,send_image=10,send_voice=10,get_chat_history=10"
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(q * len(sorted_values)))
+    return sorted_values[index]
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        action, weight = part.split("=")
+        mix[action.strip()] = float(weight)
+    unknown = set(mix) - set(VirtualUser.ACTIONS)
+    if unknown:
+        raise ValueError(f"Action không hỗ trợ: {', '.join(sorted(unknown))}")
+    return mix
+
+
+class Recorder:
+    """Gom độ trễ (giây) theo action từ mọi virtual user.
+
+    latency tính từ thời điểm request lẽ ra được gửi theo lịch (gồm cả thời gian chờ khi
+    user còn kẹt ở request trước, tránh coordinated omission); service chỉ tính từ lúc
+    thực sự gửi tới khi có phản hồi.
+    """
+
+    def __init__(self):
+        self.latencies = {}
+        self.service_times = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def record(self, action, latency, service, ok):
+        with self.lock:
+            self.latencies.setdefault(action, []).append(latency)
+            self.service_times.setdefault(action, []).append(service)
+            if not ok:
+                self.errors[action] = self.errors.get(action, 0) + 1
+
+    def report(self, elapsed):
+        report = {"elapsed_s": round(elapsed, 2), "actions": {}}
+        total = 0
+        with self.lock:
+            for action, values in sorted(self.latencies.items()):
+                values = sorted(values)
+                service = sorted(self.service_times[action])
+                total += len(values)
+                report["actions"][action] = {
+                    "count": len(values),
+                    "errors": self.errors.get(action, 0),
+                    "throughput": round(len(values) / elapsed, 1),
+                    "p50_ms": round(percentile(values, 0.5) * 1000, 2),
+                    "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+                    "p999_ms": round(percentile(values, 0.999) * 1000, 2),
+                    "max_ms": round(values[-1] * 1000, 2),
+                    "service_p50_ms": round(percentile(service, 0.5) * 1000, 2),
+                    "service_p99_ms": round(percentile(service, 0.99) * 1000, 2)
+                }
+        report["total_throughput"] = round(total / elapsed, 1)
+        return report
+
+
+class VirtualUser:
+    ACTIONS = ("message", "send_image", "send_voice", "get_chat_history")
+
+    def __init__(self, index, args, payloads):
+        self.index = index
+        self.args = args
+        self.payloads = payloads
+        self.email = f"load{args.run_id}_{index}@test.local"
+        self.user_id = None
+        self.peers = []
+        self.received = 0
+        self.controller = AuthController(host=args.host, port=args.port, store_directory=None)
+
+    def _request_with_retry(self, request, attempts=20):
+        # Server bận (bcrypt đầy hàng đợi, rate limit) trả retry_after -> chờ rồi gửi lại
+        for _ in range(attempts):
+            response = self.controller.send_request(request)
+            if "retry_after" not in response:
+                return response
+            time.sleep(response["retry_after"] * random.uniform(1, 2))
+        return response
+
+    def login(self):
+        self._request_with_retry({
+            "action": "register",
+            "display_name": f"Load {self.index}",
+            "email": self.email,
+            "password": "loadtest"
+        })
+        response = self._request_with_retry({"action": "login", "email": self.email, "password": "loadtest"})
+        if response.get("status") != "success":
+            print(f"User {self.index} đăng nhập thất bại: {response.get('message')}")
+            return
+        self.controller.start_session(response)
+        self.user_id = response["user_id"]
+
+    def _drain(self):
+        # Tin người khác gửi tới: chỉ đếm, không giữ lại
+        while not self.controller.message_queue.empty():
+            self.controller.message_queue.get_nowait()
+            self.received += 1
+        while not self.controller.event_queue.empty():
+            self.controller.event_queue.get_nowait()
+
+    def do(self, action):
+        peer = random.choice(self.peers)
+        if action == "message":
+            response = self.controller.send_message(peer, "x" * self.args.text_bytes)
+        elif action == "send_image":
+            response = self.controller.send_image(peer, self.payloads["image"], "load.jpg")
+        elif action == "send_voice":
+            response = self.controller.send_voice(peer, self.payloads["voice"], "load.wav")
+        else:
+            response = self.controller.send_request({"action": "get_chat_history", "receiver_id": peer})
+        return response.get("status") == "success"
+
+    def run(self, recorder, mix, stop_at):
+        actions, weights = zip(*mix.items())
+        interval = self.args.users / self.args.rate  # Khoảng trung bình giữa 2 request của 1 user
+        next_at = time.monotonic() + random.uniform(0, interval)
+        while True:
+            next_at += random.expovariate(1 / interval)  # Poisson: tổng hợp các user ~ rate req/s
+            now = time.monotonic()
+            if next_at > stop_at:
+                break
+            if next_at > now:
+                time.sleep(next_at - now)
+            action = random.choices(actions, weights)[0]
+            sent_at = time.monotonic()
+            try:
+                ok = self.do(action)
+            except Exception:
+                ok = False
+            done_at = time.monotonic()
+            # Tính từ lịch (next_at), không phải lúc gửi: server chậm làm request sau bị trễ lịch,
+            # phần chờ đó cũng là độ trễ người dùng thấy
+            recorder.record(action, done_at - next_at, done_at - sent_at, ok)
+            self._drain()
+
+    def stop(self):
+        self.controller.stop()
+
+
+def start_local_server():
+    """Chạy ChatController trong tiến trình này với SQLite trong RAM, port ngẫu nhiên"""
+    from server.controllers.auth_controller import ChatController
+    from server.models.storage import create_model
+    from config.config import REQUEST_LIMITS_CONFIG
+    # Mọi virtual user đều từ 127.0.0.1: rate limit đăng ký/đăng nhập tính theo kết nối
+    REQUEST_LIMITS_CONFIG["per_connection_ips"] = ["127.0.0.1"]
+    server = ChatController(host="127.0.0.1", port=0, model=create_model(
+        "sqlite", path=":memory:", bcrypt_rounds=4, archive=None
+    ))
+    threading.Thread(target=server.start, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test server chat")
+    parser.add_argument("--host", default=SERVER_CONFIG["host"])
+    parser.add_argument("--port", type=int, default=SERVER_CONFIG["port"])
+    parser.add_argument("--local", action="store_true", help="Tự chạy server local với SQLite trong RAM")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=200, help="Tổng số request/giây")
+    parser.add_argument("--duration", type=float, default=30, help="Số giây chạy")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Tỉ lệ action, vd: message=70,send_image=10")
+    parser.add_argument("--peers", type=int, default=5, help="Số người mỗi user nhắn tới")
+    parser.add_argument("--text-bytes", type=int, default=64)
+    parser.add_argument("--image-bytes", type=int, default=100 * 1024)
+    parser.add_argument("--voice-bytes", type=int, default=32 * 1024)
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+    args.run_id = int(time.time())
+    mix = parse_mix(args.mix)
+
+    if args.local:
+        server = start_local_server()
+        args.host, args.port = server.host, server.port
+
+    payloads = {
+        "image": base64.b64encode(os.urandom(args.image_bytes)).decode('utf-8'),
+        "voice": base64.b64encode(os.urandom(args.voice_bytes)).decode('utf-8')
+    }
+
+    print(f"Kết nối và đăng nhập {args.users} user tới {args.host}:{args.port}...")
+    users = [VirtualUser(i, args, payloads) for i in range(args.users)]
+    login_start = time.perf_counter()
+    threads = [threading.Thread(target=u.login, daemon=True) for u in users]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    users = [u for u in users if u.user_id is not None]
+    print(f"{len(users)} user đăng nhập trong {time.perf_counter() - login_start:.1f}s")
+    if len(users) < 2:
+        sys.exit("Cần ít nhất 2 user đăng nhập thành công")
+
+    user_ids = [u.user_id for u in users]
+    for u in users:
+        others = [uid for uid in user_ids if uid != u.user_id]
+        u.peers = random.sample(others, min(args.peers, len(others)))
+
+    recorder = Recorder()
+    start = time.monotonic()
+    stop_at = start + args.duration
+    threads = [threading.Thread(target=u.run, args=(recorder, mix, stop_at), daemon=True) for u in users]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - start
+
+    report = recorder.report(elapsed)
+    report["users"] = len(users)
+    report["target_rate"] = args.rate
+    report["messages_received"] = sum(u.received for u in users)
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    for u in users:
+        u.stop()
+
+
+if __name__ == "__main__":
+    main()